@@ -0,0 +1,105 @@
+"""Micro-benchmark of the cost of logging on the event loop.
+
+Run from the repository root with the source directory on the path:
+
+    PYTHONPATH=src python bench/bench_logging.py [--records N] [--write-delay S]
+
+Each scenario logs N records at INFO from a single call site, as the hot
+path does for every message, and reports the time spent in the logging
+calls themselves, i.e. the time the event loop would be blocked. The sink
+sleeps for --write-delay seconds per record to stand in for a slow or
+backed-up stderr.
+"""
+
+import argparse
+import io
+import logging
+import time
+
+import log_pipeline
+
+class SlowStream(io.StringIO):
+    """A stream that takes a while to write to."""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, s):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(s)
+
+def make_sink(delay):
+    handler = logging.StreamHandler(SlowStream(delay))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    return handler
+
+def run(logger, records):
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info('Handling message %d from %s', i, 'someone')
+    return time.perf_counter() - start
+
+def scenario(name, records, handler, filters=()):
+    logger = logging.getLogger('bench.' + name.replace(' ', '-'))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    for f in filters:
+        logger.addFilter(f)
+    elapsed = run(logger, records)
+    print(
+        f'{name:>28}: {elapsed * 1e6 / records:8.2f} µs/record on the loop'
+    )
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--write-delay', type=float, default=0.0001)
+    opts = parser.parse_args()
+
+    scenario('synchronous', opts.records, make_sink(opts.write_delay))
+
+    queue_handler, listener = log_pipeline.start_pipeline(
+        make_sink(opts.write_delay),
+        queue_size=opts.records
+    )
+    scenario('queued', opts.records, queue_handler)
+    listener.stop()
+
+    queue_handler, listener = log_pipeline.start_pipeline(
+        make_sink(opts.write_delay),
+        queue_size=opts.records
+    )
+    scenario(
+        'queued, rate-limited',
+        opts.records,
+        queue_handler,
+        filters=(log_pipeline.RateLimitFilter(10, 20),)
+    )
+    listener.stop()
+
+    queue_handler, listener = log_pipeline.start_pipeline(
+        make_sink(opts.write_delay),
+        queue_size=opts.records
+    )
+    scenario(
+        'queued, 10% sampled',
+        opts.records,
+        queue_handler,
+        filters=(log_pipeline.SamplingFilter(0.1),)
+    )
+    listener.stop()
+
+    logger = logging.getLogger('bench.disabled')
+    logger.setLevel(logging.WARNING)
+    elapsed = run(logger, opts.records)
+    print(
+        f'{"below level":>28}: {elapsed * 1e6 / opts.records:8.2f} µs/record'
+        ' on the loop'
+    )
+
+if __name__ == '__main__':
+    main()
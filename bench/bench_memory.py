@@ -0,0 +1,239 @@
+"""Benchmark of the Discord client's memory use with the bot's intents and
+cache options, against discord.py's defaults.
+
+Run from the repository root with the source directory on the path:
+
+    PYTHONPATH=src python bench/bench_memory.py [--guilds N] [--members N]
+
+No network access is needed. Each configuration runs in its own process,
+which feeds a client the gateway events a large set of guilds would send it:
+a GUILD_CREATE per guild, with the members and presences its intents would
+bring, followed by a stream of messages. The growth in resident set size,
+and what the client cached, are reported for each.
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+
+# Configurations to compare, as (name, bot options). discord.py's defaults
+# are used for the configuration without options.
+CONFIGS = (
+    ('discord.py defaults', None),
+    ('members and presences', [
+        '--intents', 'members,presences',
+        '--member-cache', 'intents',
+        '--max-messages', '1000',
+    ]),
+    ('bot minimal', []),
+)
+
+# The fraction of members that are online
+ONLINE = 0.3
+
+def rss():
+    """Get the process's resident set size, in bytes."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current, but close enough where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def user_payload(user_id):
+    return {
+        'id' : str(user_id),
+        'username' : f'user{user_id}',
+        'discriminator' : f'{user_id % 10000:04}',
+        'avatar' : None,
+    }
+
+def member_payload(user_id):
+    return {
+        'user' : user_payload(user_id),
+        'roles' : [],
+        'joined_at' : '2020-01-01T00:00:00+00:00',
+        'deaf' : False,
+        'mute' : False,
+        'nick' : None,
+    }
+
+def guild_payload(guild_id, members, channels, intents, bot_id):
+    """Build the GUILD_CREATE a guild would send to a client with some
+    intents. All members are sent with the members intent, as if the guild
+    had been chunked; only online ones are sent with the presences intent.
+    """
+    user_ids = [ guild_id * 100000 + i for i in range(members) ]
+    online = user_ids[:int(members * ONLINE)]
+    if intents.members:
+        sent = user_ids
+    elif intents.presences:
+        sent = online
+    else:
+        sent = []
+    return {
+        'id' : str(guild_id),
+        'name' : f'Guild {guild_id}',
+        'member_count' : members,
+        'roles' : [ {
+            'id' : str(guild_id),
+            'name' : '@everyone',
+            'permissions' : '0',
+            'position' : 0,
+            'color' : 0,
+        } ],
+        'emojis' : [],
+        'channels' : [ {
+            'id' : str(guild_id * 1000 + i),
+            'type' : 0,
+            'name' : f'channel-{i}',
+            'position' : i,
+            'permission_overwrites' : [],
+        } for i in range(channels) ],
+        'members' : [ member_payload(user_id) for user_id in sent ]
+            + [ member_payload(bot_id) ],
+        'presences' : [ {
+            'user' : { 'id' : str(user_id) },
+            'status' : 'online',
+            'activities' : [ { 'name' : 'a game', 'type' : 0 } ],
+            'client_status' : { 'desktop' : 'online' },
+        } for user_id in online ] if intents.presences else [],
+        'voice_states' : [],
+    }
+
+def message_payload(message_id, guild_id, members):
+    user_id = guild_id * 100000 + message_id % members
+    member = member_payload(user_id)
+    del member['user']
+    return {
+        'id' : str(message_id),
+        'channel_id' : str(guild_id * 1000),
+        'guild_id' : str(guild_id),
+        'author' : user_payload(user_id),
+        'member' : member,
+        'content' : 'just chatting about nothing in particular',
+        'timestamp' : '2020-01-01T00:00:00+00:00',
+        'edited_timestamp' : None,
+        'tts' : False,
+        'mention_everyone' : False,
+        'mentions' : [],
+        'mention_roles' : [],
+        'attachments' : [],
+        'embeds' : [],
+        'pinned' : False,
+        'type' : 0,
+    }
+
+def measure(options, guilds, members, channels, messages):
+    """Feed a client the events of the simulated guilds.
+
+    Arguments:
+        options -- The bot's options to configure the client with, or None
+            for discord.py's defaults.
+
+    Returns: A dict of the growth in resident set size and the numbers of
+    cached members and messages.
+    """
+    import asyncio
+    import discord
+    import dragonbot
+
+    loop = asyncio.new_event_loop()
+    if options is None:
+        client = discord.Client(loop=loop)
+    else:
+        sys.argv = [
+            'dragonbot',
+            '--token', 'benchmark',
+            '--owner-id', '1',
+            '--storage-dir', os.devnull,
+        ] + options
+        dragonbot.getopts()
+        client = discord.Client(
+            loop=loop,
+            # Guilds are sent as if they were already chunked
+            chunk_guilds_at_startup=False,
+            **dragonbot.client_options()
+        )
+    state = client._connection
+    bot_id = 1
+    state.user = discord.ClientUser(state=state, data=user_payload(bot_id))
+
+    gc.collect()
+    before = rss()
+    for guild_id in range(1, guilds + 1):
+        state.parse_guild_create(guild_payload(
+            guild_id,
+            members,
+            channels,
+            state.intents,
+            bot_id
+        ))
+    for message_id in range(messages):
+        state.parse_message_create(message_payload(
+            message_id,
+            message_id % guilds + 1,
+            members
+        ))
+    gc.collect()
+    return {
+        'rss' : rss() - before,
+        'members' : sum(len(guild.members) for guild in client.guilds),
+        'messages' : len(state._messages or ()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.config is not None:
+        # Measure one configuration, in a process of its own
+        print(json.dumps(measure(
+            dict(CONFIGS)[opts.config],
+            opts.guilds,
+            opts.members,
+            opts.channels,
+            opts.messages
+        )))
+        return
+
+    print(
+        f'{opts.guilds} guilds of {opts.members} members and'
+        f' {opts.channels} channels, {opts.messages} messages:'
+    )
+    baseline = None
+    for name, _ in CONFIGS:
+        output = subprocess.run(
+            [
+                sys.executable, __file__,
+                '--guilds', str(opts.guilds),
+                '--members', str(opts.members),
+                '--channels', str(opts.channels),
+                '--messages', str(opts.messages),
+                '--config', name,
+            ],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        if baseline is None:
+            baseline = result['rss']
+        print(
+            f'{name:>22}: {result["rss"] / 2**20:7.1f} MiB'
+            f' ({result["rss"] / baseline:4.0%} of defaults),'
+            f' {result["members"]:6} members and'
+            f' {result["messages"]:4} messages cached'
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Micro-benchmark of messages per second through dragonbot.on_message.
+
+Run from the repository root with the source directory on the path:
+
+    PYTHONPATH=src python bench/bench_on_message.py [--messages N] [--loop L]
+
+No network access is needed. The bot is initialized with throwaway file
+storage and a fake client, so only local message handling is measured.
+Throughput and per-message latency are reported for the chosen event loop
+implementation (asyncio or uvloop).
+"""
+
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeChannel, FakeClient, FakeGuild, FakeMessage, FakeUser
+
+# A mix of ordinary chatter, local commands, unknown commands and emotes.
+MESSAGES = (
+    'just chatting about nothing in particular',
+    'another message that mentions a dragon',
+    '!8ball will this be fast?',
+    '!r 2d6 + 3',
+    '!notacommand with some arguments',
+    '!alsounknown',
+    '@shrug',
+    '@nonexistent',
+    'lorem ipsum dolor sit amet, consectetur adipiscing elit',
+    '!roll 1d20',
+)
+
+def setup(storage_dir, loop_backend):
+    """Initialize the bot against a fake client.
+
+    Returns: A tuple of (the dragonbot module, the channel to post messages
+    in, the event loop the bot created).
+    """
+    sys.argv = [
+        'dragonbot',
+        '--token', 'benchmark',
+        '--owner-id', '1',
+        '--storage-dir', storage_dir,
+        '--log-level', 'WARNING',
+        '--global-log-level', 'WARNING',
+        '--loop', loop_backend,
+    ]
+    import dragonbot
+    from storage import storage_injector
+
+    dragonbot.init()
+    loop = dragonbot.client.loop
+    client = dragonbot.client = FakeClient()
+    guild = FakeGuild('Benchmark Guild')
+    client.guilds.append(guild)
+    channel = FakeChannel('general', guild)
+
+    emotes = storage_injector('emotes', guild.id)
+    emotes['shrug'] = r'¯\_(ツ)_/¯'
+    dragonbot.emotes.add_server(guild, emotes)
+    keywords = storage_injector('keywords', guild.id)
+    keywords['dragon'] = { 'reactions' : [], 'count' : 0 }
+    dragonbot.keywords.add_server(guild, keywords)
+    dragonbot.ready_guilds.add(guild.id)
+    return dragonbot, channel, loop
+
+async def run(dragonbot, channel, count):
+    author = FakeUser('benchmarker')
+    messages = [
+        FakeMessage(MESSAGES[i % len(MESSAGES)], author, channel)
+        for i in range(count)
+    ]
+    latencies = []
+    start = time.perf_counter()
+    for message in messages:
+        received = time.perf_counter()
+        await dragonbot.on_message(message)
+        latencies.append(time.perf_counter() - received)
+    # Let queued outbound messages drain
+    outbox = dragonbot.util.get_outbox()
+    while outbox.depth():
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    await outbox.close()
+    return elapsed, sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--loop', choices=('asyncio', 'uvloop'), default='asyncio')
+    opts = parser.parse_args()
+
+    # Storage objects save themselves at exit, and atexit handlers run in
+    # reverse order, so registering the cleanup first makes it run last.
+    storage_dir = tempfile.mkdtemp(prefix='dragonbot-bench-')
+    atexit.register(shutil.rmtree, storage_dir, True)
+
+    dragonbot, channel, loop = setup(storage_dir, opts.loop)
+    try:
+        elapsed, latencies = loop.run_until_complete(
+            run(dragonbot, channel, opts.messages)
+        )
+    finally:
+        loop.close()
+    percentiles = ', '.join(
+        f'p{q} {latencies[int(q / 100 * (len(latencies) - 1))] * 1e6:.0f} µs'
+            for q in (50, 90, 99)
+    )
+    print(
+        f'{opts.loop}: {opts.messages} messages in {elapsed:.3f}s:'
+        f' {opts.messages / elapsed:,.0f} messages/s'
+        f' ({len(channel.sent)} sends); latency {percentiles}'
+    )
+
+if __name__ == '__main__':
+    main()
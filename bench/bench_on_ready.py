@@ -0,0 +1,138 @@
+"""Benchmark of guild setup in dragonbot.on_ready.
+
+Run from the repository root with the source directory on the path:
+
+    PYTHONPATH=src python bench/bench_on_ready.py [--guilds N] [--concurrency N ...]
+
+No network access is needed. The bot is initialized with throwaway file
+storage, filled with keywords and emotes for each guild, and a fake client.
+A delay is added to each guild's storage load to stand in for a database
+round trip. For each concurrency limit, the time until the first guild is
+set up and one of its messages handled, and until every guild is set up,
+is reported.
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeChannel, FakeClient, FakeGuild, FakeMessage, FakeUser
+
+def setup(storage_dir, guild_count, keyword_count):
+    """Initialize the bot against a fake client with many guilds, and write
+    their storage.
+
+    Returns: The dragonbot module.
+    """
+    sys.argv = [
+        'dragonbot',
+        '--token', 'benchmark',
+        '--owner-id', '1',
+        '--storage-dir', storage_dir,
+        '--log-level', 'WARNING',
+        '--global-log-level', 'WARNING',
+        '--status-port', '0',
+    ]
+    import dragonbot
+
+    dragonbot.init()
+    # Neither is needed, and the insult pool would go to the network
+    dragonbot.insult_pool.start = lambda: None
+    dragonbot.loop_monitor.start = lambda: None
+    client = dragonbot.client = FakeClient()
+    for i in range(guild_count):
+        guild = FakeGuild(f'Guild {i}')
+        for j in range(5):
+            FakeChannel(f'channel-{j}', guild)
+        client.guilds.append(guild)
+        guild_dir = os.path.join(storage_dir, str(guild.id))
+        os.makedirs(guild_dir)
+        with open(os.path.join(guild_dir, 'keywords.json'), 'w') as fh:
+            json.dump({
+                f'keyword{k}' : { 'reactions' : [], 'count' : k }
+                    for k in range(keyword_count)
+            }, fh)
+        with open(os.path.join(guild_dir, 'emotes.json'), 'w') as fh:
+            json.dump({ 'shrug' : r'¯\_(ツ)_/¯' }, fh)
+    return dragonbot
+
+async def run(dragonbot, concurrency):
+    """Run on_ready, handling a message as soon as a guild is ready.
+
+    Returns: A tuple of (seconds until the first message was handled,
+    seconds until every guild was set up).
+    """
+    # Forget the storage loaded by earlier runs, so that it is loaded again
+    dragonbot.ready_guilds.clear()
+    dragonbot.emotes.emotes.clear()
+    dragonbot.keywords.keywords.clear()
+    dragonbot.keywords.automata.clear()
+    dragonbot.guild_setup_slots = asyncio.Semaphore(concurrency)
+    author = FakeUser('benchmarker')
+
+    async def first_message():
+        while not dragonbot.ready_guilds:
+            await asyncio.sleep(0.001)
+        guild_id = next(iter(dragonbot.ready_guilds))
+        guild = next(g for g in dragonbot.client.guilds if g.id == guild_id)
+        await dragonbot.on_message(
+            FakeMessage('!8ball is it ready?', author, guild.channels[0])
+        )
+        return time.perf_counter()
+
+    start = time.perf_counter()
+    handled = asyncio.ensure_future(first_message())
+    await dragonbot.on_ready()
+    all_ready = time.perf_counter()
+    return (await handled) - start, all_ready - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--keywords', type=int, default=50)
+    parser.add_argument(
+        '--storage-latency',
+        type=float,
+        default=0.005,
+        help='Seconds added to each guild\'s storage load.'
+    )
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    opts = parser.parse_args()
+
+    # Storage objects save themselves at exit, and atexit handlers run in
+    # reverse order, so registering the cleanup first makes it run last.
+    storage_dir = tempfile.mkdtemp(prefix='dragonbot-bench-')
+    atexit.register(shutil.rmtree, storage_dir, True)
+
+    dragonbot = setup(storage_dir, opts.guilds, opts.keywords)
+    load = dragonbot._load_guild_storage
+    def slow_load(server_id):
+        time.sleep(opts.storage_latency)
+        return load(server_id)
+    dragonbot._load_guild_storage = slow_load
+
+    loop = asyncio.get_event_loop()
+    try:
+        for concurrency in opts.concurrency:
+            first, everything = loop.run_until_complete(
+                run(dragonbot, concurrency)
+            )
+            print(
+                f'{opts.guilds} guilds, concurrency {concurrency:3}:'
+                f' first message handled after {first * 1000:7.1f} ms,'
+                f' all guilds set up after {everything * 1000:7.1f} ms'
+            )
+        loop.run_until_complete(dragonbot.util.close_outbox())
+    finally:
+        loop.close()
+
+if __name__ == '__main__':
+    main()
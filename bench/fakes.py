@@ -0,0 +1,153 @@
+"""Minimal stand-ins for the discord.py objects that DragonBot's message
+handlers touch. They let the handlers run without a gateway connection and
+record everything the bot would have sent. FakeSession stands in for the
+HTTP client's aiohttp session, so that commands that call upstream APIs run
+without network access.
+"""
+
+import asyncio
+import itertools
+import json
+
+_ids = itertools.count(1000)
+
+class FakeUser():
+
+    def __init__(self, name, user_id=None, bot=False):
+        self.id = user_id if user_id is not None else next(_ids)
+        self.name = self.display_name = name
+        self.bot = bot
+        self.mention = f'<@{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild():
+
+    def __init__(self, name, guild_id=None):
+        self.id = guild_id if guild_id is not None else next(_ids)
+        self.name = name
+        self.channels = []
+
+    def __str__(self):
+        return self.name
+
+class FakeTyping():
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc):
+        return False
+
+class FakeChannel():
+
+    def __init__(self, name, guild=None, channel_id=None):
+        self.id = channel_id if channel_id is not None else next(_ids)
+        self.name = name
+        self.guild = guild
+        self.sent = []
+        if guild is not None:
+            guild.channels.append(self)
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+
+    def typing(self):
+        return FakeTyping()
+
+    def __str__(self):
+        return self.name
+
+class FakeMessage():
+
+    def __init__(self, content, author, channel, mentions=()):
+        self.id = next(_ids)
+        self.content = self.clean_content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = list(mentions)
+        self.role_mentions = []
+        self.attachments = []
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+class FakeClient():
+
+    def __init__(self):
+        self.user = FakeUser('DragonBot', bot=True)
+        self.guilds = []
+        self.latency = 0.0
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds:
+            for channel in guild.channels:
+                if channel.id == channel_id:
+                    return channel
+        return None
+
+class FakeResponse():
+    """A response with an empty body and an error status, as an upstream
+    API would give for something it cannot find.
+    """
+
+    content_type = 'application/json'
+    content_length = 0
+
+    def __init__(self, url, status=404):
+        self.url = url
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc):
+        return False
+
+    async def read(self):
+        return b''
+
+    async def text(self):
+        return ''
+
+    async def json(self, **_kwargs):
+        raise json.JSONDecodeError('Empty body', '', 0)
+
+class _FakeConnector():
+    _acquired = ()
+    _conns = {}
+
+class FakeSession():
+    """Stands in for an aiohttp.ClientSession. Every request gets a
+    FakeResponse after a fixed latency.
+    """
+
+    closed = False
+    connector = _FakeConnector()
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url, **_kwargs):
+        self.requests += 1
+        return _DelayedResponse(url, self.latency)
+
+    async def close(self):
+        self.closed = True
+
+class _DelayedResponse():
+
+    def __init__(self, url, latency):
+        self.response = FakeResponse(url)
+        self.latency = latency
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.latency)
+        return self.response
+
+    async def __aexit__(self, *_exc):
+        return False
@@ -0,0 +1,327 @@
+"""Replays a log of recorded messages against dragonbot.on_message.
+
+Record a log with the bot's --record-messages option, or make a synthetic
+one, then run from the repository root with the source directory on the
+path:
+
+    PYTHONPATH=src python bench/replay.py LOG [--speed X] [--loop L]
+    PYTHONPATH=src python bench/replay.py LOG --synthesize N
+
+No network access is needed. The bot is initialized with throwaway file
+storage, holding each recorded guild's keywords and emotes, and a fake
+client, channels and messages that capture what the bot sends and the
+reactions it adds. Requests to upstream APIs get an empty "not found"
+response after --upstream-latency seconds.
+
+Messages are dispatched as tasks at their recorded times, divided by
+--speed: 1 replays in real time and larger speeds replay faster. A speed of
+0 replays flat out, with at most --max-in-flight messages being handled at
+once. Throughput, latency percentiles for whole messages and for each
+pipeline, and memory use are reported.
+"""
+
+import argparse
+import asyncio
+import atexit
+import gc
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_on_message import MESSAGES
+from fakes import (
+    FakeChannel,
+    FakeClient,
+    FakeGuild,
+    FakeMessage,
+    FakeSession,
+    FakeUser,
+)
+
+# Added to recorded IDs, so that they do not collide with the fakes' own
+_ID_OFFSET = 10 ** 12
+
+def rss():
+    """Get the process's resident set size, in bytes."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def peak_rss():
+    """Get the process's peak resident set size, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def synthesize(path, count, guilds, rate):
+    """Write a synthetic message log, using the same messages as
+    bench_on_message.py, from random users in a few guilds.
+
+    Arguments:
+        path -- The log's file name.
+        count -- How many messages to write.
+        guilds -- How many guilds to spread them over.
+        rate -- The average messages per second.
+    """
+    import traffic
+
+    fake_guilds = []
+    for i in range(guilds):
+        guild = FakeGuild(f'Guild {i}')
+        FakeChannel('general', guild)
+        fake_guilds.append(guild)
+    users = [ FakeUser(f'user{i}') for i in range(50) ]
+    recorder = traffic.MessageRecorder(
+        path,
+        guild_info=lambda guild: {
+            'keywords' : [ 'dragon' ],
+            'emotes' : [ 'shrug' ],
+        }
+    )
+    rng = random.Random(0)
+    at = recorder.started
+    for i in range(count):
+        at += rng.expovariate(rate)
+        guild = rng.choice(fake_guilds)
+        recorder.record(
+            FakeMessage(
+                MESSAGES[i % len(MESSAGES)],
+                rng.choice(users),
+                guild.channels[0]
+            ),
+            at=at
+        )
+    recorder.close()
+
+class Replay():
+    """Builds the fake guilds, channels and users a log refers to, and
+    replays its messages.
+    """
+
+    def __init__(self, dragonbot):
+        self.dragonbot = dragonbot
+        self.client = dragonbot.client
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        self.latencies = []
+        self.lateness = []
+
+    def add_guild(self, record):
+        """Set up a recorded guild, with its keywords and emotes."""
+        from storage import storage_injector
+
+        guild = FakeGuild(
+            f'Guild {record["guild"]}',
+            guild_id=_ID_OFFSET + record['guild']
+        )
+        self.guilds[record['guild']] = guild
+        self.client.guilds.append(guild)
+        emotes = storage_injector('emotes', guild.id)
+        for name in record['emotes']:
+            emotes[name] = f'Emote {name}'
+        keywords = storage_injector('keywords', guild.id)
+        for name in record['keywords']:
+            keywords[name] = { 'reactions' : [], 'count' : 0 }
+        self.dragonbot.emotes.add_server(guild, emotes)
+        self.dragonbot.keywords.add_server(guild, keywords)
+        self.dragonbot.ready_guilds.add(guild.id)
+
+    def channel(self, record):
+        key = (record.get('g'), record['c'])
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = FakeChannel(
+                f'channel-{record["c"]}',
+                self.guilds.get(record.get('g')),
+                channel_id=_ID_OFFSET + record['c']
+            )
+        return channel
+
+    def user(self, anonymous_id, bot=False):
+        user = self.users.get(anonymous_id)
+        if user is None:
+            user = self.users[anonymous_id] = FakeUser(
+                f'user{anonymous_id}',
+                user_id=_ID_OFFSET + anonymous_id,
+                bot=bot
+            )
+        return user
+
+    def message(self, record):
+        return FakeMessage(
+            record['m'],
+            self.user(record['a'], record.get('bot', False)),
+            self.channel(record),
+            mentions=[ self.user(m) for m in record.get('mentions', ()) ]
+        )
+
+    async def handle(self, message):
+        received = time.perf_counter()
+        await self.dragonbot.on_message(message)
+        self.latencies.append(time.perf_counter() - received)
+
+    async def run(self, records, speed, max_in_flight):
+        """Replay the records.
+
+        Returns: The number of messages replayed.
+        """
+        in_flight = set()
+        count = 0
+        start = time.perf_counter()
+        for record in records:
+            if 'guild' in record:
+                self.add_guild(record)
+                continue
+            message = self.message(record)
+            if speed > 0:
+                due = start + record['t'] / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.lateness.append(max(0.0, time.perf_counter() - due))
+            elif len(in_flight) >= max_in_flight:
+                await asyncio.wait(
+                    in_flight,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+            task = asyncio.ensure_future(self.handle(message))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            count += 1
+        if in_flight:
+            await asyncio.wait(in_flight)
+        # Let queued outbound messages drain
+        outbox = self.dragonbot.util.get_outbox()
+        while outbox.depth():
+            await asyncio.sleep(0.001)
+        return count
+
+def setup(storage_dir, loop_backend, upstream_latency):
+    """Initialize the bot against a fake client and fake upstream APIs.
+
+    Returns: The dragonbot module.
+    """
+    sys.argv = [
+        'dragonbot',
+        '--token', 'replay',
+        '--owner-id', '1',
+        '--storage-dir', storage_dir,
+        '--log-level', 'ERROR',
+        '--global-log-level', 'ERROR',
+        '--loop', loop_backend,
+        '--status-port', '0',
+    ]
+    import dragonbot
+
+    dragonbot.init()
+    dragonbot.client = FakeClient()
+    dragonbot.util._http_client.session = FakeSession(upstream_latency)
+    return dragonbot
+
+def percentiles(samples, unit=1e3, suffix='ms'):
+    ordered = sorted(samples)
+    if not ordered:
+        return 'N/A'
+    return ', '.join(
+        f'p{q} {ordered[int(q / 100 * (len(ordered) - 1))] * unit:.2f} {suffix}'
+            for q in (50, 90, 99)
+    ) + f', max {ordered[-1] * unit:.2f} {suffix}'
+
+def report(dragonbot, replay, count, elapsed, memory):
+    captured = sum(len(channel.sent) for channel in replay.channels.values())
+    print(
+        f'{count} messages in {elapsed:.3f}s: {count / elapsed:,.0f} messages/s;'
+        f' {captured} sends captured'
+    )
+    print(f'  message latency: {percentiles(replay.latencies)}')
+    if replay.lateness:
+        print(f'  dispatch lateness: {percentiles(replay.lateness)}')
+    for (name,), histogram in sorted(dragonbot.pipeline_seconds.values.items()):
+        print('  {} pipeline ({} runs): p50 {}, p90 {}, p99 {} (bucket bounds)'.format(
+            name,
+            histogram.total,
+            *(
+                f'{histogram.percentile(q) * 1e3:.2f} ms'
+                    for q in (0.5, 0.9, 0.99)
+            )
+        ))
+    wait = dragonbot.util.get_outbox().latency()
+    print(
+        '  outbound queue: median wait '
+        + (f'{wait * 1e3:.2f} ms' if wait is not None else 'N/A')
+    )
+    before, after, peak = memory
+    print(
+        f'  memory: RSS {before / 2**20:.1f} MiB before,'
+        f' {after / 2**20:.1f} MiB after, {peak / 2**20:.1f} MiB peak'
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='The message log to replay or write.')
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=0,
+        help='How many times faster than recorded to replay; 0 replays flat'
+            ' out. Default: 0.'
+    )
+    parser.add_argument('--loop', choices=('asyncio', 'uvloop'), default='asyncio')
+    parser.add_argument('--max-in-flight', type=int, default=100)
+    parser.add_argument('--upstream-latency', type=float, default=0.05)
+    parser.add_argument(
+        '--synthesize',
+        type=int,
+        metavar='N',
+        help='Write a synthetic log of N messages instead of replaying.'
+    )
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=100,
+        help='Messages per second in a synthetic log.'
+    )
+    opts = parser.parse_args()
+
+    if opts.synthesize is not None:
+        synthesize(opts.log, opts.synthesize, opts.guilds, opts.rate)
+        print(f'Wrote {opts.synthesize} messages to {opts.log}')
+        return
+
+    import traffic
+
+    # Storage objects save themselves at exit, and atexit handlers run in
+    # reverse order, so registering the cleanup first makes it run last.
+    storage_dir = tempfile.mkdtemp(prefix='dragonbot-replay-')
+    atexit.register(shutil.rmtree, storage_dir, True)
+
+    dragonbot = setup(storage_dir, opts.loop, opts.upstream_latency)
+    replay = Replay(dragonbot)
+    loop = asyncio.get_event_loop()
+    gc.collect()
+    before = rss()
+    start = time.perf_counter()
+    try:
+        count = loop.run_until_complete(replay.run(
+            traffic.read_log(opts.log),
+            opts.speed,
+            opts.max_in_flight
+        ))
+        elapsed = time.perf_counter() - start
+        loop.run_until_complete(dragonbot.util.close_outbox())
+    finally:
+        loop.close()
+    after = rss()
+    report(dragonbot, replay, count, elapsed, (before, after, max(after, peak_rss())))
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ class CommandDispatcher():
     class DuplicateCommand(Exception):
         pass
 
-    Command = namedtuple('Command', ['name', 'func', 'rw', 'may_use'])
+    Command = namedtuple('Command', ['name', 'func', 'rw', 'may_use', 'aliases'])
 
     def __init__(self, read_only=False):
         """Construct a new CommandDispatcher bound to the given client.
@@ -26,6 +26,7 @@ class CommandDispatcher():
             read_only -- Whether r/w commands can be executed. Defaults to
                 False.
         """
+        # Maps every command name and alias to its Command.
         self.commands = {}
         self.read_only = read_only
 
@@ -34,7 +35,8 @@ class CommandDispatcher():
         command_name,
         command_func,
         rw=False,
-        may_use=None
+        may_use=None,
+        aliases=()
     ):
         """Register a command to make it known to the dispatcher.
 
@@ -50,28 +52,43 @@ class CommandDispatcher():
                 permitted to use this command. The collection must
                 implement the __contains__ method. If anyone may use the
                 command, pass None.
+            aliases -- Other names that dispatch to the same command.
         """
-        if command_name in self.commands:
-            raise CommandDispatcher.DuplicateCommand(
-                'Command already registered'
-            )
-        self.commands[command_name] = CommandDispatcher.Command(
+        names = (command_name,) + tuple(aliases)
+        for name in names:
+            if name in self.commands:
+                raise CommandDispatcher.DuplicateCommand(
+                    'Command already registered: "{}"'.format(name)
+                )
+        command = CommandDispatcher.Command(
             name=command_name,
             func=command_func,
             rw=rw,
-            may_use=may_use
+            may_use=may_use,
+            aliases=tuple(aliases)
         )
+        for name in names:
+            self.commands[name] = command
 
     def is_registered(self, command_name):
         return command_name in self.commands
 
-    async def dispatch(self, client, command_name, message):
+    def lookup(self, command_name):
+        """Get the Command registered under a name or alias.
+
+        Returns: The Command, or None if the name is not registered.
+        """
+        return self.commands.get(command_name)
+
+    async def dispatch(self, client, command_name, message, cmd=None):
         """Dispatch the given command.
 
         Arguments:
             client -- The discord.Client that received the message which
                 triggered the command.
             message -- The discord.Message that triggered the command.
+            cmd -- The util.ParsedCommand for the message, if it has
+                already been parsed.
 
         Returns: The return value of the command function, if any.
 
@@ -86,11 +103,20 @@ class CommandDispatcher():
         raise.
         """
         # Command has to be registered
-        if command_name not in self.commands:
+        command = self.lookup(command_name)
+        if command is None:
             raise CommandDispatcher.UnknownCommand(
                 'Unknown command: "{}"'.format(command_name)
             )
-        command = self.commands[command_name]
+        return await self.invoke(client, command, message, cmd)
+
+    async def invoke(self, client, command, message, cmd=None):
+        """Invoke a Command that has already been looked up.
+
+        This is the fast path for callers that have used lookup() to handle
+        unknown commands without an exception. Raises the same permission
+        exceptions as dispatch().
+        """
         # Caller has to have permission to use the command
         if command.may_use is not None:
             if message.author.id not in command.may_use:
@@ -99,7 +125,7 @@ class CommandDispatcher():
                     ' to use command "{}"'.format(
                         message.guild,
                         message.author,
-                        command_name
+                        command.name
                     )
                 )
         # Must not be in read-only mode for read/write commands
@@ -109,7 +135,8 @@ class CommandDispatcher():
             )
         # Call the command
         assert command.func is not None
-        return await command.func(client, message)
+        return await command.func(client, message, cmd)
 
     def known_command_names(self):
+        """Get the names of all known commands, including aliases."""
         return self.commands.keys()
@@ -54,8 +54,42 @@ EIGHT_BALL_ANSWERS = [
 ]
 # Maximum size for an embed description
 MAX_EMBED_DESC_SIZE = 2048
-# Maximum number of dice rolls
-MAX_DICE_ROLLS = 100
+# Maximum size of a custom emoji image, in bytes
+MAX_EMOJI_SIZE = 256 * 1024
+# Maximum size of an image that will be downscaled to make an emoji, in
+# bytes, and the largest width or height it is scaled to
+MAX_EMOJI_SOURCE_SIZE = 8 * 1024 * 1024
+MAX_EMOJI_DIMENSION = 128
+# Most pixels, over all of its frames, in an image that will be decoded to
+# make an emoji
+MAX_EMOJI_SOURCE_PIXELS = 50 * 1000 * 1000
+# Number of worker processes for image transcoding
+IMAGE_WORKERS = 2
+# Maximum size of a Wolfram Alpha result image, in bytes. This is also
+# Discord's upload limit.
+MAX_WOLFRAM_IMAGE_SIZE = 8 * 1024 * 1024
+# Maximum number of dice rolled by one expression, with and without NumPy
+MAX_DICE_ROLLS = 1000000
+MAX_DICE_ROLLS_WITHOUT_NUMPY = 100000
+# Rolls of more dice than this are evaluated off the event loop
+DICE_EXECUTOR_THRESHOLD = 10000
+# Most dice in a roll that are listed individually; larger rolls are
+# summarized
+MAX_DICE_SHOWN = 100
+# Most times exploding dice are rerolled
+MAX_DICE_EXPLOSIONS = 100
+# Limits for !odds: the most possible outcomes of an expression or any part
+# of it, and a bound on the work done for keeping dice (roughly the number
+# of array element updates)
+MAX_ODDS_OUTCOMES = 1000000
+MAX_ODDS_KEEP_WORK = 100000000
+# Probability below which further explosions of exploding dice are ignored
+ODDS_EPSILON = 1e-12
+# Distributions longer than this are convolved with FFTs rather than
+# directly
+ODDS_FFT_THRESHOLD = 64
+# Percentiles shown by !odds
+ODDS_PERCENTILES = (5, 25, 50, 75, 95)
 # Maximum number of sides a die can have
 MAX_DIE_SIDES = 1000000
 # Allowed schemes for image URLs.
@@ -72,11 +106,131 @@ WOLFRAM_SHORT = '/v1/result'
 WIKIPEDIA_API_URL = 'https://en.wikipedia.org/w/api.php'
 WIKTIONARY_API_URL = 'https://en.wiktionary.org/w/api.php'
 INSULT_API_URL = 'https://insult.mattbas.org/api/insult'
+# Time limits, in seconds, for the independent pipelines that handle a
+# message. A pipeline that runs over is cancelled without affecting the
+# others.
+PIPELINE_TIMEOUTS = {
+    'command'  : 120,
+    'emote'    : 30,
+    'keywords' : 30,
+}
+# Response caches for upstream lookups, given as (maximum entries, TTL,
+# negative TTL). TTLs are in seconds; negative results are "not found"
+# answers.
+RESPONSE_CACHES = {
+    'wikipedia'        : (512, 60 * 60, 10 * 60),
+    'wiktionary'       : (512, 60 * 60, 10 * 60),
+    'urban dictionary' : (512, 60 * 60, 10 * 60),
+    'wolfram ask'      : (256, 10 * 60, 5 * 60),
+    'wolfram simple'   : (64,  10 * 60, 5 * 60),
+    'emoji images'     : (32,  24 * 60 * 60, 0),
+    'dice odds'        : (256, 24 * 60 * 60, 24 * 60 * 60),
+}
+# HTTP client connection pool: total and per-host connection limits, how
+# long idle connections are kept alive and how long DNS results are cached,
+# in seconds
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 10
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_DNS_CACHE_TTL = 300
+# Streamed downloads: the default size limit, how much is kept in memory
+# before spooling to a temporary file, and the read size, all in bytes
+HTTP_MAX_DOWNLOAD_SIZE = 8 * 1024 * 1024
+HTTP_SPOOL_MEMORY_LIMIT = 512 * 1024
+HTTP_CHUNK_SIZE = 64 * 1024
+# Total time limits, in seconds, for requests to each upstream API
+HTTP_TIMEOUTS = {
+    'default'          : 15,
+    'emoji'            : 20,
+    'insult'           : 5,
+    'urban dictionary' : 10,
+    'wikipedia'        : 10,
+    'wiktionary'       : 10,
+    'wolfram'          : 20,
+}
+# Number of prefetched insults to keep of each kind, the level below which
+# they are refilled, and how long to wait after a failed refill, in seconds
+INSULT_POOL_SIZE = 20
+INSULT_POOL_LOW_WATER = 5
+INSULT_POOL_RETRY_DELAY = 60
+# Circuit breakers for upstream APIs: which upstreams have one, how many
+# consecutive failures or slow calls open it, the fraction of an upstream's
+# timeout a call must take to count as slow and how long it stays open
+# before a probe, in seconds
+HTTP_BREAKER_UPSTREAMS = (
+    'insult',
+    'urban dictionary',
+    'wikipedia',
+    'wiktionary',
+    'wolfram',
+)
+HTTP_BREAKER_FAILURE_THRESHOLD = 5
+HTTP_BREAKER_SLOW_CALL_FRACTION = 0.5
+HTTP_BREAKER_RESET_TIMEOUT = 30
+# Retries of failed GET requests: how many, the base and maximum backoff in
+# seconds, and which response statuses are retried
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_BACKOFF_MAX = 4
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Hedged requests: which upstreams get them, the latency percentile after
+# which a second request is sent, and how many latency samples are kept and
+# needed before hedging starts. Wolfram Alpha is left out since every
+# request counts against the API quota.
+HTTP_HEDGED_UPSTREAMS = ('insult', 'urban dictionary', 'wikipedia', 'wiktionary')
+HTTP_HEDGE_PERCENTILE = 0.95
+HTTP_LATENCY_SAMPLES = 100
+HTTP_HEDGE_MIN_SAMPLES = 20
+# How long, in seconds, to collect concurrent Wikipedia lookups into one
+# request, and the most titles per request (the API returns at most 20
+# intro extracts at a time)
+WIKI_BATCH_WINDOW = 0.005
+WIKI_BATCH_MAX_TITLES = 20
+# How long, in seconds, a command may take before the typing indicator is
+# shown
+TYPING_DELAY = 0.3
+# Number of concurrent senders for queued outbound messages, and how many
+# recent queueing latencies to keep for statistics
+OUTBOX_WORKERS = 4
+OUTBOX_LATENCY_SAMPLES = 100
+# Most messages !purge will delete, how many messages can be bulk-deleted at
+# once and how old they may be, in seconds (Discord's limit is 14 days; a
+# minute is left as margin), and how often to report progress, in seconds
+MAX_PURGE = 10000
+BULK_DELETE_MAX = 100
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60 - 60
+PURGE_PROGRESS_INTERVAL = 5
+# Most guilds whose storage is loaded at once when the bot becomes ready
+GUILD_SETUP_CONCURRENCY = 8
 # Config vars that shouldn't be shown
 SENSITIVE_CONFIG_VARS = ('token', 'mongodb_uri', 'wolfram_app_id')
 
 LOG_LEVELS = [ 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL' ]
 
+# Gateway intents the bot itself needs, whatever its feature modules need:
+# the guild and channel caches, and messages, which carry commands, in
+# guilds and direct messages
+BASE_INTENTS = ( 'guilds', 'guild_messages', 'dm_messages' )
+
+# Event loop implementations that can be chosen with --loop
+LOOP_BACKENDS = ( 'asyncio', 'uvloop' )
+
+# Options that keep their values when the options are reloaded, because
+# changing them requires a restart
+RESTART_OPTIONS = (
+    'intents',
+    'loop',
+    'max_messages',
+    'member_cache',
+    'mongodb_uri',
+    'record_messages',
+    'shard_count',
+    'shard_ids',
+    'status_port',
+    'storage_dir',
+    'token',
+)
+
 LOG_FORMAT = ' | '.join([
     '%(asctime)s',
     '%(levelname)s',
@@ -85,3 +239,41 @@ LOG_FORMAT = ' | '.join([
 ])
 
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# How often, in seconds, to measure event loop lag; how long the loop must
+# be blocked, in seconds, before its stack is captured; and how many of
+# those stalls to keep
+LOOP_LAG_INTERVAL = 0.5
+LOOP_STALL_THRESHOLD = 0.25
+LOOP_STALL_HISTORY = 10
+# Upper bounds of the event loop lag histogram's buckets, in seconds
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Most log records waiting to be written before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+# Most recorded messages waiting to be written before new ones are dropped
+RECORD_QUEUE_SIZE = 10000
+# Default number of records per second, and the burst, each call site may
+# log below WARNING
+LOG_RATE_LIMIT = 10
+LOG_RATE_LIMIT_BURST = 20
+# Default upper bounds of metrics histograms' buckets, in seconds
+METRICS_LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+# Address and default port of the bot's HTTP server for health checks and
+# metrics
+STATUS_HOST = '0.0.0.0'
+STATUS_PORT = 10000
+# How long, in seconds, the bot may be disconnected from the gateway before
+# it is reported dead, and the most heartbeat latency and event loop lag, in
+# seconds, with which it is still reported ready
+HEALTH_GATEWAY_GRACE = 300
+HEALTH_MAX_LATENCY = 5
+HEALTH_MAX_LOOP_LAG = 1
+# How long, in seconds, the storage backend may take to answer a health check
+HEALTH_STORAGE_TIMEOUT = 5
+# How often, in seconds, each sharded process publishes its statistics to
+# the shared storage, and how old, in seconds, published statistics may be
+# before they are left out of the totals
+SHARD_STATS_INTERVAL = 30
+SHARD_STATS_MAX_AGE = 3 * SHARD_STATS_INTERVAL
@@ -1,14 +1,48 @@
-from random import randrange
+"""A module for DragonBot that rolls dice.
+
+Dice expressions are parsed into a small syntax tree and then evaluated.
+Large pools of dice are rolled in bulk with NumPy when it is installed, and
+are summarized rather than listed die by die. With NumPy, the exact
+distribution of an expression's value can also be computed.
+"""
+
+from collections import namedtuple
 from util import command_method
+import asyncio
 import constants
+import heapq
 import logging
+import math
+import random
 import re
 import util
 
+# NumPy takes a while to import, so it is loaded when a roll first needs it
+numpy = util.lazy_import('numpy')
+
+_rng = None
+
+# Nodes of a parsed dice expression
+Constant = namedtuple('Constant', ['value'])
+# keep is None, or a tuple of ('h' or 'l', number of dice to keep)
+Roll = namedtuple('Roll', ['count', 'sides', 'keep', 'explode'])
+BinaryOp = namedtuple('BinaryOp', ['op', 'left', 'right'])
+Negate = namedtuple('Negate', ['operand'])
+Group = namedtuple('Group', ['expr'])
+
+TOKEN_PATTERN = re.compile(r'\s*(?:([0-9]+)|(kh|kl|k|d|!|\+|-|\*|\(|\)))')
+
 class Dice():
 
+    # Gateway intents needed to roll dice in guilds and direct messages
+    intents = ('guild_messages', 'dm_messages')
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.odds_cache = util.ResponseCache(
+            'dice odds',
+            *constants.RESPONSE_CACHES['dice odds']
+        )
 
     def register_commands(self, cd):
         """Register this modules's commands with a CommandDispatcher.
@@ -16,8 +50,8 @@ class Dice():
         Arguments:
             cd -- The CommandDispatcher to register with.
         """
-        cd.register('roll', self.roll)
-        cd.register('r', self.roll)
+        cd.register('roll', self.roll, aliases=('r',))
+        cd.register('odds', self.odds)
         self.logger.info('Registered commands')
 
     @staticmethod
@@ -28,22 +62,42 @@ class Dice():
             help_msgs=[ [
                 '{prefix}roll or {prefix}r <dice expression>',
                 'Roll dice specified by <dice expression>. A dice expression'
-                ' consists of a number of dice rolls or constant modifiers'
-                ' separated by plus signs. A dice roll consists of the number'
-                ' of times a die is rolled and the number of sides on the die,'
-                ' separated by the letter "d". A constant modifier is simply'
-                ' any integer value. For example, the expression'
-                ' "1d6 + 2d4 + 3" will roll 1 6-sided die, 2 4-sided dice, and'
-                ' add 3 to the result.'
+                ' consists of dice rolls and integer constants combined with'
+                ' `+`, `-` and `*`, and may use parentheses. A dice roll'
+                ' consists of the number of times a die is rolled and the'
+                ' number of sides on the die, separated by the letter "d".'
+                ' Add `!` to a roll to roll again and add whenever a die'
+                ' shows its highest face, and `kh<n>` or `kl<n>` to keep only'
+                ' the highest or lowest <n> dice. For example, the expression'
+                ' "4d6kh3 + 2d4 - 1" rolls 4 6-sided dice and keeps the'
+                ' highest 3, adds 2 4-sided dice, and subtracts 1. Large'
+                ' pools of dice are summarized instead of listed.'
+            ], [
+                '{prefix}odds <dice expression> [>= <target>]',
+                'Show the exact distribution of a dice expression: its mean,'
+                ' standard deviation, range and percentiles, and the chance'
+                ' of rolling at least <target>. Exploding dice are'
+                ' approximated, and cannot be combined with keeping dice.'
             ] ]
         )
 
     @command_method
-    async def roll(self, _client, message):
-        _command, expr = util.split_command(message)
+    async def roll(self, _client, message, cmd):
+        expr = cmd.argstr
         try:
-            results = parse_cmd(expr)
-            (formatted_expr, total) = format_results(results)
+            if expr is None:
+                raise ValueError('Need a dice expression.')
+            node = parse(expr)
+            if count_dice(node) > constants.DICE_EXECUTOR_THRESHOLD:
+                # Large rolls take long enough to stall the event loop
+                loop = asyncio.get_event_loop()
+                (formatted_expr, total) = await loop.run_in_executor(
+                    None,
+                    evaluate,
+                    node
+                )
+            else:
+                (formatted_expr, total) = evaluate(node)
             if (
                 formatted_expr == str(total)
                 or len(formatted_expr) > constants.MAX_CHARACTERS
@@ -54,47 +108,561 @@ class Dice():
         except ValueError as e:
             await message.channel.send(str(e))
         except:
+            self.logger.exception('Error rolling "%s"', expr)
             await message.channel.send('Unknown error.')
 
-PATTERN = re.compile(r'^(?P<die>[0-9]+d[0-9]+)|(?P<constant>[0-9]+)$')
-SPLIT_PATTERN = re.compile(r'\s*\+\s*')
+    @command_method
+    async def odds(self, _client, message, cmd):
+        argstr = cmd.argstr
+        if numpy is None:
+            await message.channel.send('Computing odds requires NumPy.')
+            return
+        try:
+            if argstr is None:
+                raise ValueError('Need a dice expression.')
+            expr, _, target = argstr.partition('>=')
+            try:
+                target = int(target) if target.strip() else None
+            except ValueError:
+                raise ValueError('The target must be an integer.')
+            node = parse(expr)
+            key = canonical(node)
+            async with util.DeferredTyping(message.channel):
+                # Popular expressions are cached; others are computed off
+                # the event loop, since large ones take a while.
+                result = await self.odds_cache.get(
+                    key,
+                    lambda: asyncio.get_event_loop().run_in_executor(
+                        None,
+                        distribution,
+                        node
+                    )
+                )
+            await message.channel.send(
+                describe_distribution(
+                    key,
+                    result,
+                    target,
+                    bounded=not has_exploding_dice(node)
+                )
+            )
+        except ValueError as e:
+            await message.channel.send(str(e))
+        except:
+            self.logger.exception('Error computing odds of "%s"', argstr)
+            await message.channel.send('Unknown error.')
 
-def format_results(rolls):
-    results = []
-    for roll in rolls:
-        if len(roll) == 0:
-            continue
-        elif len(roll) == 1:
-            results.append(str(roll[0]))
+def max_dice_rolls():
+    """The most dice one expression may roll, which is lower when NumPy is
+    not available to roll them in bulk.
+    """
+    if numpy is not None:
+        return constants.MAX_DICE_ROLLS
+    return constants.MAX_DICE_ROLLS_WITHOUT_NUMPY
+
+def parse(expr):
+    """Parse a dice expression.
+
+    Returns: The root node of the expression's syntax tree.
+
+    Raises:
+        ValueError -- If the expression is invalid or exceeds the limits.
+    """
+    tokens = []
+    pos = 0
+    expr = expr.strip().casefold()
+    while pos < len(expr):
+        match = TOKEN_PATTERN.match(expr, pos)
+        if match is None:
+            raise ValueError('Invalid expression')
+        if match.group(1) is not None:
+            tokens.append(int(match.group(1)))
         else:
-            results.append(f"[{' + '.join(str(r) for r in roll)}]")
-    expression = ' + '.join(results)
-    total = sum(roll for l in rolls for roll in l)
-    return (expression, total)
-
-def parse_cmd(cmd):
-    rolls = SPLIT_PATTERN.split(cmd)
-    return [parse_roll(roll) for roll in rolls]
-
-def parse_roll(roll):
-    match = PATTERN.match(roll)
-    if match is None:
+            tokens.append(match.group(2))
+        pos = match.end()
+    parser = _Parser(tokens)
+    node = parser.expr()
+    if parser.peek() is not None:
         raise ValueError('Invalid expression')
-    if match.group('die'):
-        die = match.group('die')
-        num, sides = die.split('d')
-        num = int(num)
-        sides = int(sides)
-        if num > constants.MAX_DICE_ROLLS:
-            raise ValueError(f'Too many rolls: {die}')
+    if count_dice(node) > max_dice_rolls():
+        raise ValueError(f'Too many rolls: at most {max_dice_rolls()} dice')
+    return node
+
+class _Parser():
+    """A recursive-descent parser over the tokens of a dice expression.
+
+    expr    := term (('+' | '-') term)*
+    term    := unary ('*' unary)*
+    unary   := '-' unary | primary
+    primary := '(' expr ')' | [number] 'd' number ['!'] [('k' | 'kh' | 'kl') number]
+             | number
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Incomplete expression')
+        self.pos += 1
+        return token
+
+    def number(self):
+        token = self.next()
+        if not isinstance(token, int):
+            raise ValueError('Invalid expression')
+        return token
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in ('+', '-'):
+            node = BinaryOp(self.next(), node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek() == '*':
+            node = BinaryOp(self.next(), node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == '-':
+            self.next()
+            return Negate(self.unary())
+        return self.primary()
+
+    def primary(self):
+        token = self.next()
+        if token == '(':
+            node = self.expr()
+            if self.next() != ')':
+                raise ValueError('Unbalanced parentheses')
+            return Group(node)
+        if token == 'd':
+            return self.roll(1)
+        if isinstance(token, int):
+            if self.peek() == 'd':
+                self.next()
+                return self.roll(token)
+            return Constant(token)
+        raise ValueError('Invalid expression')
+
+    def roll(self, count):
+        sides = self.number()
         if sides > constants.MAX_DIE_SIDES:
-            raise ValueError(f'Too many sides: {die}')
-        results = []
-        for i in range(0, num):
-            if sides == 0:
-                results.append(0)
-            else:
-                results.append(randrange(1, sides + 1))
+            raise ValueError(f'Too many sides: {count}d{sides}')
+        explode = False
+        if self.peek() == '!':
+            self.next()
+            if sides < 2:
+                raise ValueError(f"{count}d{sides} can't explode")
+            explode = True
+        keep = None
+        if self.peek() in ('k', 'kh', 'kl'):
+            keep = ('l' if self.next() == 'kl' else 'h', self.number())
+        return Roll(count, sides, keep, explode)
+
+def has_exploding_dice(node):
+    if isinstance(node, Roll):
+        return node.explode
+    if isinstance(node, BinaryOp):
+        return has_exploding_dice(node.left) or has_exploding_dice(node.right)
+    if isinstance(node, Negate):
+        return has_exploding_dice(node.operand)
+    if isinstance(node, Group):
+        return has_exploding_dice(node.expr)
+    return False
+
+def count_dice(node):
+    """Count the dice an expression rolls, not counting explosions."""
+    if isinstance(node, Roll):
+        return node.count
+    if isinstance(node, BinaryOp):
+        return count_dice(node.left) + count_dice(node.right)
+    if isinstance(node, Negate):
+        return count_dice(node.operand)
+    if isinstance(node, Group):
+        return count_dice(node.expr)
+    return 0
+
+def canonical(node):
+    """Format an expression in a canonical form, e.g. "4d6kh3 + 1" for
+    "4d6k3+1".
+    """
+    if isinstance(node, Constant):
+        return str(node.value)
+    if isinstance(node, Roll):
+        return '{}d{}{}{}'.format(
+            node.count,
+            node.sides,
+            '!' if node.explode else '',
+            f'k{node.keep[0]}{node.keep[1]}' if node.keep else ''
+        )
+    if isinstance(node, BinaryOp):
+        return f'{canonical(node.left)} {node.op} {canonical(node.right)}'
+    if isinstance(node, Negate):
+        return f'-{canonical(node.operand)}'
+    return f'({canonical(node.expr)})'
+
+def evaluate(node):
+    """Roll the dice in an expression and compute its value.
+
+    Returns: A tuple of (the expression with its rolls filled in, total).
+    """
+    if isinstance(node, Constant):
+        return (str(node.value), node.value)
+    if isinstance(node, Roll):
+        return roll_term(node)
+    if isinstance(node, BinaryOp):
+        left_text, left = evaluate(node.left)
+        right_text, right = evaluate(node.right)
+        if node.op == '+':
+            total = left + right
+        elif node.op == '-':
+            total = left - right
+        else:
+            total = left * right
+        return (f'{left_text} {node.op} {right_text}', total)
+    if isinstance(node, Negate):
+        text, total = evaluate(node.operand)
+        return (f'-{text}', -total)
+    text, total = evaluate(node.expr)
+    return (f'({text})', total)
+
+def roll_dice(count, sides):
+    """Roll count dice with the given number of sides.
+
+    Returns: A NumPy array of the results if NumPy is installed, otherwise a
+    list.
+    """
+    if numpy is not None:
+        global _rng
+        if sides == 0:
+            return numpy.zeros(count, dtype=numpy.int64)
+        if _rng is None:
+            _rng = numpy.random.default_rng()
+        return _rng.integers(1, sides, endpoint=True, size=count)
+    if sides == 0:
+        return [0] * count
+    return random.choices(range(1, sides + 1), k=count)
+
+def roll_pool(roll):
+    """Roll the dice of a Roll node, including any explosions.
+
+    Returns: A NumPy array or a list of the results.
+    """
+    results = roll_dice(roll.count, roll.sides)
+    if not roll.explode:
         return results
+    chunks = [ results ]
+    exploding = _count_equal(results, roll.sides)
+    depth = 0
+    while exploding and depth < constants.MAX_DICE_EXPLOSIONS:
+        extra = roll_dice(exploding, roll.sides)
+        chunks.append(extra)
+        exploding = _count_equal(extra, roll.sides)
+        depth += 1
+    if numpy is not None:
+        return numpy.concatenate(chunks)
+    return [ r for chunk in chunks for r in chunk ]
+
+def _count_equal(results, value):
+    if numpy is not None:
+        return int(numpy.count_nonzero(results == value))
+    return results.count(value)
+
+def roll_term(roll):
+    """Roll a Roll node.
+
+    Returns: A tuple of (text, total). Small pools list every die, with
+    dropped dice struck through; large pools are summarized.
+    """
+    results = roll_pool(roll)
+    n = len(results)
+    kept = n
+    if roll.keep is not None:
+        kept = min(roll.keep[1], n)
+
+    if n > constants.MAX_DICE_SHOWN:
+        return summarize_term(roll, results, kept)
+
+    values = [ int(r) for r in results ]
+    dropped = set()
+    if kept < n:
+        order = sorted(range(n), key=lambda i: values[i])
+        if roll.keep[0] == 'h':
+            dropped = set(order[:n - kept])
+        else:
+            dropped = set(order[kept:])
+    total = sum(v for i, v in enumerate(values) if i not in dropped)
+    if n == 1:
+        return (str(total), total)
+    text = ' + '.join(
+        f'~~{v}~~' if i in dropped else str(v) for i, v in enumerate(values)
+    )
+    return (f'[{text}]', total)
+
+def summarize_term(roll, results, kept):
+    """Summarize a large pool of dice, counting only the kept ones."""
+    n = len(results)
+    if kept == 0:
+        return (f'[{canonical(roll)}: kept 0 of {n} dice]', 0)
+    if numpy is not None:
+        if kept < n:
+            if roll.keep[0] == 'h':
+                results = numpy.partition(results, n - kept)[n - kept:]
+            else:
+                results = numpy.partition(results, kept - 1)[:kept]
+        total = int(results.sum())
+        low, high = int(results.min()), int(results.max())
+    else:
+        if kept < n:
+            if roll.keep[0] == 'h':
+                results = heapq.nlargest(kept, results)
+            else:
+                results = heapq.nsmallest(kept, results)
+        total = sum(results)
+        low, high = min(results), max(results)
+    counted = f'kept {kept} of {n}' if kept < n else f'{n}'
+    return (
+        f'[{canonical(roll)}: {counted} dice, mean {total / kept:.2f},'
+        f' min {low}, max {high}]',
+        total
+    )
+
+# The exact distribution of an expression's value: the probability of
+# offset + i is pmf[i]
+Distribution = namedtuple('Distribution', ['offset', 'pmf'])
+
+def distribution(node):
+    """Compute the exact distribution of an expression's value. Requires
+    NumPy. This can take a while for large expressions, so it should be run
+    off the event loop.
+
+    Returns: A Distribution.
+
+    Raises:
+        ValueError -- If the distribution would be too large to compute.
+    """
+    if isinstance(node, Constant):
+        return _point(node.value)
+    if isinstance(node, Roll):
+        if node.keep is not None:
+            if node.explode:
+                raise ValueError("Can't compute odds for exploding dice with keep")
+            return keep_distribution(node)
+        return convolve_power(die_distribution(node), node.count)
+    if isinstance(node, BinaryOp):
+        left = distribution(node.left)
+        right = distribution(node.right)
+        if node.op == '+':
+            return convolve(left, right)
+        if node.op == '-':
+            return convolve(left, negate(right))
+        return multiply(left, right)
+    if isinstance(node, Negate):
+        return negate(distribution(node.operand))
+    return distribution(node.expr)
+
+def _point(value):
+    return Distribution(value, numpy.ones(1))
+
+def _check_size(size):
+    if size > constants.MAX_ODDS_OUTCOMES:
+        raise ValueError('Too many possible outcomes to compute the odds')
+
+def die_distribution(roll):
+    """Get the distribution of a single die of a Roll. Exploding dice are
+    cut off once further explosions become negligibly unlikely.
+    """
+    sides = roll.sides
+    if sides == 0:
+        return _point(0)
+    if not roll.explode:
+        return Distribution(1, numpy.full(sides, 1 / sides))
+    explosions = 0
+    while (1 / sides) ** (explosions + 1) > constants.ODDS_EPSILON:
+        explosions += 1
+    _check_size((explosions + 1) * sides)
+    pmf = numpy.zeros((explosions + 1) * sides)
+    for k in range(explosions + 1):
+        # k explosions followed by a face other than the highest
+        pmf[k * sides:(k + 1) * sides - 1] = (1 / sides) ** (k + 1)
+    return Distribution(1, pmf)
+
+def convolve(a, b):
+    """Get the distribution of the sum of two independent values."""
+    size = len(a.pmf) + len(b.pmf) - 1
+    _check_size(size)
+    if min(len(a.pmf), len(b.pmf)) <= constants.ODDS_FFT_THRESHOLD:
+        pmf = numpy.convolve(a.pmf, b.pmf)
+    else:
+        n = 1 << (size - 1).bit_length()
+        pmf = numpy.fft.irfft(
+            numpy.fft.rfft(a.pmf, n) * numpy.fft.rfft(b.pmf, n),
+            n
+        )[:size]
+        # Remove rounding noise
+        pmf = numpy.clip(pmf, 0, None)
+        pmf /= pmf.sum()
+    return Distribution(a.offset + b.offset, pmf)
+
+def convolve_power(d, n):
+    """Get the distribution of the sum of n independent copies of a value,
+    by exponentiation by squaring.
+    """
+    _check_size((len(d.pmf) - 1) * n + 1)
+    result = _point(0)
+    while n:
+        if n & 1:
+            result = convolve(result, d)
+        n >>= 1
+        if n:
+            d = convolve(d, d)
+    return result
+
+def negate(d):
+    return Distribution(-(d.offset + len(d.pmf) - 1), d.pmf[::-1].copy())
+
+def multiply(a, b):
+    """Get the distribution of the product of two independent values."""
+    if len(a.pmf) == 1 or len(b.pmf) == 1:
+        if len(a.pmf) == 1:
+            a, b = b, a
+        factor = b.offset
+        if factor == 0:
+            return _point(0)
+        if factor < 0:
+            a, factor = negate(a), -factor
+        _check_size((len(a.pmf) - 1) * factor + 1)
+        pmf = numpy.zeros((len(a.pmf) - 1) * factor + 1)
+        pmf[::factor] = a.pmf
+        return Distribution(a.offset * factor, pmf)
+
+    _check_size(len(a.pmf) * len(b.pmf))
+    products = numpy.multiply.outer(
+        numpy.arange(a.offset, a.offset + len(a.pmf)),
+        numpy.arange(b.offset, b.offset + len(b.pmf))
+    ).ravel()
+    low = int(products.min())
+    _check_size(int(products.max()) - low + 1)
+    pmf = numpy.zeros(int(products.max()) - low + 1)
+    numpy.add.at(pmf, products - low, numpy.multiply.outer(a.pmf, b.pmf).ravel())
+    return Distribution(low, pmf)
+
+def _binomial_pmf(n, p, log_factorials):
+    """Get the probabilities of 0 to n successes in n trials, computed in
+    log space since the binomial coefficients of large pools overflow
+    floats.
+
+    Arguments:
+        log_factorials -- An array of log(k!) for k from 0 to at least n.
+    """
+    if p >= 1:
+        pmf = numpy.zeros(n + 1)
+        pmf[n] = 1.0
+        return pmf
+    c = numpy.arange(n + 1)
+    return numpy.exp(
+        log_factorials[n] - log_factorials[c] - log_factorials[n - c]
+        + c * math.log(p) + (n - c) * math.log1p(-p)
+    )
+
+def keep_distribution(roll):
+    """Get the distribution of the sum of the highest or lowest dice of a
+    roll.
+
+    The faces are visited from the kept end inwards. Given that the dice not
+    yet assigned show none of the faces visited so far, each is uniform over
+    the remaining faces, so the number showing the current face is binomial.
+    The state is the number of dice assigned so far and the kept sum.
+    """
+    count, sides = roll.count, roll.sides
+    keep = min(roll.keep[1], count)
+    if sides == 0 or keep == 0:
+        return _point(0)
+    work = sides * count * (count + 1) // 2 * (keep * sides + 1)
+    if work > constants.MAX_ODDS_KEEP_WORK:
+        raise ValueError('Too many dice to compute the odds of keeping some')
+
+    log_factorials = numpy.concatenate((
+        [ 0.0 ],
+        numpy.cumsum(numpy.log(numpy.arange(1, count + 1)))
+    ))
+    # states[j] is the distribution of the kept sum with j dice assigned
+    states = [ numpy.zeros(keep * sides + 1) for _ in range(count + 1) ]
+    states[0][0] = 1.0
+    if roll.keep[0] == 'h':
+        faces = range(sides, 0, -1)
     else:
-        return [int(match.group('constant'))]
+        faces = range(1, sides + 1)
+    for remaining_faces, face in enumerate(faces):
+        p = 1 / (sides - remaining_faces)
+        new_states = [ numpy.zeros(keep * sides + 1) for _ in range(count + 1) ]
+        for j, state in enumerate(states):
+            if not state.any():
+                continue
+            left = count - j
+            weights = _binomial_pmf(left, p, log_factorials)
+            for c, weight in enumerate(weights):
+                if weight == 0:
+                    continue
+                shift = max(0, min(c, keep - j)) * face
+                if shift:
+                    new_states[j + c][shift:] += weight * state[:-shift]
+                else:
+                    new_states[j + c] += weight * state
+        states = new_states
+
+    pmf = states[count]
+    nonzero = numpy.nonzero(pmf)[0]
+    return Distribution(
+        int(nonzero[0]),
+        pmf[nonzero[0]:nonzero[-1] + 1].copy()
+    )
+
+def describe_distribution(expr, d, target=None, bounded=True):
+    """Format a summary of a distribution: its mean, standard deviation,
+    range, percentiles and optionally the probability of reaching a target.
+
+    Arguments:
+        expr -- The expression, as it should be shown.
+        d -- The expression's Distribution.
+        target -- If not None, the value whose probability of being reached
+            or exceeded is shown.
+        bounded -- False if the distribution was cut off, e.g. because of
+            exploding dice, in which case it has no maximum.
+    """
+    values = numpy.arange(d.offset, d.offset + len(d.pmf))
+    mean = float((values * d.pmf).sum())
+    std = float(numpy.sqrt(((values - mean) ** 2 * d.pmf).sum()))
+    cdf = numpy.cumsum(d.pmf)
+    percentiles = ', '.join(
+        '{}%: {}'.format(
+            q,
+            d.offset + min(
+                int(numpy.searchsorted(cdf, q / 100 - 1e-12)),
+                len(cdf) - 1
+            )
+        ) for q in constants.ODDS_PERCENTILES
+    )
+    lines = [
+        '**{}**: mean {:.2f}, std. dev. {:.2f}, {}'.format(
+            expr,
+            mean,
+            std,
+            f'range {d.offset} to {d.offset + len(d.pmf) - 1}' if bounded
+                else f'minimum {d.offset}, no maximum'
+        ),
+        'Percentiles: ' + percentiles,
+    ]
+    if target is not None:
+        at_least = float(d.pmf[max(0, target - d.offset):].sum()) \
+            if target - d.offset < len(d.pmf) else 0.0
+        lines.append(f'P(≥ {target}) = {at_least:.4%}')
+    return '\n'.join(lines)
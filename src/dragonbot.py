@@ -1,38 +1,110 @@
+import time
+# Taken before the other imports, so that --profile-startup can time them
+_imports_started = time.perf_counter()
+
 import argparse
 import asyncio
 import atexit
 import codecs
-import collections
 import datetime
 import discord
+import importlib
 import io
 import json
 import logging
 import os
+import re
 import signal
 import sys
-import time
 
-from dotenv import load_dotenv
-from pymongo import MongoClient
+from dotenv import dotenv_values, load_dotenv
 
 from command_dispatcher import CommandDispatcher
-from dice import Dice
-from emotes import Emotes
-from insult import get_insult
-from keywords import Keywords
-from magic8ball import Magic8Ball
+from emoji_images import EmojiImages
+from health import Health
+from insult import InsultPool, random_insult
+from loop_monitor import LoopMonitor
+from startup_profile import StartupProfile
+from status_server import StatusServer
 from storage import storage_injector
-from urban_dictionary import UrbanDictionary
-from util import split_command, split_command_clean, command, server_command
-from wikipedia import Wikipedia
-from wolfram_alpha import WolframAlpha
+from util import split_command_clean, command, server_command
 import config
 import constants
+import log_pipeline
+import metrics
+import shards
+import traffic
 import util
 
 __version__ = '4.5.0'
 
+# Feature modules, as (module, class, description), in the order their
+# commands are registered. They can be reloaded while the bot is running.
+FEATURES = (
+    ('dice',             'Dice',            'Dice'),
+    ('emotes',           'Emotes',          'Emotes'),
+    ('keywords',         'Keywords',        'Keywords'),
+    ('magic8ball',       'Magic8Ball',      'Magic 8-Ball'),
+    ('urban_dictionary', 'UrbanDictionary', 'Urban Dictionary'),
+    ('wikipedia',        'Wikipedia',       'Wikipedia'),
+    ('wolfram_alpha',    'WolframAlpha',    'Wolfram Alpha'),
+)
+
+### METRICS ###
+
+messages_seen = metrics.counter(
+    'dragonbot_messages_total',
+    'Messages seen.'
+)
+commands_seen = metrics.counter(
+    'dragonbot_command_messages_total',
+    'Messages seen that start with the command prefix.'
+)
+commands_run = metrics.counter(
+    'dragonbot_commands_total',
+    'Commands run without error, by command.',
+    labels=('command',)
+)
+unknown_commands = metrics.counter(
+    'dragonbot_unknown_commands_total',
+    'Messages with the command prefix naming an unknown command.'
+)
+emotes_seen = metrics.counter(
+    'dragonbot_emotes_total',
+    'Emote messages handled.'
+)
+insult_pool_misses = metrics.counter(
+    'dragonbot_insult_pool_misses_total',
+    'Insults requested when the prefetched pool was empty.'
+)
+pipeline_seconds = metrics.histogram(
+    'dragonbot_pipeline_seconds',
+    'Time taken by each on_message pipeline.',
+    labels=('pipeline',)
+)
+pipeline_timeouts = metrics.counter(
+    'dragonbot_pipeline_timeouts_total',
+    'on_message pipelines cancelled for running over their time limit.',
+    labels=('pipeline',)
+)
+pipeline_errors = metrics.counter(
+    'dragonbot_pipeline_errors_total',
+    'on_message pipelines that raised an exception.',
+    labels=('pipeline',)
+)
+messages_before_ready = metrics.counter(
+    'dragonbot_messages_before_ready_total',
+    'Messages ignored because their guild was still being set up.'
+)
+start_time = metrics.gauge(
+    'dragonbot_start_time_seconds',
+    'When the bot was started, as a Unix timestamp.'
+)
+connect_seconds = metrics.gauge(
+    'dragonbot_connect_seconds',
+    'Time the bot took to become ready after starting.'
+)
+
 ### ARGUMENTS ###
 
 def getopts():
@@ -42,11 +114,22 @@ def getopts():
         'greet'            : 'DRAGONBOT_GREET',
         'insults'          : 'DRAGONBOT_INSULTS',
         'insults_file'     : 'DRAGONBOT_INSULTS_FILE',
+        'intents'          : 'DRAGONBOT_INTENTS',
         'log_level'        : 'DRAGONBOT_LOG_LEVEL',
+        'log_rate_limit'   : 'DRAGONBOT_LOG_RATE_LIMIT',
+        'log_sample_rate'  : 'DRAGONBOT_LOG_SAMPLE_RATE',
+        'loop'             : 'DRAGONBOT_LOOP',
+        'max_messages'     : 'DRAGONBOT_MAX_MESSAGES',
+        'member_cache'     : 'DRAGONBOT_MEMBER_CACHE',
         'mongodb_uri'      : 'DRAGONBOT_MONGODB_URI',
         'owner_id'         : 'DRAGONBOT_OWNER_ID',
         'presence'         : 'DRAGONBOT_PRESENCE',
+        'profile_startup'  : 'DRAGONBOT_PROFILE_STARTUP',
         'read_only'        : 'DRAGONBOT_READ_ONLY',
+        'record_messages'  : 'DRAGONBOT_RECORD_MESSAGES',
+        'shard_count'      : 'DRAGONBOT_SHARD_COUNT',
+        'shard_ids'        : 'DRAGONBOT_SHARD_IDS',
+        'status_port'      : 'DRAGONBOT_STATUS_PORT',
         'storage_dir'      : 'DRAGONBOT_STORAGE_DIR',
         'token'            : 'DRAGONBOT_TOKEN',
         'unknown_cmd_msg'  : 'DRAGONBOT_UNKNOWN_CMD_MSG',
@@ -59,11 +142,31 @@ def getopts():
         'greet'        : os.environ.get(env_opts['greet']) == 'True',
         'insults'      : os.environ.get(env_opts['insults']),
         'insults_file' : os.environ.get(env_opts['insults_file']),
+        'intents'      : os.getenv(env_opts['intents'], default='minimal'),
         'log_level'    : os.getenv(env_opts['log_level'], default='INFO'),
+        'log_rate_limit' : float(os.getenv(
+            env_opts['log_rate_limit'],
+            default=constants.LOG_RATE_LIMIT
+        )),
+        'log_sample_rate' : float(os.getenv(
+            env_opts['log_sample_rate'],
+            default=1.0
+        )),
+        'loop'         : os.getenv(env_opts['loop'], default='asyncio'),
+        'max_messages' : int(os.getenv(env_opts['max_messages'], default=0)),
+        'member_cache' : os.getenv(env_opts['member_cache'], default='none'),
         'mongodb_uri'  : os.environ.get(env_opts['mongodb_uri']),
         'owner_id'     : os.environ.get(env_opts['owner_id']),
         'presence'     : os.environ.get(env_opts['presence']),
+        'profile_startup' : os.environ.get(env_opts['profile_startup']) == 'True',
         'read_only'    : os.environ.get(env_opts['read_only']) == 'True',
+        'record_messages' : os.environ.get(env_opts['record_messages']),
+        'shard_count'  : os.environ.get(env_opts['shard_count']),
+        'shard_ids'    : os.environ.get(env_opts['shard_ids']),
+        'status_port'  : int(os.getenv(
+            env_opts['status_port'],
+            default=constants.STATUS_PORT
+        )),
         'storage_dir'  : os.environ.get(env_opts['storage_dir']),
         'token'        : os.environ.get(env_opts['token']),
         'unknown_cmd_msg' : os.environ.get(env_opts['unknown_cmd_msg']) == 'True',
@@ -116,6 +219,15 @@ def getopts():
         help='Like the --insults option, but takes a filename from which to'
             ' read the insults.'
     )
+    parser.add_argument(
+        '--intents',
+        type=str,
+        help='The gateway intents to enable besides those the bot\'s features'
+            ' need, as a comma-separated list of intent names, or "default" or'
+            ' "all" for discord.py\'s sets of intents. Default: minimal, only'
+            ' those the features need.'
+            ' Environment variable: ' + env_opts['intents']
+    )
     parser.add_argument(
         '-l', '--log-level',
         choices=constants.LOG_LEVELS,
@@ -123,6 +235,44 @@ def getopts():
             ' values as `--global-log-level`.'
             ' Environment variable: ' + env_opts['log_level']
     )
+    parser.add_argument(
+        '--log-rate-limit',
+        type=float,
+        help='The number of per-message log messages per second each line of'
+            ' code may log below the WARNING level; further messages are'
+            ' suppressed and counted. Default: {}.'.format(constants.LOG_RATE_LIMIT) +
+            ' Environment variable: ' + env_opts['log_rate_limit']
+    )
+    parser.add_argument(
+        '--log-sample-rate',
+        type=float,
+        help='The fraction, between 0 and 1, of per-message log messages'
+            ' below the WARNING level to keep. Default: 1.'
+            ' Environment variable: ' + env_opts['log_sample_rate']
+    )
+    parser.add_argument(
+        '--loop',
+        choices=constants.LOOP_BACKENDS,
+        help='The event loop implementation to use. "uvloop" requires the'
+            ' uvloop package. Default: asyncio.'
+            ' Environment variable: ' + env_opts['loop']
+    )
+    parser.add_argument(
+        '--max-messages',
+        type=int,
+        help='The number of messages to cache. None of the bot\'s features'
+            ' use the cache, so by default it is off. Default: 0.'
+            ' Environment variable: ' + env_opts['max_messages']
+    )
+    parser.add_argument(
+        '--member-cache',
+        type=str,
+        help='Which guild members to cache, as a comma-separated list of'
+            ' "joined", "online" and "voice", which need the members,'
+            ' presences and voice_states intents, respectively; "intents" to'
+            ' cache all those the intents allow; or "none". Default: none.'
+            ' Environment variable: ' + env_opts['member_cache']
+    )
     parser.add_argument(
         '--mongodb-uri',
         type=str,
@@ -142,6 +292,13 @@ def getopts():
         help="The bot's presence, given as JSON."
             ' Environment variable: ' + env_opts['presence']
     )
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help='Log how long each phase of startup took, including each guild\'s'
+            ' setup, once the bot is ready.'
+            ' Environment variable: ' + env_opts['profile_startup']
+    )
     parser.add_argument(
         '--read-only',
         action='store_true',
@@ -149,6 +306,38 @@ def getopts():
             ' the disk or database from doing so.'
             ' Environment variable: ' + env_opts['read_only']
     )
+    parser.add_argument(
+        '--record-messages',
+        type=str,
+        help='Append an anonymized log of the messages the bot handles to'
+            ' the given file, gzipped if its name ends in ".gz", for'
+            ' replaying with bench/replay.py.'
+            ' Environment variable: ' + env_opts['record_messages']
+    )
+    parser.add_argument(
+        '--shard-count',
+        type=int,
+        help='The number of shards to split the bot\'s gateway connection'
+            ' into. Without --shard-ids, this process runs all of them.'
+            ' Environment variable: ' + env_opts['shard_count']
+    )
+    parser.add_argument(
+        '--shard-ids',
+        type=str,
+        help='The shards this process runs, as a list of IDs and ranges of'
+            ' them, e.g. "0-3,6". Requires --shard-count. Processes running'
+            ' the other shards may share the storage directory or database.'
+            ' Environment variable: ' + env_opts['shard_ids']
+    )
+    parser.add_argument(
+        '--status-port',
+        type=int,
+        help='The port to serve the bot\'s status on: its liveness at /health,'
+            ' its readiness at /ready and its metrics, in the Prometheus text'
+            ' format, at /metrics. 0 disables the server.'
+            ' Default: {}.'.format(constants.STATUS_PORT) +
+            ' Environment variable: ' + env_opts['status_port']
+    )
     parser.add_argument(
         '--storage-dir',
         type=str,
@@ -224,6 +413,43 @@ def getopts():
         print('You must specify either --storage-dir or --mongodb-uri.')
         sys.exit(1)
 
+    if opts.loop not in constants.LOOP_BACKENDS:
+        print('--loop must be one of: ' + ', '.join(constants.LOOP_BACKENDS))
+        sys.exit(1)
+
+    try:
+        if opts.shard_count is not None:
+            opts.shard_count = int(opts.shard_count)
+        if opts.shard_ids is not None:
+            opts.shard_ids = shards.parse_shard_ids(opts.shard_ids)
+        shards.validate(opts.shard_ids, opts.shard_count)
+    except ValueError as e:
+        print(f'Invalid sharding options: {e}')
+        sys.exit(1)
+
+    try:
+        opts.intents = _parse_flags_opt(
+            opts.intents,
+            discord.Intents,
+            ('minimal', 'default', 'all')
+        )
+        opts.member_cache = _parse_flags_opt(
+            opts.member_cache,
+            discord.MemberCacheFlags,
+            ('none', 'intents')
+        )
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    if opts.max_messages < 0:
+        print('--max-messages must not be negative.')
+        sys.exit(1)
+
+    if not 0 <= opts.log_sample_rate <= 1:
+        print('--log-sample-rate must be between 0 and 1.')
+        sys.exit(1)
+
     opts.global_log_level = util.get_log_level(opts.global_log_level)
     opts.log_level = util.get_log_level(opts.log_level)
 
@@ -241,6 +467,27 @@ def _parse_json_opt(opts, arg):
         print(f'{arg} option is not valid JSON: ' + e.msg + '\n')
         sys.exit(1)
 
+def _parse_flags_opt(value, flags_class, presets):
+    """Parse an option that is either one of a few preset names or a
+    comma-separated list of flag names.
+
+    Returns: The preset name, or a list of the flag names.
+
+    Raises:
+        ValueError -- If a name is neither a preset nor a flag.
+    """
+    if value in presets:
+        return value
+    names = [ name.strip() for name in value.split(',') if name.strip() ]
+    for name in names:
+        if name not in flags_class.VALID_FLAGS:
+            raise ValueError('Unknown {} "{}". Expected one of: {}'.format(
+                flags_class.__name__,
+                name,
+                ', '.join(presets + tuple(flags_class.VALID_FLAGS))
+            ))
+    return names
+
 def _get_insults(insults):
     if 'insults' not in insults:
         raise ValueError('Malformed insults object, expected "insults" field')
@@ -253,39 +500,321 @@ def _get_insults(insults):
 
 ### INITIALIZATION ###
 
-loop   = asyncio.get_event_loop()
-client = discord.Client(loop=loop)
+class _ReleasesResources():
+    """Mixin for Discord clients that also release the bot's own resources
+    when they are closed.
+    """
+
+    async def close(self):
+        emoji_images.shutdown()
+        await insult_pool.stop()
+        await loop_monitor.stop()
+        if shard_stats is not None:
+            await shard_stats.stop()
+        if status_server is not None:
+            await status_server.stop()
+        await util.close_http_client()
+        await util.close_outbox()
+        await super().close()
+
+class DragonBotClient(_ReleasesResources, discord.Client):
+    """A discord.Client that also releases the bot's own resources when it
+    is closed.
+    """
+
+class ShardedDragonBotClient(_ReleasesResources, discord.AutoShardedClient):
+    """A discord.AutoShardedClient that also releases the bot's own
+    resources when it is closed.
+    """
+
+# Created by init(), once the event loop backend is known
+client = None
+# Created by init() when the bot is sharded
+shard_stats = None
+# Created by init() with --record-messages
+message_recorder = None
+# IDs of the servers whose storage is loaded, so that their messages are
+# handled, and of those whose storage is loading
+ready_guilds = set()
+loading_guilds = set()
+# When main() started logging in, for the startup profile
+login_started = None
+
+def create_event_loop(backend):
+    """Create an event loop and make it the current one.
+
+    Arguments:
+        backend -- 'asyncio' for the standard library's loop, or 'uvloop'.
+
+    Raises:
+        ImportError -- If uvloop was requested but is not installed.
+    """
+    if backend == 'uvloop':
+        import uvloop
+        loop = uvloop.new_event_loop()
+    else:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+def required_intents():
+    """Get the names of the gateway intents the bot and its feature modules
+    need. This imports the modules, but does not initialize them.
+    """
+    names = set(constants.BASE_INTENTS)
+    for module_name, class_name, _ in FEATURES:
+        feature = getattr(importlib.import_module(module_name), class_name)
+        names.update(feature.intents)
+    return names
+
+def client_options():
+    """Get the gateway intents, member cache flags and message cache size
+    for the Discord client, from the options.
+
+    Returns: A dict of keyword arguments for discord.Client.
+    """
+    if config.intents == 'default':
+        intents = discord.Intents.default()
+    elif config.intents == 'all':
+        intents = discord.Intents.all()
+    else:
+        intents = discord.Intents.none()
+        if config.intents != 'minimal':
+            for name in config.intents:
+                setattr(intents, name, True)
+    for name in required_intents():
+        setattr(intents, name, True)
+
+    if config.member_cache == 'intents':
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    else:
+        member_cache_flags = discord.MemberCacheFlags.none()
+        if config.member_cache != 'none':
+            for name in config.member_cache:
+                setattr(member_cache_flags, name, True)
+
+    return {
+        'intents' : intents,
+        'member_cache_flags' : member_cache_flags,
+        # 0 would mean discord.py's default of 1000; None turns it off
+        'max_messages' : config.max_messages or None,
+    }
+
+def create_client(loop):
+    """Create the Discord client on a loop and register the event
+    handlers with it. With a shard count configured, the client runs the
+    configured shards, or all of them, in this process.
+
+    Raises:
+        ValueError -- If the member cache flags need intents that are not
+            enabled.
+    """
+    options = client_options()
+    if config.shard_count is None:
+        new_client = DragonBotClient(loop=loop, **options)
+    else:
+        new_client = ShardedDragonBotClient(
+            loop=loop,
+            shard_count=config.shard_count,
+            shard_ids=config.shard_ids,
+            **options
+        )
+    for handler in (
+        on_ready,
+        on_connect,
+        on_shard_connect,
+        on_guild_join,
+        on_guild_remove,
+        on_message,
+    ):
+        new_client.event(handler)
+    return new_client
+
+def shard_snapshot():
+    """Get this process's statistics that are added up across shards."""
+    return {
+        'guilds'   : len(client.guilds),
+        'messages' : messages_seen.get(),
+        'commands' : commands_seen.get(),
+        'emotes'   : emotes.count_emotes(),
+        'keywords' : keywords.count_keywords(),
+    }
+
+def recorded_guild_info(guild):
+    """Get the names of a guild's keywords and emotes, for the message log."""
+    return {
+        'keywords' : list(keywords.keywords.get(guild.id, ())),
+        'emotes'   : list(emotes.emotes.get(guild.id, ())),
+    }
+
+def create_features(reload=False, profile=None):
+    """Import the feature modules and construct their objects.
+
+    Arguments:
+        reload -- Whether to reload the modules first.
+        profile -- If given, the StartupProfile to record each module's
+            import and initialization in.
+
+    Returns: A dict of the objects by module name.
+    """
+    features = {}
+    for module_name, class_name, description in FEATURES:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        if reload:
+            module = importlib.reload(module)
+        logger.info('Initializing %s module', description)
+        features[module_name] = getattr(module, class_name)()
+        if profile is not None:
+            profile.record(
+                f'{description} module',
+                time.perf_counter() - start
+            )
+    return features
+
+def create_dispatcher(features):
+    """Create a CommandDispatcher with the bot's own commands and those of
+    the feature objects.
+    """
+    assert config.owner_id is not None, 'No owner ID configured'
+    owner_only = { int(config.owner_id) } # For registering commands as owner-only
+    cd = CommandDispatcher(read_only=config.read_only)
+    cd.register("addemoji", add_emoji, may_use=owner_only)
+    cd.register("config", show_config, may_use=owner_only)
+    cd.register("help", show_help)
+    cd.register("insult", insult)
+    cd.register("lag", show_lag, may_use=owner_only)
+    cd.register("play", set_current_game, may_use=owner_only)
+    cd.register("purge", purge, may_use=owner_only)
+    cd.register("reload", reload_command, may_use=owner_only)
+    cd.register("say", say, may_use=owner_only)
+    cd.register("stats", show_stats)
+    cd.register("test", test, may_use=owner_only, rw=True)
+    cd.register("truth", truth)
+    cd.register("version", version_command)
+    for feature in features.values():
+        feature.register_commands(cd)
+    logger.debug(", ".join(cd.known_command_names()))
+    return cd
+
+def install_features(new_features, dispatcher):
+    """Make a set of feature objects and their dispatcher the ones that
+    handle messages.
+    """
+    global command_dispatcher, emotes, features, keywords
+    features = new_features
+    emotes = features['emotes']
+    keywords = features['keywords']
+    command_dispatcher = dispatcher
+    metrics.gauge(
+        'dragonbot_emotes',
+        'Emotes known across all guilds.'
+    ).set_function(emotes.count_emotes)
+    metrics.gauge(
+        'dragonbot_keywords',
+        'Keywords known across all guilds.'
+    ).set_function(keywords.count_keywords)
+
+def reload_config():
+    """Read the options again, from the .env file and the command line.
+    Options that cannot change without a restart keep their values, and the
+    new log levels and rates take effect.
+
+    Raises:
+        ValueError -- If the new options are invalid. The current ones are
+            kept.
+    """
+    # Variables that were set in the real environment take precedence over
+    # the .env file, as they did at startup.
+    for name, value in dotenv_values().items():
+        if name not in startup_environment and value is not None:
+            os.environ[name] = value
+    saved = { name : getattr(config, name) for name in constants.RESTART_OPTIONS }
+    try:
+        getopts()
+    except SystemExit:
+        raise ValueError('Invalid options')
+    for name, value in saved.items():
+        if getattr(config, name) != value:
+            logger.warning('Changing the %s option requires a restart', name)
+            setattr(config, name, value)
+    logging.getLogger().setLevel(config.global_log_level)
+    logger.setLevel(config.log_level)
+    log_pipeline.set_rates(config.log_rate_limit, config.log_sample_rate)
+
+def reload_features():
+    """Reload the options and the feature modules, and switch to new
+    feature objects and a new CommandDispatcher.
+
+    The client stays connected, and guild storage and keyword automata carry
+    over to the new objects. Commands already running finish on the old
+    ones. If anything fails, the old objects stay in use.
+
+    Raises:
+        Exception -- Whatever reloading the options or a module, or
+            constructing a feature object, raised.
+    """
+    logger.info('Reloading feature modules')
+    reload_config()
+    new_features = create_features(reload=True)
+    missing = required_intents() - {
+        name for name, enabled in client.intents if enabled
+    }
+    if missing:
+        logger.warning(
+            'Reloaded features need gateway intents %s, which are only'
+            ' enabled by a restart',
+            ', '.join(sorted(missing))
+        )
+    new_features['emotes'].carry_over(features['emotes'])
+    new_features['keywords'].carry_over(features['keywords'])
+    install_features(new_features, create_dispatcher(new_features))
+    logger.info('Reloaded %d feature modules', len(new_features))
 
 def init():
     """Initialize the bot."""
     global                  \
         client,             \
-        command_dispatcher, \
         config,             \
-        emotes,             \
-        keywords,           \
+        guild_setup_slots,  \
+        emoji_images,       \
+        insult_pool,        \
+        hot_logger,         \
         logger,             \
-        stats
+        loop_monitor,       \
+        message_recorder,   \
+        shard_stats,        \
+        startup_environment, \
+        startup_profile,    \
+        status_server
 
-    # Load environment variables
-    load_dotenv()
+    startup_profile = StartupProfile(started=_imports_started)
+    startup_profile.record('imports', time.perf_counter() - _imports_started)
 
-    # Get options
-    getopts()
+    # Load environment variables
+    startup_environment = set(os.environ)
+    with startup_profile.phase('options'):
+        load_dotenv()
+        getopts()
     assert config.initialized, 'Settings were not initialized'
+    startup_profile.detailed = config.profile_startup
 
     if (config.version):
         print(version())
         sys.exit(0)
 
-    # Initialize logger
-    logging.basicConfig(
-        level=config.global_log_level,
-        format=constants.LOG_FORMAT,
-        datefmt=constants.DATE_FORMAT
-    )
+    # Initialize logger. Records are written out by a background thread;
+    # stopping its listener at exit flushes them.
+    with startup_profile.phase('logging'):
+        log_listener = log_pipeline.setup_logging(
+            config.global_log_level,
+            config.log_rate_limit,
+            config.log_sample_rate
+        )
+    atexit.register(log_listener.stop)
     logger = logging.getLogger('dragonbot')
     logger.setLevel(config.log_level)
+    hot_logger = log_pipeline.hot_path_logger('dragonbot')
     logger.info(
         'Set logging level to %s, global level to %s',
         config.log_level,
@@ -306,68 +835,94 @@ def init():
             os.execv(sys.executable, ['python'] + sys.argv)
         except Exception as e:
             logger.warning(e)
-    signal.signal(signal.SIGUSR1, restart)
+    signal.signal(signal.SIGUSR2, restart)
 
     if config.read_only:
         logger.info('Running in read-only mode')
 
+    # Create the event loop and the client that runs on it
+    with startup_profile.phase('event loop and client'):
+        try:
+            loop = create_event_loop(config.loop)
+        except ImportError:
+            logger.critical('The %s event loop is not installed', config.loop)
+            sys.exit(1)
+        logger.info('Using the %s event loop', config.loop)
+        try:
+            client = create_client(loop)
+        except ValueError as e:
+            logger.critical('Invalid --member-cache: %s', e)
+            sys.exit(1)
+        logger.info(
+            'Enabled gateway intents: %s',
+            ', '.join(name for name, enabled in client.intents if enabled)
+        )
+        if config.shard_count is not None:
+            shard_stats = shards.ShardStats(client, shard_snapshot)
+            logger.info('Running shards %s', shard_stats.key())
+
+    # Limits how many guilds load their storage at once
+    guild_setup_slots = asyncio.Semaphore(constants.GUILD_SETUP_CONCURRENCY)
+
+    # Reload the feature modules on SIGUSR1, between events
+    def reload_on_signal():
+        logger.info('Received reload signal')
+        try:
+            reload_features()
+        except Exception:
+            logger.exception('Failed to reload feature modules')
+    loop.add_signal_handler(signal.SIGUSR1, reload_on_signal)
+
     # Initialize storage directory if needed
-    if config.storage_dir:
-        logger.info('Creating storage directory %s', config.storage_dir)
-        os.makedirs(config.storage_dir, exist_ok=True)
-    # Otherwise initialize a Mongo client
-    elif config.mongodb_uri:
-        logger.info('Initializing Mongo client')
-        config.mongo = MongoClient(config.mongodb_uri)
-
-        def mongo_cleanup():
-            logger.info('Closing MongoDB connection(s)')
-            config.mongo.close()
-        atexit.register(mongo_cleanup)
+    with startup_profile.phase('storage'):
+        if config.storage_dir:
+            logger.info('Creating storage directory %s', config.storage_dir)
+            os.makedirs(config.storage_dir, exist_ok=True)
+        # Otherwise initialize a Mongo client. pymongo is only imported
+        # when it is used.
+        elif config.mongodb_uri:
+            logger.info('Initializing Mongo client')
+            from pymongo import MongoClient
+            config.mongo = MongoClient(config.mongodb_uri)
+
+            def mongo_cleanup():
+                logger.info('Closing MongoDB connection(s)')
+                config.mongo.close()
+            atexit.register(mongo_cleanup)
 
     # Initialize modules
-    logger.info('Initializing Dice module')
-    dice = Dice()
-    logger.info('Initializing Emotes module')
-    emotes = Emotes()
-    logger.info('Initializing Keywords module')
-    keywords = Keywords()
-    logger.info('Initializing Magic 8-Ball module')
-    eightball = Magic8Ball()
-    logger.info('Initializing Urban Dictionary module')
-    urbandictionary = UrbanDictionary()
-    logger.info('Initializing Wolfram Alpha module')
-    wolfram = WolframAlpha()
-    logger.info('Initializing Wikipedia module')
-    wikipedia = Wikipedia()
-
-    # Set up command dispatcher
-    assert config.owner_id is not None, 'No owner ID configured'
-    owner_only = { int(config.owner_id) } # For registering commands as owner-only
-    cd = CommandDispatcher(read_only=config.read_only)
-    cd.register("addemoji", add_emoji, may_use=owner_only)
-    cd.register("config", show_config, may_use=owner_only)
-    cd.register("help", show_help)
-    cd.register("insult", insult)
-    cd.register("play", set_current_game, may_use=owner_only)
-    cd.register("purge", purge, may_use=owner_only)
-    cd.register("say", say, may_use=owner_only)
-    cd.register("stats", show_stats)
-    cd.register("test", test, may_use=owner_only, rw=True)
-    cd.register("truth", truth)
-    cd.register("version", version_command)
-    dice.register_commands(cd)
-    emotes.register_commands(cd)
-    keywords.register_commands(cd)
-    eightball.register_commands(cd)
-    urbandictionary.register_commands(cd)
-    wikipedia.register_commands(cd)
-    wolfram.register_commands(cd)
-    command_dispatcher = cd # Make global
+    new_features = create_features(profile=startup_profile)
+    with startup_profile.phase('other modules'):
+        insult_pool = InsultPool()
+        emoji_images = EmojiImages()
+        loop_monitor = LoopMonitor()
+        status_server = (
+            StatusServer(
+                config.status_port,
+                health=Health(client, loop_monitor)
+            ) if config.status_port else None
+        )
 
-    logger.debug(", ".join(cd.known_command_names()))
+    if config.record_messages:
+        message_recorder = traffic.MessageRecorder(
+            config.record_messages,
+            guild_info=recorded_guild_info
+        )
+        atexit.register(message_recorder.close)
+
+    # Metrics read from other modules when they are rendered
+    metrics.register('event loop', loop_monitor.collect)
+    metrics.register('startup', startup_profile.collect)
+    if shard_stats is not None:
+        metrics.register('shards', shard_stats.collect)
+    metrics.gauge(
+        'dragonbot_gateway_latency_seconds',
+        'Latency between a gateway heartbeat and its acknowledgement.'
+    ).set_function(lambda: client.latency)
 
-    stats = collections.defaultdict(int)
+    # Set up command dispatcher
+    with startup_profile.phase('command dispatcher'):
+        install_features(new_features, create_dispatcher(new_features))
 
     assert None not in (
         client,
@@ -376,17 +931,27 @@ def init():
         emotes,
         keywords,
         logger,
-        stats
     ), 'Variable was not initialized'
 
     logger.info('Finished pre-login initialization')
 
 def main():
+    global login_started
     init()
     logger.info(version())
     logger.info('PID is %d', os.getpid())
     assert version(), "version() should return a non-empty string, but didn't"
-    stats['start time'] = time.time()
+    start_time.set(time.time())
+    if status_server is not None:
+        try:
+            with startup_profile.phase('status server'):
+                client.loop.run_until_complete(status_server.start())
+        except OSError:
+            logger.exception(
+                'Could not serve status on port %d',
+                config.status_port
+            )
+    login_started = time.perf_counter()
     try:
         client.run(config.token)
     except Exception:
@@ -418,6 +983,10 @@ def help_message():
     ], [
         '{prefix}config',
         'Show the current bot configuration. Owner only.'
+    ], [
+        '{prefix}lag',
+        'Show the event loop lag histogram and the stacks of recent stalls,'
+        ' in a direct message. Owner only.'
     ], [
         '{prefix}insult `<someone\'s name>`',
         'Insult someone with a random insult.'
@@ -428,9 +997,15 @@ def help_message():
     ], [
         '{prefix}purge `<@user>` `<count>`',
         'Purges up to `<count>` messages from the mentioned <@user>.'
-        ' `<count>` must be at least 2 but no more than 100.'
+        ' `<count>` must be at least 2 but no more than {}.'.format(
+            constants.MAX_PURGE
+        ) +
         ' Deleted messages cannot be older than 14 days.'
         ' Subject to the limitations imposed by the Discord API.'
+    ], [
+        '{prefix}reload',
+        'Reload the options and the feature modules, without reconnecting.'
+        ' Owner only.'
     ], [
         '{prefix}say `<channel ID>` `<message>`',
         'Have the bot post a message in a given channel. Owner only.'
@@ -458,7 +1033,7 @@ def help_message():
 ### COMMANDS ###
 
 @command
-async def truth(client, message):
+async def truth(client, message, _cmd):
     """Say the truth."""
     assert None not in (client, message), 'Got None, expected value'
     await message.channel.send(
@@ -469,28 +1044,28 @@ async def truth(client, message):
     )
 
 @command
-async def version_command(_client, message):
+async def version_command(_client, message, _cmd):
     """Say the bot's version."""
     await message.channel.send(version())
 
 @command
-async def show_help(_client, message):
+async def show_help(_client, message, cmd):
     """Show help."""
-    _command, argstr = util.split_command(message)
+    argstr = cmd.argstr
     if argstr is None:
         help_msg = help_message()
     elif argstr.casefold() == 'dice':
-        help_msg = Dice.help()
+        help_msg = features['dice'].help()
     elif argstr.casefold() == 'emotes':
-        help_msg = Emotes.help()
+        help_msg = features['emotes'].help()
     elif argstr.casefold() == 'keywords':
-        help_msg = Keywords.help()
+        help_msg = features['keywords'].help()
     elif argstr.casefold() == 'urban dictionary':
-        help_msg = UrbanDictionary.help()
+        help_msg = features['urban_dictionary'].help()
     elif argstr.casefold() in ('wolfram', 'wolfram alpha'):
-        help_msg = WolframAlpha.help()
+        help_msg = features['wolfram_alpha'].help()
     elif argstr.casefold() in ('wiki', 'wikipedia'):
-        help_msg = Wikipedia.help()
+        help_msg = features['wikipedia'].help()
     else:
         await message.channel.send("I don't have help for that.")
     if isinstance(help_msg, discord.Embed):
@@ -500,7 +1075,7 @@ async def show_help(_client, message):
         await message.channel.send(help_msg)
 
 @command
-async def show_config(_client, message):
+async def show_config(_client, message, _cmd):
     """Show the current bot configuration."""
     dm_channel = message.author.dm_channel
     if dm_channel is None:
@@ -522,16 +1097,70 @@ async def show_config(_client, message):
     await dm_channel.send(embed=embed)
 
 @command
-async def test(_client, message):
+async def show_lag(_client, message, _cmd):
+    """Send the event loop lag report to the owner."""
+    dm_channel = message.author.dm_channel
+    if dm_channel is None:
+        await message.author.create_dm()
+        dm_channel = message.author.dm_channel
+    # Leave room for the code block markers
+    for chunk in util.chunker(loop_monitor.dump(), constants.MAX_CHARACTERS - 8):
+        await dm_channel.send(f'```\n{chunk}```')
+
+@command
+async def reload_command(_client, message, _cmd):
+    """Reload the options and the feature modules."""
+    start = time.perf_counter()
+    try:
+        reload_features()
+    except Exception as e:
+        logger.exception('Failed to reload feature modules')
+        await message.channel.send(
+            f'Reload failed, keeping the current modules: {e}'
+        )
+        return
+    await message.channel.send('Reloaded {} modules in {:.0f} ms.'.format(
+        len(features),
+        (time.perf_counter() - start) * 1000
+    ))
+
+@command
+async def test(_client, message, _cmd):
     test_message = 'a' * 2500
     await message.channel.send(test_message)
 
 @command
-async def show_stats(_client, message):
+async def show_stats(_client, message, _cmd):
     """Show session statistics."""
-    stats['uptime']         = time.time() - stats['start time']
-    stats['emotes known']   = emotes.count_emotes()
-    stats['keywords known'] = keywords.count_keywords()
+    ratio, hits, lookups = util.ResponseCache.hit_ratio()
+    cache_hits = f'{ratio:.0%} ({hits}/{lookups})' if ratio is not None else 'N/A'
+    pool = (await util.get_http_client()).pool_stats()
+    connections = '{} in use, {} idle; {} of {} reused'.format(
+        pool['in use'],
+        pool['idle'],
+        pool['connections reused'],
+        pool['connections reused'] + pool['connections created'],
+    )
+    log_stats = log_pipeline.stats()
+    log_records = '{} suppressed, {} sampled out, {} dropped'.format(
+        log_stats['suppressed'],
+        log_stats['sampled out'],
+        log_stats['dropped'],
+    )
+    outbox = util.get_outbox()
+    latency = outbox.latency()
+    queue = '{} queued, {} sent, {} merged; {} median wait'.format(
+        outbox.depth(),
+        outbox.stats['sent'],
+        outbox.stats['merged'],
+        util.td_str(latency) if latency is not None else 'N/A',
+    )
+    upstreams = '\n'.join(
+        f"{name}: {breaker['state']}, {breaker['trips']} trip(s)"
+            for name, breaker in sorted(
+                (await util.get_http_client()).breaker_stats().items()
+            )
+    ) or 'N/A'
 
     embed = discord.Embed(
         title='Session Statistics',
@@ -540,24 +1169,55 @@ async def show_stats(_client, message):
         color=constants.EMBED_COLOR,
     )
     for field in [
-        [ 'Start time',     util.ts_to_iso(stats['start time']), True ],
-        [ 'Connect time',   util.td_str(stats['connect time']),  True ],
-        [ 'Uptime',         util.td_str(stats['uptime']),        True ],
+        [ 'Start time',     util.ts_to_iso(start_time.get()),    True ],
+        [ 'Connect time',   util.td_str(connect_seconds.get()),  True ],
+        [ 'Uptime',         util.td_str(time.time() - start_time.get()), True ],
         [ 'Avg. latency',   util.td_str(client.latency),         True ],
-        [ 'Messages seen',  stats['messages seen'],              True ],
-        [ 'Commands seen',  stats['commands seen'],              True ],
-        [ 'Emotes known',   stats['emotes known'],               True ],
-        [ 'Keywords known', stats['keywords known'],             True ],
+        [ 'Messages seen',  messages_seen.get(),                 True ],
+        [ 'Commands seen',  commands_seen.get(),                 True ],
+        [ 'Emotes known',   emotes.count_emotes(),               True ],
+        [ 'Keywords known', keywords.count_keywords(),           True ],
+        [ 'Cache hit ratio', cache_hits,                         True ],
+        [ 'HTTP connections', connections,                       True ],
+        [ 'Upstream APIs',  upstreams,                           True ],
+        [ 'Typing calls saved', util.DeferredTyping.saved,       True ],
+        [ 'Outbound queue', queue,                               True ],
+        [ 'Log records',    log_records,                         True ],
+        [ 'Loop lag',       loop_monitor.summary(),              True ],
     ]:
         embed.add_field(name=field[0], value=field[1], inline=(field[2] or False))
+    if shard_stats is not None:
+        totals, processes = await shard_stats.totals()
+        embed.add_field(
+            name='Shards',
+            value='Running {}; {} process(es) reporting'.format(
+                shard_stats.key(),
+                len(processes)
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name='All shards',
+            value='\n'.join(
+                f'{name.capitalize()}: {totals.get(name, 0)}'
+                    for name in (
+                        'guilds',
+                        'messages',
+                        'commands',
+                        'emotes',
+                        'keywords',
+                    )
+            ),
+            inline=False
+        )
     embed.set_footer(text=version())
     await message.channel.send(embed=embed)
 
 @command
-async def say(client, message):
+async def say(client, message, cmd):
     """Say something specified by the !say command."""
-    command, argstr = split_command(message)
-    if command is None or argstr is None:
+    argstr = cmd.argstr
+    if argstr is None:
         await message.channel.send('Nothing to say.')
         return
     try:
@@ -573,13 +1233,16 @@ async def say(client, message):
         await message.channel.send("Couldn't find channel.")
 
 @command
-async def insult(_client, message):
+async def insult(_client, message, _cmd):
     """Handles the !insult commmand.
 
     If the command message has a single user or role mention, the name of that
     user or role is used in the insult. If no one is mentioned but a string is
     provided, that string will be insulted. Otherwise, the user who invoked the
     command will be insulted.
+
+    Insults come from the prefetched pool. If it has run dry, one of the
+    configured random insults is used instead of waiting for the insult API.
     """
     _command, name = split_command_clean(message)
     mentions       = len(message.mentions)
@@ -593,20 +1256,19 @@ async def insult(_client, message):
         name = None
     logger.info('Insult: name is %s', name)
 
-    try:
-        insult = await get_insult(who=name)
-        if not insult:
-            await message.channel.send('Error retrieving insult')
-        else:
-            await message.channel.send(insult)
-    except Exception:
-        await message.channel.send('Error retrieving insult from server.')
-        logger.exception('Error retrieving insult from server')
+    insult = insult_pool.take(who=name)
+    if insult is None:
+        insult_pool_misses.inc()
+        insult = '{}, {}.'.format(
+            name or message.author.display_name,
+            random_insult()
+        )
+    await message.channel.send(insult)
 
 @command
-async def set_current_game(client, message):
+async def set_current_game(client, message, cmd):
     """Handles the !play command."""
-    _command, args = split_command(message)
+    args = cmd.argstr
     try:
         game, url = args.rsplit(maxsplit=1)
     except ValueError:
@@ -622,29 +1284,57 @@ async def set_current_game(client, message):
         await message.channel.send('Error changing presence.')
 
 @server_command
-async def add_emoji(_client, message):
-    _command, args = split_command(message)
+async def add_emoji(_client, message, cmd):
+    args = cmd.argstr
     fp   = None
     name = None
     try:
         name, image_url = args.rsplit(maxsplit=1)
+    except ValueError:
+        image_url = None
+    if image_url is not None:
+        # Stream the file from the URL, giving up early if it is too large
+        # or not an image
         client = await util.get_http_client()
-        rsp    = await client.get(image_url)
-        if rsp.status != 200:
+        try:
+            fp = await client.download(
+                image_url,
+                upstream='emoji',
+                max_size=emoji_images.max_source_size(),
+                content_types=('image/',)
+            )
+        except util.HTTPStatusError:
             await message.channel.send('Error retrieving file from URL')
             return
-        # Get file from URL
-        fp = io.BytesIO(await rsp.read())
-    except ValueError:
+        except util.DownloadError as e:
+            await message.channel.send(f"I can't use that file: {e}.")
+            return
+    else:
         if not message.attachments:
             await message.channel.send('Invalid syntax: need a name and a file.')
             return
         name = args
         # Handle attached file
+        attachment = message.attachments[0]
+        if attachment.size > emoji_images.max_source_size():
+            await message.channel.send(
+                "I can't use that file: it is larger than"
+                f' {emoji_images.max_source_size() // 1024} KB.'
+            )
+            return
         fp = io.BytesIO()
-        await message.attachments[0].save(fp=fp)
+        await attachment.save(fp=fp)
+    with fp:
+        image = fp.read()
+    # Shrink the image to fit the emoji size limit if necessary
     try:
-        await message.guild.create_custom_emoji(name=name, image=fp.getvalue())
+        image = await emoji_images.fit(image)
+    except (ValueError, OSError) as e:
+        await message.channel.send(f"I can't use that image: {e}.")
+        logger.info('Error fitting image for emoji', exc_info=True)
+        return
+    try:
+        await message.guild.create_custom_emoji(name=name, image=image)
     except discord.Forbidden:
         await message.channel.send("I don't have permission to do that here.")
         logger.exception('Error creating custom emoji')
@@ -659,12 +1349,18 @@ async def add_emoji(_client, message):
     await message.channel.send('Emoji created!')
 
 @command
-async def purge(_client, message):
-    """Handles the !purge command."""
-    _command, args = split_command(message)
+async def purge(_client, message, cmd):
+    """Handles the !purge command.
+
+    The channel history is scanned newest first, back to the bulk-delete
+    cutoff, and matching messages are deleted in chunks of 100 while the
+    scan continues. Only one chunk is held in memory besides the one being
+    deleted.
+    """
+    args = cmd.argstr
     try:
         user, count = args.split(maxsplit=1)
-    except ValueError:
+    except (AttributeError, ValueError):
         await message.channel.send('Need a name and a count.')
         return
     try:
@@ -672,70 +1368,155 @@ async def purge(_client, message):
     except ValueError:
         await message.channel.send('Count must be an integer.')
         return
+    match = re.fullmatch(r'<@!?(\d+)>|(\d+)', user)
+    if match is None:
+        await message.channel.send('Need a user mention or ID.')
+        return
+    user_id = int(match.group(1) or match.group(2))
 
-    if count > 100:
-        await message.channel.send("Can't delete more than 100 messages.")
+    if count > constants.MAX_PURGE:
+        await message.channel.send(
+            f"Can't delete more than {constants.MAX_PURGE} messages."
+        )
         return
     if count < 2:
         await message.channel.send("Can't delete fewer than 2 messages.")
         return
 
-    delete_me = []
-    async for message in message.channel.history(limit=1000):
-        if message.author.mention == user:
-            delete_me.append(message)
-        if len(delete_me) >= count:
-            break
-    if delete_me:
-        try:
-            await message.channel.delete_messages(delete_me)
-            await message.channel.send(
-                'Deleted {} messages'.format(len(delete_me))
-            )
-        except discord.Forbidden:
-            await message.channel.send("I'm not allowed to do that.")
-        except discord.HTTPException as e:
-            await message.channel.send(
-                'An error occurred' + (': ' + e.text if e.text else "") + '.'
-            )
-            logger.exception('Error deleting messages')
-        except Exception:
-            logger.exception('Error deleting messages')
+    channel = message.channel
+    status = await channel.send(f'Deleting up to {count} messages...')
+    cutoff = datetime.datetime.utcnow() \
+        - datetime.timedelta(seconds=constants.BULK_DELETE_MAX_AGE)
+    deleted = 0
+    last_progress = time.monotonic()
+    in_flight = None
+
+    async def finish_chunk():
+        """Wait for the chunk being deleted, if any, and count it."""
+        nonlocal deleted, in_flight, last_progress
+        if in_flight is None:
+            return
+        task, size = in_flight
+        in_flight = None
+        await task
+        deleted += size
+        if time.monotonic() - last_progress >= constants.PURGE_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await status.edit(content=f'Deleted {deleted} of {count} messages...')
+
+    async def delete_chunk(chunk):
+        """Start deleting a chunk once the previous one is done, without
+        waiting for it, so that the history scan can continue.
+        """
+        nonlocal in_flight
+        await finish_chunk()
+        in_flight = (
+            asyncio.ensure_future(channel.delete_messages(chunk)),
+            len(chunk)
+        )
+
+    try:
+        chunk = []
+        found = 0
+        async for old_message in channel.history(limit=None, before=status):
+            if old_message.created_at < cutoff:
+                break
+            if old_message.author.id != user_id:
+                continue
+            chunk.append(old_message)
+            found += 1
+            if found == count:
+                break
+            if len(chunk) == constants.BULK_DELETE_MAX:
+                await delete_chunk(chunk)
+                chunk = []
+        if chunk:
+            await delete_chunk(chunk)
+        await finish_chunk()
+    except discord.Forbidden:
+        await status.edit(content="I'm not allowed to do that.")
+        return
+    except discord.HTTPException as e:
+        logger.exception('Error deleting messages')
+        await status.edit(
+            content=f'An error occurred after deleting {deleted} messages'
+                + (': ' + e.text if e.text else '') + '.'
+        )
+        return
+    except Exception:
+        logger.exception('Error deleting messages')
+        await status.edit(
+            content=f'An error occurred after deleting {deleted} messages.'
+        )
+        return
+    finally:
+        if in_flight is not None:
+            in_flight[0].cancel()
+
+    if deleted:
+        await status.edit(content=f'Deleted {deleted} messages.')
     else:
-        await message.channel.send(
-            "I don't see any messages from that user in the recent history."
+        await status.edit(
+            content="I don't see any messages from that user in the last"
+                ' 14 days.'
         )
 
 ### EVENT HANDLERS ###
 
-@client.event
 async def on_ready():
     """Event handler for becoming ready."""
-    global emotes, keywords
     assert client is not None, 'client is None in on_ready()'
     logger.info('Bot is ready')
-    stats['connect time'] = time.time() - stats['start time']
-
-    # Log server and default channel
-    for server in client.guilds:
-        logger.info("Logged into server %s %s", server, server.id)
-        if (
-            hasattr(server, 'default_channel')
-            and server.default_channel is not None
-        ):
-            logger.info("Default channel is %s", server.default_channel)
-        for channel in server.channels:
-            if isinstance(channel, discord.TextChannel):
-                logger.info('\tChannel: %s %s', channel.name, channel.id)
+    connect_seconds.set(time.time() - start_time.get())
+    profiling = startup_profile.finished is None
+    if profiling and login_started is not None:
+        startup_profile.record(
+            'login and gateway',
+            time.perf_counter() - login_started
+        )
+    insult_pool.start()
+    loop_monitor.start()
+    if shard_stats is not None:
+        shard_stats.start()
+
+    # Set up the guilds concurrently. Each guild's messages are handled as
+    # soon as it is set up, without waiting for the others.
+    guilds = list(client.guilds)
+    guilds_started = time.perf_counter()
+    results = await asyncio.gather(
+        *(setup_guild(server) for server in guilds),
+        return_exceptions=True
+    )
+    for server, result in zip(guilds, results):
+        if isinstance(result, Exception):
+            logger.error(
+                'Failed to set up server %s %s',
+                server,
+                server.id,
+                exc_info=result
+            )
+    guilds_seconds = time.perf_counter() - guilds_started
+    logger.info(
+        'Set up %d of %d server(s) in %.3fs',
+        len(ready_guilds),
+        len(guilds),
+        guilds_seconds
+    )
 
-        if (
-            config.greet and hasattr(server, 'default_channel')
-            and server.default_channel is not None
-        ):
-            await server.default_channel.send(version())
+    if config.greet:
+        for server in guilds:
+            if (
+                hasattr(server, 'default_channel')
+                and server.default_channel is not None
+            ):
+                await server.default_channel.send(version())
 
-        emotes.add_server(server, storage_injector('emotes', server.id))
-        keywords.add_server(server, storage_injector('keywords', server.id))
+    if profiling:
+        startup_profile.record(
+            f'guild setup ({len(guilds)} guilds)',
+            guilds_seconds
+        )
+        startup_profile.finish()
 
     if config.presence is not None:
         presence = config.presence
@@ -750,79 +1531,248 @@ async def on_ready():
                 logger.info('Set current game to %s', str(game))
         # TODO: Support other presence options (status, AFK)
 
-@client.event
 async def on_guild_join(server):
-    global emotes, keywords, logger
     logger.info('Initializing storage for new server "%s"', server)
-    emotes.add_server(server, storage_injector('emotes', server.id))
-    keywords.add_server(server, storage_injector('keywords', server.id))
+    await setup_guild(server)
 
-@client.event
-async def on_message(message):
-    """Event handler for messages."""
-    stats['messages seen'] += 1
+async def on_guild_remove(server):
+    logger.info('Removed from server "%s"', server)
+    ready_guilds.discard(server.id)
 
-    # Don't process the bot's messages
-    if message.author.id == client.user.id:
-        return
+async def on_connect():
+    """Event handler for a new gateway session, which is followed by the
+    servers it includes and on_ready. Sharded clients are handled by
+    on_shard_connect instead.
+    """
+    if config.shard_count is None:
+        _forget_ready_guilds(lambda server_id: True)
 
-    if message.content.startswith(constants.COMMAND_PREFIX):
-        if message.content == constants.COMMAND_PREFIX:
-            logger.info('Ignoring null command')
-            return
+async def on_shard_connect(shard_id):
+    """Event handler for a new gateway session on one shard."""
+    _forget_ready_guilds(
+        lambda server_id: (server_id >> 22) % client.shard_count == shard_id
+    )
+
+def _forget_ready_guilds(predicate):
+    """Stop treating servers as ready until on_ready sets them up again,
+    since the bot may have been removed from some while disconnected. Their
+    storage stays loaded, so setting them up again is cheap.
+    """
+    forgotten = {
+        server_id for server_id in ready_guilds if predicate(server_id)
+    }
+    if forgotten:
         logger.info(
-            '[%s] Handling command message "%s" from user %s',
-            message.guild,
-            message.content,
-            message.author
+            'New session; setting up %d server(s) again',
+            len(forgotten)
         )
+        ready_guilds.difference_update(forgotten)
 
-        stats['commands seen'] += 1
+def _load_guild_storage(server_id):
+    """Load a server's emotes and keywords and build its keyword automaton.
+    This blocks, so it should be called in an executor.
 
-        command, _ = split_command(message)
+    Returns: A tuple of (the emotes storage, the keywords storage, the
+    automaton).
+    """
+    emote_storage = storage_injector('emotes', server_id)
+    keyword_storage = storage_injector('keywords', server_id)
+    return (
+        emote_storage,
+        keyword_storage,
+        keywords.build_automaton(keyword_storage),
+    )
+
+async def setup_guild(server):
+    """Load a server's storage and start handling its messages.
 
-        if command is None:
-            logger.warning(
-                '[%s] Mishandled command message "%s" from %s',
-                message.guild,
-                message.content,
-                message.author
+    The storage is loaded in an executor, so that the event loop keeps
+    handling messages for servers that are already set up; at most
+    constants.GUILD_SETUP_CONCURRENCY servers load at once. A server that
+    is set up, or being set up, is left alone, and one whose storage is
+    still loaded from before a reconnect keeps it, so that a reconnect does
+    not throw away changes that have not been saved.
+    """
+    if server.id in ready_guilds or server.id in loading_guilds:
+        return
+    if server.id in keywords.keywords and server.id in emotes.emotes:
+        ready_guilds.add(server.id)
+        return
+    loading_guilds.add(server.id)
+    started = time.perf_counter()
+    try:
+        async with guild_setup_slots:
+            emote_storage, keyword_storage, automaton = \
+                await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    _load_guild_storage,
+                    server.id
+                )
+        emotes.add_server(server, emote_storage)
+        keywords.add_server(server, keyword_storage, automaton)
+        if not ready_guilds and login_started is not None:
+            startup_profile.record(
+                'first guild ready',
+                time.perf_counter() - login_started
             )
+        ready_guilds.add(server.id)
+    finally:
+        loading_guilds.discard(server.id)
+
+    logger.debug('Set up server %s %s', server, server.id)
+    if (
+        hasattr(server, 'default_channel')
+        and server.default_channel is not None
+    ):
+        logger.debug('Default channel is %s', server.default_channel)
+    if logger.isEnabledFor(logging.DEBUG):
+        for channel in server.channels:
+            if isinstance(channel, discord.TextChannel):
+                logger.debug('\tChannel: %s %s', channel.name, channel.id)
+    if startup_profile.detailed and startup_profile.finished is None:
+        startup_profile.record(
+            f'guild {server.id} setup',
+            time.perf_counter() - started
+        )
 
-        assert command_dispatcher is not None
+async def _handle_command(message, cmd):
+    """Command pipeline for on_message."""
+    assert command_dispatcher is not None
+    command = command_dispatcher.lookup(cmd.name)
+
+    # Unknown commands are common (other bots share the prefix), so
+    # they are handled here without going through an exception.
+    if command is None:
+        unknown_commands.inc()
+        logger.debug(
+            '[%s] Unknown command "%s" from %s',
+            message.guild,
+            cmd.name,
+            message.author
+        )
+        if config.unknown_cmd_msg:
+            util.queue_message(message.channel, f'Unknown command: "{cmd.name}"')
+        return
 
-        try:
-            await command_dispatcher.dispatch(client, command, message)
-            stats['commands run'] += 1
-        except (
-            CommandDispatcher.PermissionDenied,
-            CommandDispatcher.WriteDenied,
-            CommandDispatcher.UnknownCommand
-        ) as e:
-            if (
-                e.__class__ != CommandDispatcher.UnknownCommand
-                or config.unknown_cmd_msg
-            ):
-                await message.channel.send(str(e))
-            logger.info(
-                '[%s] Exception executing command "%s" from %s: %s',
-                message.guild,
-                command,
-                message.author,
-                str(e)
-            )
-    elif message.clean_content.startswith(constants.EMOTE_PREFIX):
+    hot_logger.info(
+        '[%s] Handling command message "%s" from user %s',
+        message.guild,
+        message.content,
+        message.author
+    )
+    try:
+        await command_dispatcher.invoke(client, command, message, cmd)
+        commands_run.labels(cmd.name).inc()
+    except (
+        CommandDispatcher.PermissionDenied,
+        CommandDispatcher.WriteDenied
+    ) as e:
+        util.queue_message(message.channel, str(e))
         logger.info(
-            '[%s] Handling emote message "%s" from %s',
+            '[%s] Exception executing command "%s" from %s: %s',
             message.guild,
-            message.clean_content,
-            message.author
+            cmd.name,
+            message.author,
+            str(e)
+        )
+
+async def _handle_emote(message):
+    """Emote pipeline for on_message."""
+    logger.info(
+        '[%s] Handling emote message "%s" from %s',
+        message.guild,
+        message.clean_content,
+        message.author
+    )
+    await emotes.display_emote(client, message)
+    emotes_seen.inc()
+
+async def _run_pipeline(name, coro, message):
+    """Run one on_message pipeline under its time limit.
+
+    Errors and timeouts are logged and counted here so that they do not
+    affect the other pipelines handling the same message.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(coro, constants.PIPELINE_TIMEOUTS[name])
+    except asyncio.TimeoutError:
+        pipeline_timeouts.labels(name).inc()
+        logger.warning(
+            '[%s] Cancelled %s pipeline for message %s after %ds',
+            message.guild,
+            name,
+            message.id,
+            constants.PIPELINE_TIMEOUTS[name]
         )
-        await emotes.display_emote(client, message)
-        stats['emotes seen'] += 1
+    except Exception:
+        pipeline_errors.labels(name).inc()
+        logger.exception(
+            '[%s] Error in %s pipeline for message %s',
+            message.guild,
+            name,
+            message.id
+        )
+    finally:
+        pipeline_seconds.labels(name).observe(time.perf_counter() - start)
+
+async def on_message(message):
+    """Event handler for messages.
 
-    # Check for keywords
-    await keywords.handle_keywords(client, message)
+    A message may be a command or an emote, and is always checked for
+    keywords. These pipelines are independent, so they run concurrently and
+    a slow command does not hold up keyword reactions. Each pipeline is
+    cancelled if it runs over its limit in constants.PIPELINE_TIMEOUTS.
+    """
+    messages_seen.inc()
+
+    # Don't process the bot's messages
+    if message.author.id == client.user.id:
+        return
+
+    # Nor those of servers whose storage is still loading
+    if message.guild is not None and message.guild.id not in ready_guilds:
+        messages_before_ready.inc()
+        return
+
+    if message_recorder is not None:
+        message_recorder.record(message)
+
+    pipelines = []
+    if message.content.startswith(constants.COMMAND_PREFIX):
+        # Parse the command once; the result is handed to the handler.
+        cmd = util.parse_command(message)
+        if cmd.name is None:
+            logger.debug('Ignoring null command')
+            return
+        commands_seen.inc()
+        pipelines.append(('command', _handle_command(message, cmd)))
+    elif message.clean_content.startswith(constants.EMOTE_PREFIX):
+        pipelines.append(('emote', _handle_emote(message)))
+
+    # Check for keywords. Counting is done inline; only messages that
+    # contain keywords need a pipeline for announcements and reactions.
+    try:
+        found = keywords.count_keywords_in(message)
+    except Exception:
+        found = None
+        pipeline_errors.labels('keywords').inc()
+        logger.exception('[%s] Error counting keywords', message.guild)
+    if found:
+        pipelines.append((
+            'keywords',
+            keywords.react_to_keywords(client, message, found)
+        ))
+
+    if not pipelines:
+        return
+    if len(pipelines) == 1:
+        name, coro = pipelines[0]
+        await _run_pipeline(name, coro, message)
+    else:
+        await asyncio.gather(*(
+            _run_pipeline(name, coro, message) for name, coro in pipelines
+        ))
 
 ### RUN ###
 
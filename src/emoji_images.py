@@ -0,0 +1,151 @@
+"""Fitting images to Discord's custom emoji size limit.
+
+Oversized images are downscaled and recompressed in a process pool so that
+decoding never blocks the event loop. Results are cached by a hash of the
+source image. Pillow is an optional dependency; without it, images are
+passed through unchanged.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import logging
+
+import constants
+import util
+
+# Pillow takes a while to import, so it is loaded when an image is first
+# transcoded
+Image = util.lazy_import('PIL.Image')
+ImageSequence = util.lazy_import('PIL.ImageSequence')
+
+# Smallest dimension, in pixels, to which an image will be shrunk
+MIN_DIMENSION = 16
+
+def can_transcode():
+    """Whether images can be transcoded, i.e. whether Pillow is installed."""
+    return Image is not None
+
+def fit_to_size(data, max_size, max_dimension, max_pixels):
+    """Downscale and recompress an image until it is no larger than
+    max_size bytes. Animated GIFs stay animated.
+
+    This is CPU-bound and runs in a worker process. Each frame is shrunk as
+    it is decoded, so only one full-size frame is held at a time.
+
+    Arguments:
+        data -- The image as bytes.
+        max_size -- The maximum size of the result, in bytes.
+        max_dimension -- The largest width or height to start from.
+        max_pixels -- The most pixels, over all frames, the image may have.
+
+    Returns: The image as bytes, as a GIF if the source was animated and as a
+    PNG otherwise.
+
+    Raises:
+        ValueError -- If the image has too many pixels or could not be made
+            small enough.
+        OSError -- If the image could not be decoded.
+    """
+    bounds = (max_dimension, max_dimension)
+    with Image.open(io.BytesIO(data)) as image:
+        animated = getattr(image, 'is_animated', False)
+        width, height = image.size
+        if getattr(image, 'n_frames', 1) * width * height > max_pixels:
+            raise ValueError('Image is too large to resize')
+        # Lets JPEGs decode at a reduced size
+        image.draft('RGB', bounds)
+        frames = []
+        for frame in ImageSequence.Iterator(image) if animated else [ image ]:
+            frame = frame.convert('RGBA')
+            frame.thumbnail(bounds, Image.LANCZOS)
+            frames.append(frame)
+        duration = image.info.get('duration', 100)
+
+    scale = 1.0
+    while True:
+        size = tuple(max(1, int(d * scale)) for d in frames[0].size)
+        if min(size) < MIN_DIMENSION and scale < 1.0:
+            raise ValueError('Image cannot be made small enough')
+        resized = [ frame.resize(size, Image.LANCZOS) for frame in frames ]
+        out = io.BytesIO()
+        if animated:
+            resized[0].save(
+                out,
+                format='GIF',
+                save_all=True,
+                append_images=resized[1:],
+                duration=duration,
+                loop=0,
+                disposal=2,
+                optimize=True,
+            )
+        else:
+            resized[0].save(out, format='PNG', optimize=True)
+            if out.tell() > max_size:
+                # Try a palette image before shrinking any further
+                out = io.BytesIO()
+                resized[0].quantize(256).save(out, format='PNG', optimize=True)
+        if out.tell() <= max_size:
+            return out.getvalue()
+        scale *= 0.75
+
+class EmojiImages():
+    """Fits images to the emoji size limit off the event loop."""
+
+    def __init__(self):
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.executor = None
+        self.cache = util.ResponseCache(
+            'emoji images',
+            *constants.RESPONSE_CACHES['emoji images']
+        )
+
+    def max_source_size(self):
+        """The largest source image that will be accepted, in bytes."""
+        if can_transcode():
+            return constants.MAX_EMOJI_SOURCE_SIZE
+        return constants.MAX_EMOJI_SIZE
+
+    async def fit(self, data):
+        """Get a version of an image that fits the emoji size limit.
+
+        Returns: The image as bytes; the original if it already fits or if
+        Pillow is not installed.
+
+        Raises:
+            ValueError -- If the image could not be made small enough.
+            OSError -- If the image could not be decoded.
+        """
+        if len(data) <= constants.MAX_EMOJI_SIZE or not can_transcode():
+            return data
+        loop = asyncio.get_event_loop()
+        digest = await loop.run_in_executor(
+            None,
+            lambda: hashlib.sha256(data).digest()
+        )
+        return await self.cache.get(digest, lambda: self._transcode(data))
+
+    async def _transcode(self, data):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=constants.IMAGE_WORKERS
+            )
+        self.logger.info('Transcoding %d-byte image for emoji', len(data))
+        result = await asyncio.get_event_loop().run_in_executor(
+            self.executor,
+            fit_to_size,
+            data,
+            constants.MAX_EMOJI_SIZE,
+            constants.MAX_EMOJI_DIMENSION,
+            constants.MAX_EMOJI_SOURCE_PIXELS
+        )
+        self.logger.info('Transcoded image to %d bytes', len(result))
+        return result
+
+    def shutdown(self):
+        """Shut down the worker processes, if any were started."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -7,13 +7,18 @@ from storage import KeyExistsError
 from util import server_command_method
 import config
 import constants
+import log_pipeline
 import util
 
 class Emotes():
     """Emotes module for DragonBot."""
 
+    # Gateway intents this module needs: emotes are only used in guilds
+    intents = ('guild_messages',)
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.hot_logger = log_pipeline.hot_path_logger(self.logger.name)
         self.emotes = {}
 
     def __len__(self):
@@ -21,9 +26,15 @@ class Emotes():
 
     def add_server(self, server, storage):
         """Track emotes for a server."""
-        self.logger.info('Tracking emotes for server %d', server.id)
+        self.logger.debug('Tracking emotes for server %d', server.id)
         self._set_server_emotes(server.id, storage)
 
+    def carry_over(self, old):
+        """Take over the servers tracked by an Emotes from before a reload,
+        without loading their storage again.
+        """
+        self.emotes = old.emotes
+
     def _set_server_emotes(self, server_id, emotes):
         """Set the emotes for a server."""
         self.emotes[server_id] = emotes
@@ -72,8 +83,8 @@ class Emotes():
         """
         cd.register("emotes",        self.list_emotes)
         cd.register("addemote",      self.add_emote,      rw=True, may_use={config.owner_id})
-        cd.register("deleteemote",   self.remove_emote,   rw=True, may_use={config.owner_id})
-        cd.register("removeemote",   self.remove_emote,   rw=True, may_use={config.owner_id})
+        cd.register("removeemote",   self.remove_emote,   rw=True, may_use={config.owner_id},
+                    aliases=("deleteemote",))
         cd.register("refreshemotes", self.refresh_emotes, may_use={config.owner_id})
         self.logger.info('Registered commands')
 
@@ -81,8 +92,8 @@ class Emotes():
         return sum([ len(self.emotes[server]) for server in self.emotes ])
 
     @server_command_method
-    async def add_emote(self, _client, message):
-        _command, argstr = util.split_command(message)
+    async def add_emote(self, _client, message, cmd):
+        argstr = cmd.argstr
         try:
             if argstr is None:
                 raise ValueError('No arguments')
@@ -121,8 +132,8 @@ class Emotes():
     # End of add_emote
 
     @server_command_method
-    async def remove_emote(self, _client, message):
-        _command, argstr = util.split_command(message)
+    async def remove_emote(self, _client, message, cmd):
+        argstr = cmd.argstr
         if argstr is None:
             await message.channel.send(
                 "I can't delete nothing, {}.".format(random_insult())
@@ -147,31 +158,31 @@ class Emotes():
     # End of remove_emote
 
     @server_command_method
-    async def refresh_emotes(self, _client, message):
+    async def refresh_emotes(self, _client, message, _cmd):
         self._get_server_emotes(message.channel.guild.id).load()
         await message.channel.send('Emotes refreshed!')
 
     @server_command_method
-    async def list_emotes(self, _client, message):
+    async def list_emotes(self, _client, message, _cmd):
         if not self._get_server_emotes(message.guild.id):
             await message.channel.send(
                 "I don't have any emotes for this server yet!"
             )
-        for chunk in util.chunker(
-            self._get_server_emotes(message.guild.id).as_text_list(),
-            constants.MAX_CHARACTERS
-        ):
-            await message.channel.send(chunk)
+        else:
+            await util.queue_message(
+                message.channel,
+                self._get_server_emotes(message.guild.id).as_text_list()
+            )
 
     @server_command_method
-    async def display_emote(self, _client, message):
+    async def display_emote(self, _client, message, _cmd):
         emote = message.clean_content[1:]
         server_emotes = self._get_server_emotes(message.guild.id)
         if emote in server_emotes:
-            self.logger.debug('Posting emote "%s"', server_emotes[emote])
+            self.hot_logger.debug('Posting emote "%s"', server_emotes[emote])
             await message.channel.send(server_emotes[emote])
         else:
-            self.logger.debug('Unknown emote')
+            self.hot_logger.debug('Unknown emote')
             if constants.IDK_REACTION is not None:
                 await message.add_reaction(constants.IDK_REACTION)
 
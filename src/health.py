@@ -1,14 +1,121 @@
+"""Health and readiness checks for DragonBot, served by the StatusServer on
+the bot's own event loop.
+
+The bot is alive unless its client has closed or it has been disconnected
+from the gateway for too long; an orchestrator should restart it otherwise.
+Since the checks run on the event loop, a bot whose loop is blocked does not
+answer at all. The bot is ready when it is connected, its heartbeat latency
+and event loop lag are low, and its storage backend can be reached.
+"""
+
 import asyncio
-from aiohttp import web
-
-async def handle_health(request):
-    return web.Response(
-        status=200,
-        content_type='text/html',
-        text="<html><head><title>Dragonbot</title></head><body>Healthy</body></html>",
-    )
-
-print('Starting web server')
-app = web.Application()
-app.add_routes([web.get('/', handle_health)])
-web.run_app(app, port=10000)
+import logging
+import math
+import time
+
+import constants
+import storage
+
+class Health():
+    """Checks the state of the client, the event loop and storage."""
+
+    def __init__(self, client, loop_monitor):
+        """Construct a new Health.
+
+        Arguments:
+            client -- The discord.Client to check.
+            loop_monitor -- The LoopMonitor measuring the event loop's lag.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.client = client
+        self.loop_monitor = loop_monitor
+        self.disconnected_since = None
+
+    def connected(self):
+        """Whether the client is ready and its gateway connection is open. A
+        sharded client must have every one of its shards' connections open.
+        """
+        if not self.client.is_ready() or self.client.is_closed():
+            return False
+        shards = getattr(self.client, 'shards', None)
+        if shards is not None:
+            return bool(shards) and not any(
+                shard.is_closed() for shard in shards.values()
+            )
+        ws = self.client.ws
+        return ws is not None and ws.open
+
+    def liveness(self):
+        """Check whether the bot is alive.
+
+        Returns: A tuple of (whether it is alive, a description).
+        """
+        if self.client.is_closed():
+            return (False, 'Client is closed')
+        if self.connected():
+            self.disconnected_since = None
+            return (True, 'Healthy')
+        if not self.client.is_ready():
+            # Still logging in for the first time
+            return (True, 'Starting')
+        now = time.monotonic()
+        if self.disconnected_since is None:
+            self.disconnected_since = now
+        down = now - self.disconnected_since
+        if down > constants.HEALTH_GATEWAY_GRACE:
+            return (False, f'Disconnected from the gateway for {down:.0f}s')
+        return (True, 'Reconnecting')
+
+    async def readiness(self):
+        """Check whether the bot is ready to handle messages.
+
+        Returns: A tuple of (whether it is ready, a dict of checks by name).
+        Each check is a dict with 'ok' and 'detail' fields. Unsaved storage
+        changes are reported, but do not make the bot unready.
+        """
+        checks = {}
+
+        connected = self.connected()
+        checks['gateway'] = {
+            'ok' : connected,
+            'detail' : 'connected' if connected else 'not connected',
+        }
+
+        latency = self.client.latency
+        latency_ok = (
+            not math.isnan(latency)
+            and latency <= constants.HEALTH_MAX_LATENCY
+        )
+        checks['heartbeat latency'] = {
+            'ok' : latency_ok,
+            'detail' : 'no heartbeat' if math.isnan(latency) or math.isinf(latency)
+                else f'{latency:.3f}s',
+        }
+
+        lag = self.loop_monitor.current_lag()
+        checks['event loop lag'] = {
+            'ok' : lag is None or lag <= constants.HEALTH_MAX_LOOP_LAG,
+            'detail' : 'not measured' if lag is None else f'{lag:.3f}s',
+        }
+
+        try:
+            backend = await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(
+                    None,
+                    storage.check_backend
+                ),
+                constants.HEALTH_STORAGE_TIMEOUT
+            )
+            checks['storage'] = { 'ok' : True, 'detail' : backend }
+        except asyncio.TimeoutError:
+            checks['storage'] = { 'ok' : False, 'detail' : 'timed out' }
+        except Exception as e:
+            self.logger.warning('Storage check failed: %s', e)
+            checks['storage'] = { 'ok' : False, 'detail' : str(e) }
+
+        ready = all(check['ok'] for check in checks.values())
+        checks['pending writes'] = {
+            'ok' : True,
+            'detail' : storage.unsaved_changes(),
+        }
+        return (ready, checks)
@@ -0,0 +1,541 @@
+"""Managed HTTP client for DragonBot's upstream APIs.
+
+A single aiohttp session is shared by every module. It is created on first
+use, so that it belongs to the running event loop, and closed when the bot's
+client closes.
+
+Each upstream API has a circuit breaker, so that when it degrades requests
+fail fast instead of waiting out slow responses. GET requests are retried
+with jittered backoff and, for some upstreams, hedged.
+"""
+
+import aiohttp
+import asyncio
+import collections
+import io
+import logging
+import random
+import tempfile
+import time
+
+import constants
+import metrics
+
+request_seconds = metrics.histogram(
+    'dragonbot_http_request_seconds',
+    'Time taken by completed GET requests to upstream APIs.',
+    labels=('upstream',)
+)
+
+class HTTPStatusError(Exception):
+    """Raised when an upstream API responds with an error status."""
+
+    def __init__(self, response):
+        super().__init__(
+            'HTTP {} from {}'.format(response.status, response.url)
+        )
+        self.status = response.status
+
+class DownloadError(Exception):
+    """Raised when a download is rejected for its size or content type."""
+    pass
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to an upstream whose circuit
+    breaker is open.
+    """
+    pass
+
+def timeout_seconds(upstream):
+    """Get the total time limit, in seconds, for requests to an upstream."""
+    return constants.HTTP_TIMEOUTS.get(
+        upstream,
+        constants.HTTP_TIMEOUTS['default']
+    )
+
+class CircuitBreaker():
+    """Tracks the health of an upstream API.
+
+    The breaker opens after a number of consecutive failures or slow calls.
+    While open, calls fail immediately. After a cool-down it becomes
+    half-open and lets a single probe call through: if the probe succeeds
+    the breaker closes, otherwise it opens again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=constants.HTTP_BREAKER_FAILURE_THRESHOLD,
+        slow_call=None,
+        reset_timeout=constants.HTTP_BREAKER_RESET_TIMEOUT
+    ):
+        """Construct a new CircuitBreaker.
+
+        Arguments:
+            name -- The name of the upstream API.
+            failure_threshold -- How many consecutive failures open it.
+            slow_call -- How long, in seconds, a call must take to count as
+                a failure. Defaults to a fraction of the upstream's timeout.
+            reset_timeout -- How long, in seconds, it stays open before
+                letting a probe through.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.name = name
+        self.failure_threshold = failure_threshold
+        if slow_call is None:
+            slow_call = (
+                timeout_seconds(name) * constants.HTTP_BREAKER_SLOW_CALL_FRACTION
+            )
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Check whether a call may be made. Every call that is allowed must
+        be followed by exactly one of record_success(), record_failure() or
+        record_abandoned().
+
+        Raises:
+            CircuitOpenError -- If the call may not be made.
+        """
+        if (
+            self.state == CircuitBreaker.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self.state = CircuitBreaker.HALF_OPEN
+        if (
+            self.state == CircuitBreaker.OPEN
+            or (self.state == CircuitBreaker.HALF_OPEN and self.probing)
+        ):
+            self.rejected += 1
+            raise CircuitOpenError(f'{self.name} is unavailable')
+        if self.state == CircuitBreaker.HALF_OPEN:
+            self.probing = True
+
+    def record_success(self, duration):
+        """Record a call that got a response, taking duration seconds. Slow
+        calls count as failures.
+        """
+        if duration > self.slow_call:
+            self.record_failure()
+            return
+        self.probing = False
+        self.failures = 0
+        if self.state != CircuitBreaker.CLOSED:
+            self.logger.info('Circuit for %s closed', self.name)
+            self.state = CircuitBreaker.CLOSED
+
+    def record_failure(self):
+        self.probing = False
+        self.failures += 1
+        if (
+            self.state == CircuitBreaker.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state != CircuitBreaker.OPEN:
+                self.trips += 1
+                self.logger.warning(
+                    'Circuit for %s opened after %d failure(s)',
+                    self.name,
+                    self.failures
+                )
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """Record a call that was cancelled before it finished."""
+        self.probing = False
+
+class HTTPClient():
+    """Wraps a pooled aiohttp.ClientSession, applying per-upstream timeouts
+    and collecting statistics about requests and connection reuse.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.session = None
+        self.stats = collections.defaultdict(int)
+        self.breakers = {
+            upstream : CircuitBreaker(upstream)
+                for upstream in constants.HTTP_BREAKER_UPSTREAMS
+        }
+        # Recent latencies of successful requests, for hedging
+        self.latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=constants.HTTP_LATENCY_SAMPLES)
+        )
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.logger.info('Creating HTTP client session')
+            connector = aiohttp.TCPConnector(
+                limit=constants.HTTP_POOL_LIMIT,
+                limit_per_host=constants.HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=constants.HTTP_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                ttl_dns_cache=constants.HTTP_DNS_CACHE_TTL,
+            )
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(
+                self._count('connections created')
+            )
+            trace_config.on_connection_reuseconn.append(
+                self._count('connections reused')
+            )
+            trace_config.on_connection_queued_start.append(
+                self._count('requests queued')
+            )
+            trace_config.on_dns_cache_hit.append(self._count('DNS cache hits'))
+            trace_config.on_dns_cache_miss.append(
+                self._count('DNS cache misses')
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._timeout('default'),
+                trace_configs=[trace_config],
+            )
+        return self.session
+
+    def _count(self, stat):
+        """Make a trace callback that increments a statistic."""
+        async def callback(_session, _context, _params):
+            self.stats[stat] += 1
+        return callback
+
+    @staticmethod
+    def _timeout(upstream):
+        return aiohttp.ClientTimeout(total=timeout_seconds(upstream))
+
+    async def get(self, url, upstream='default', **kwargs):
+        """Make a GET request and read the response body.
+
+        The body is read before returning, which releases the connection
+        back to the pool; the response's read(), text() and json() methods
+        return the buffered body.
+
+        Failed requests and responses with a status in
+        constants.HTTP_RETRY_STATUSES are retried with jittered exponential
+        backoff. For upstreams in constants.HTTP_HEDGED_UPSTREAMS, a second,
+        hedged request is sent if the first is slower than usual.
+
+        Arguments:
+            url -- The URL to request.
+            upstream -- The name of the upstream API, which selects the
+                timeout from constants.HTTP_TIMEOUTS and the circuit breaker.
+            **kwargs -- Passed on to aiohttp.ClientSession.get.
+
+        Returns: The aiohttp.ClientResponse. If retries are exhausted, this
+        may be a response with a retryable error status.
+
+        Raises:
+            CircuitOpenError -- If the upstream's circuit breaker is open.
+            asyncio.TimeoutError -- If the request and reading the body
+                took longer than the upstream's timeout on every attempt.
+            aiohttp.ClientError -- If the request failed on every attempt.
+        """
+        attempts = constants.HTTP_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                rsp = await self._guarded(
+                    upstream,
+                    lambda: self._hedged_get(url, upstream, **kwargs)
+                )
+                if rsp.status not in constants.HTTP_RETRY_STATUSES:
+                    return rsp
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt + 1 == attempts:
+                    raise
+            if attempt + 1 < attempts:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self._backoff(attempt))
+        return rsp
+
+    async def _guarded(self, upstream, call):
+        """Make a call through the upstream's circuit breaker, if it has
+        one, recording the outcome.
+        """
+        breaker = self.breakers.get(upstream)
+        if breaker is None:
+            return await call()
+        breaker.before_call()
+        start = time.monotonic()
+        try:
+            rsp = await call()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            breaker.record_failure()
+            raise
+        except HTTPStatusError as e:
+            if e.status in constants.HTTP_RETRY_STATUSES:
+                breaker.record_failure()
+            else:
+                breaker.record_success(time.monotonic() - start)
+            raise
+        except BaseException:
+            breaker.record_abandoned()
+            raise
+        if getattr(rsp, 'status', None) in constants.HTTP_RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - start)
+        return rsp
+
+    @staticmethod
+    def _backoff(attempt):
+        """Get the delay before a retry: exponential, capped and jittered."""
+        delay = min(
+            constants.HTTP_RETRY_BACKOFF * 2 ** attempt,
+            constants.HTTP_RETRY_BACKOFF_MAX
+        )
+        return delay * random.uniform(0.5, 1.5)
+
+    def _hedge_delay(self, upstream):
+        """Get how long to wait before hedging a request to an upstream, or
+        None if requests to it should not be hedged.
+        """
+        if upstream not in constants.HTTP_HEDGED_UPSTREAMS:
+            return None
+        latencies = self.latencies[upstream]
+        if len(latencies) < constants.HTTP_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return ordered[int(constants.HTTP_HEDGE_PERCENTILE * (len(ordered) - 1))]
+
+    async def _hedged_get(self, url, upstream, **kwargs):
+        """Make a request, sending a second one if the first takes longer
+        than the upstream's usual latency. The first response wins and the
+        other request is cancelled.
+        """
+        delay = self._hedge_delay(upstream)
+        if delay is None:
+            return await self._get_once(url, upstream, **kwargs)
+
+        first = asyncio.ensure_future(self._get_once(url, upstream, **kwargs))
+        pending = { first }
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self.stats['hedged requests'] += 1
+            pending.add(
+                asyncio.ensure_future(self._get_once(url, upstream, **kwargs))
+            )
+            while True:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats['hedged requests won'] += 1
+                        return task.result()
+                    if not pending:
+                        raise task.exception()
+        finally:
+            # Including the first request, if the caller was cancelled
+            # while waiting on it
+            for task in pending:
+                task.cancel()
+
+    async def _get_once(self, url, upstream, **kwargs):
+        self.stats['requests'] += 1
+        start = time.monotonic()
+        try:
+            async with self._get_session().get(
+                url,
+                timeout=self._timeout(upstream),
+                **kwargs
+            ) as rsp:
+                await rsp.read()
+        except Exception:
+            self.stats['failed requests'] += 1
+            raise
+        duration = time.monotonic() - start
+        request_seconds.labels(upstream).observe(duration)
+        if rsp.status < 400:
+            self.latencies[upstream].append(duration)
+        return rsp
+
+    async def download(
+        self,
+        url,
+        upstream='default',
+        max_size=constants.HTTP_MAX_DOWNLOAD_SIZE,
+        content_types=None,
+        **kwargs
+    ):
+        """Stream a response body into a bounded, spooled buffer.
+
+        The body is read in chunks and kept in memory up to
+        constants.HTTP_SPOOL_MEMORY_LIMIT, after which it is moved to a
+        temporary file. The download is abandoned as soon as it is known to
+        be too large or of the wrong type.
+
+        Arguments:
+            url -- The URL to request.
+            upstream -- The name of the upstream API, which selects the
+                timeout from constants.HTTP_TIMEOUTS.
+            max_size -- The maximum size of the body, in bytes.
+            content_types -- If given, a tuple of prefixes one of which the
+                response's content type must start with, e.g. ('image/',).
+            **kwargs -- Passed on to aiohttp.ClientSession.get.
+
+        Returns: A readable, seekable file object positioned at the start of
+        the body; an io.BytesIO if it was kept in memory. The caller is
+        responsible for closing it.
+
+        Raises:
+            CircuitOpenError -- If the upstream's circuit breaker is open.
+            HTTPStatusError -- If the response status was not 200.
+            DownloadError -- If the body was too large or of the wrong type.
+            asyncio.TimeoutError -- If the download took longer than the
+                upstream's timeout.
+            aiohttp.ClientError -- If the request failed.
+        """
+        return await self._guarded(
+            upstream,
+            lambda: self._download(url, upstream, max_size, content_types, **kwargs)
+        )
+
+    async def _download(self, url, upstream, max_size, content_types, **kwargs):
+        self.stats['requests'] += 1
+        self.stats['downloads'] += 1
+        buffer = io.BytesIO()
+        try:
+            async with self._get_session().get(
+                url,
+                timeout=self._timeout(upstream),
+                **kwargs
+            ) as rsp:
+                if rsp.status != 200:
+                    raise HTTPStatusError(rsp)
+                if content_types is not None and not any(
+                    rsp.content_type.startswith(t) for t in content_types
+                ):
+                    raise DownloadError(
+                        f'Unexpected content type {rsp.content_type}'
+                    )
+                if (
+                    rsp.content_length is not None
+                    and rsp.content_length > max_size
+                ):
+                    raise DownloadError(
+                        f'Content length {rsp.content_length} exceeds'
+                        f' the limit of {max_size} bytes'
+                    )
+                size = 0
+                async for chunk in rsp.content.iter_chunked(
+                    constants.HTTP_CHUNK_SIZE
+                ):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise DownloadError(
+                            f'Body exceeds the limit of {max_size} bytes'
+                        )
+                    if (
+                        isinstance(buffer, io.BytesIO)
+                        and size > constants.HTTP_SPOOL_MEMORY_LIMIT
+                    ):
+                        spooled = tempfile.TemporaryFile()
+                        spooled.write(buffer.getvalue())
+                        buffer.close()
+                        buffer = spooled
+                        self.stats['downloads spooled to disk'] += 1
+                    buffer.write(chunk)
+        except Exception:
+            buffer.close()
+            self.stats['failed requests'] += 1
+            raise
+        buffer.seek(0)
+        return buffer
+
+    def pool_stats(self):
+        """Get a snapshot of connection pool usage.
+
+        Returns: A dict with the number of connections in use and idle, the
+        pool limit, and the counters collected so far.
+        """
+        in_use = idle = 0
+        if self.session is not None and not self.session.closed:
+            connector = self.session.connector
+            # pylint: disable=protected-access
+            in_use = len(connector._acquired)
+            idle = sum(len(conns) for conns in connector._conns.values())
+        return dict(
+            self.stats,
+            **{ 'in use' : in_use, 'idle' : idle, 'limit' : constants.HTTP_POOL_LIMIT }
+        )
+
+    def breaker_stats(self):
+        """Get the state, trip count and number of rejected calls of each
+        upstream's circuit breaker.
+        """
+        return {
+            name : {
+                'state' : breaker.state,
+                'trips' : breaker.trips,
+                'rejected' : breaker.rejected,
+            } for name, breaker in self.breakers.items()
+        }
+
+    def collect(self):
+        """Get the client's statistics as metrics."""
+        pool = self.pool_stats()
+        breakers = self.breaker_stats()
+        states = (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+        return [
+            metrics.Family(
+                'dragonbot_http_client_events_total',
+                'counter',
+                'Requests, retries, connections and DNS lookups made by the'
+                    ' HTTP client.',
+                [ ('', (('event', event),), count)
+                    for event, count in sorted(self.stats.items()) ]
+            ),
+            metrics.Family(
+                'dragonbot_http_connections',
+                'gauge',
+                'Pooled HTTP connections, by state.',
+                [ ('', (('state', state),), pool[state])
+                    for state in ('in use', 'idle') ]
+            ),
+            metrics.Family(
+                'dragonbot_http_breaker_state',
+                'gauge',
+                'Whether each upstream\'s circuit breaker is in each state.',
+                [ ('', (('upstream', name), ('state', state)),
+                        int(breaker['state'] == state))
+                    for name, breaker in sorted(breakers.items())
+                        for state in states ]
+            ),
+            metrics.Family(
+                'dragonbot_http_breaker_trips_total',
+                'counter',
+                'Times each upstream\'s circuit breaker has opened.',
+                [ ('', (('upstream', name),), breaker['trips'])
+                    for name, breaker in sorted(breakers.items()) ]
+            ),
+            metrics.Family(
+                'dragonbot_http_breaker_rejected_total',
+                'counter',
+                'Requests failed fast by each upstream\'s circuit breaker.',
+                [ ('', (('upstream', name),), breaker['rejected'])
+                    for name, breaker in sorted(breakers.items()) ]
+            ),
+        ]
+
+    async def close(self):
+        """Close the session and its pooled connections."""
+        if self.session is not None and not self.session.closed:
+            self.logger.info('Closing HTTP client session')
+            await self.session.close()
+        self.session = None
@@ -2,6 +2,8 @@
 various ways.
 """
 
+import asyncio
+import collections
 import random
 import urllib
 import logging
@@ -10,21 +12,23 @@ import config
 import constants
 import util
 
-async def get_insult(who = None):
+# Stands in for the insultee's name in templated insults
+NAME_PLACEHOLDER = 'DRAGONBOTINSULTEE'
+
+async def fetch_insult(who = None):
+    """Make a single request to the insult API.
+
+    Returns: The insult, or None if the request failed.
+    """
     if who:
         query_params = urllib.parse.urlencode({ 'who' : who })
         url = f'{constants.INSULT_API_URL}?{query_params}'
     else:
         url = constants.INSULT_API_URL
     client = await util.get_http_client()
-    rsp = await client.get(url)
+    rsp = await client.get(url, upstream='insult')
     if rsp.status != 200:
         util.log_http_error(logging, rsp)
-        # Try again, this time without the parameter
-        rsp2 = await client.get(constants.INSULT_API_URL)
-        if rsp2.status == 200:
-            return await rsp2.text()
-        # Otherwise return nothing
         return None
     return await rsp.text()
 
@@ -32,3 +36,96 @@ def random_insult():
     """Random insults that the bot calls people who fail to use its
     commands properly."""
     return random.choice(config.insults) if config.insults else constants.DEFAULT_INSULT
+
+class InsultPool():
+    """Keeps insults from the insult API in memory so that !insult can
+    answer without waiting on the API.
+
+    Two pools are kept: generic insults, and templated insults into which a
+    name can be substituted. A background task tops a pool up whenever it
+    falls below the low-water mark.
+    """
+
+    def __init__(
+        self,
+        size=constants.INSULT_POOL_SIZE,
+        low_water=constants.INSULT_POOL_LOW_WATER
+    ):
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.size = size
+        self.low_water = low_water
+        self.generic = collections.deque(maxlen=size)
+        self.templated = collections.deque(maxlen=size)
+        self.refill_needed = None
+        self.task = None
+
+    def __len__(self):
+        return len(self.generic) + len(self.templated)
+
+    def start(self):
+        """Start the refill task. Must be called with the event loop
+        running; calling it again while the task is running does nothing.
+        """
+        if self.task is not None and not self.task.done():
+            return
+        self.refill_needed = asyncio.Event()
+        self.refill_needed.set()
+        self.task = asyncio.ensure_future(self._refill())
+        self.logger.info('Started insult prefetching')
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    def take(self, who=None):
+        """Take an insult from the pool.
+
+        Arguments:
+            who -- The name of the insultee, or None for a generic insult.
+
+        Returns: The insult, or None if the pool is empty.
+        """
+        insult = None
+        if who:
+            if self.templated:
+                insult = self.templated.popleft().replace(NAME_PLACEHOLDER, who)
+        elif self.generic:
+            insult = self.generic.popleft()
+        if (
+            self.refill_needed is not None
+            and min(len(self.generic), len(self.templated)) < self.low_water
+        ):
+            self.refill_needed.set()
+        return insult
+
+    async def _refill(self):
+        while True:
+            await self.refill_needed.wait()
+            self.refill_needed.clear()
+            try:
+                while len(self.generic) < self.size:
+                    insult = await fetch_insult()
+                    if insult is None:
+                        raise ValueError('No insult received')
+                    self.generic.append(insult)
+                while len(self.templated) < self.size:
+                    insult = await fetch_insult(NAME_PLACEHOLDER)
+                    if insult is None or NAME_PLACEHOLDER not in insult:
+                        raise ValueError('No templated insult received')
+                    self.templated.append(insult)
+                self.logger.debug('Refilled insult pools')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.warning(
+                    'Error prefetching insults; retrying in %ds',
+                    constants.INSULT_POOL_RETRY_DELAY,
+                    exc_info=True
+                )
+                await asyncio.sleep(constants.INSULT_POOL_RETRY_DELAY)
+                self.refill_needed.set()
@@ -4,26 +4,59 @@ import logging
 import re
 
 from insult import random_insult
-from util import command_method, server_command_method
+from util import server_command_method
 import config
 import constants
+import log_pipeline
+import metrics
 import util
 
+automaton_seconds = metrics.histogram(
+    'dragonbot_keyword_automaton_build_seconds',
+    'Time taken to build a guild\'s keyword automaton.'
+)
+keyword_matches = metrics.counter(
+    'dragonbot_keyword_matches_total',
+    'Keywords found in messages.'
+)
+
 class Keywords():
     """A keywords module for DragonBot."""
 
+    # Gateway intents this module needs: keywords are only counted in
+    # guilds
+    intents = ('guild_messages',)
+
     def __init__(self): # , keywords_file):
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.hot_logger = log_pipeline.hot_path_logger(self.logger.name)
         self.keywords = {}
         self.automata = {}
 
     def __len__(self):
         return self.keywords.__len__()
 
-    def add_server(self, server, storage):
-        """Track emotes for a server."""
+    def add_server(self, server, storage, automaton=None):
+        """Track keywords for a server.
+
+        Arguments:
+            server -- The server.
+            storage -- The server's keywords storage.
+            automaton -- The server's automaton, if it was already built
+                with build_automaton(), e.g. in an executor.
+        """
         self.keywords[server.id] = storage
-        self.update_automaton(server)
+        if automaton is None:
+            self.update_automaton(server)
+        else:
+            self.automata[server.id] = automaton
+
+    def carry_over(self, old):
+        """Take over the servers tracked by a Keywords from before a reload,
+        along with their automata, without loading their storage again.
+        """
+        self.keywords = old.keywords
+        self.automata = old.automata
 
     @staticmethod
     def help():
@@ -65,36 +98,63 @@ class Keywords():
 
     def register_commands(self, cd):
         cd.register("addkeyword",    self.add_keyword,    rw=True, may_use={config.owner_id})
-        cd.register("deletekeyword", self.remove_keyword, rw=True, may_use={config.owner_id})
-        cd.register("removekeyword", self.remove_keyword, rw=True, may_use={config.owner_id})
+        cd.register("removekeyword", self.remove_keyword, rw=True, may_use={config.owner_id},
+                    aliases=("deletekeyword",))
         cd.register("setcount",      self.set_count,      rw=True, may_use={config.owner_id})
         cd.register("keywords",      self.list_keywords)
         cd.register("count",         self.show_count)
         cd.register("refreshkeywords", self.refresh_keywords, may_use={config.owner_id})
         self.logger.info('Registered commands')
 
+    @staticmethod
+    def build_automaton(storage):
+        """Build an Aho-Corasick automaton of the keywords in a server's
+        storage. It does not touch any Keywords, so it can run in an
+        executor.
+        """
+        with automaton_seconds.time():
+            automaton = ahocorasick.Automaton(str)
+            # Add each keyword
+            for keyword in storage.data:
+                automaton.add_word(keyword, keyword)
+            # Finalize the automaton for searching
+            automaton.make_automaton()
+        return automaton
+
     def update_automaton(self, server):
-        # Make a new Aho-Corasick automaton
-        self.automata[server.id] = ahocorasick.Automaton(str)
-        automaton = self.automata[server.id]
-        # Add each keyword
-        for keyword in self.keywords[server.id].data:
-            automaton.add_word(keyword, keyword)
-        # Finalize the automaton for searching
-        automaton.make_automaton()
+        self.automata[server.id] = self.build_automaton(self.keywords[server.id])
         self.logger.debug('[%s] Updated automaton', server)
 
     def count_keywords(self):
         return sum([ len(self.keywords[server]) for server in self.keywords ])
 
-    @command_method
-    async def handle_keywords(self, _client, message):
+    async def handle_keywords(self, client, message):
         """Processes a message, checking it for keywords and performing
         actions when they are found.
+
+        This runs on every message, so unlike the command handlers it is not
+        wrapped in a command decorator and never parses the message as a
+        command.
+        """
+        assert client is not None, 'Got None for client'
+        assert message is not None, 'Got None for message'
+        found = self.count_keywords_in(message)
+        if found:
+            await self.react_to_keywords(client, message, found)
+
+    def count_keywords_in(self, message):
+        """Count the keywords that occur in a message.
+
+        This does not touch the network, so it can be called inline for
+        every message; only messages that contain keywords need to go on to
+        react_to_keywords().
+
+        Returns: A list of (keyword, count) pairs for the keywords found,
+        in order of first occurrence, with each keyword's count just after
+        this message incremented it.
         """
-        assert message is not None
         if message.guild is None:
-            return
+            return []
         assert message.guild.id in self.keywords, \
             'ID {} not in keywords, which has keys {}'.format(
                 message.guild.id,
@@ -103,8 +163,9 @@ class Keywords():
 
         server_keywords = self.keywords[message.guild.id]
         if not server_keywords:
-            return
+            return []
         content = message.clean_content.casefold()
+        found = []
         seen = set()
         for _index, keyword in self.automata[message.guild.id].iter(content):
             # Count keyword
@@ -112,26 +173,46 @@ class Keywords():
                 continue
             seen.add(keyword)
             server_keywords[keyword]['count'] += 1
+            server_keywords.touch()
             count = server_keywords[keyword]['count']
-            self.logger.info(
+            found.append((keyword, count))
+            self.hot_logger.info(
                 '%s incremented count of "%s" to %d',
                 message.author,
                 keyword,
                 count
             )
+        if found:
+            keyword_matches.inc(len(found))
+        return found
+
+    async def react_to_keywords(self, _client, message, found):
+        """Announce "gets" and add reactions for keywords already counted
+        by count_keywords_in().
+
+        Arguments:
+            found -- The (keyword, count) pairs count_keywords_in() returned.
+                Gets are decided from these counts, since other messages
+                may have counted the same keywords since.
+        """
+        server_keywords = self.keywords[message.guild.id]
+        for keyword, count in found:
             if util.is_get(count):
-                await message.channel.send('{} #{}'.format(keyword, count))
+                util.queue_message(
+                    message.channel,
+                    '{} #{}'.format(keyword, count)
+                )
                 server_keywords.save()
 
             # Show reactions
             reactions = server_keywords[keyword]['reactions']
-            self.logger.debug(
+            self.hot_logger.debug(
                 'Got reactions [%s] for keyword "%s"',
                 ", ".join(reactions) if reactions is not None else "None",
                 keyword
             )
             for reaction in reactions:
-                self.logger.info('Reacting with "%s"', reaction)
+                self.hot_logger.info('Reacting with "%s"', reaction)
                 try:
                     await message.add_reaction(reaction)
                 except discord.errors.Forbidden:
@@ -145,9 +226,9 @@ class Keywords():
                     )
 
     @server_command_method
-    async def add_keyword(self, _client, message):
+    async def add_keyword(self, _client, message, cmd):
         server_keywords = self.keywords[message.guild.id]
-        _command, argstr = util.split_command(message)
+        argstr = cmd.argstr
         if argstr is None:
             await message.channel.send(
                 "I can't add nothing, {}.".format(random_insult())
@@ -184,9 +265,9 @@ class Keywords():
         )
 
     @server_command_method
-    async def remove_keyword(self, _client, message):
+    async def remove_keyword(self, _client, message, cmd):
         server_keywords = self.keywords[message.guild.id]
-        _command, name = util.split_command(message)
+        name = cmd.argstr
         if name is None:
             await message.channel.send(
                 "I can't delete nothing, {}.".format(random_insult())
@@ -202,7 +283,7 @@ class Keywords():
             await message.channel.send("That keyword doesn't exist!")
 
     @server_command_method
-    async def refresh_keywords(self, _client, message):
+    async def refresh_keywords(self, _client, message, _cmd):
         if hasattr(message, 'guild'):
             self.keywords[message.channel.guild.id].load()
             await message.channel.send('Keywords refreshed!')
@@ -210,19 +291,22 @@ class Keywords():
             await message.channel.send('You must be in a server to do that.')
 
     @server_command_method
-    async def list_keywords(self, _client, message):
+    async def list_keywords(self, _client, message, _cmd):
         server_keywords = self.keywords[message.guild.id]
         if not server_keywords:
             await message.channel.send(
                 "I don't have any keywords for this server yet!"
             )
-        for chunk in util.chunker(server_keywords.as_text_list(), 2000):
-            await message.channel.send(chunk)
+        else:
+            await util.queue_message(
+                message.channel,
+                server_keywords.as_text_list()
+            )
 
     @server_command_method
-    async def show_count(self, _client, message):
+    async def show_count(self, _client, message, cmd):
         server_keywords = self.keywords[message.guild.id]
-        _command, keyword = util.split_command(message)
+        keyword = cmd.argstr
         if keyword in server_keywords:
             await message.channel.send(server_keywords[keyword]['count'])
         else:
@@ -230,9 +314,9 @@ class Keywords():
                 await message.channel.send(constants.IDK_REACTION)
 
     @server_command_method
-    async def set_count(self, _client, message):
+    async def set_count(self, _client, message, cmd):
         server_keywords = self.keywords[message.guild.id]
-        _command, argstr = util.split_command(message)
+        argstr = cmd.argstr
         if argstr is None:
             await message.channel.send('Missing keyword and count.')
         try:
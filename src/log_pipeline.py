@@ -0,0 +1,192 @@
+"""Logging for DragonBot that does not block the event loop.
+
+Records are put on a bounded queue by a QueueHandler and written out by a
+QueueListener on a background thread, so a slow stderr never stalls gateway
+processing. If the queue fills up, records are dropped and counted rather
+than waited for.
+
+Below WARNING, records from hot-path loggers (those that log for every
+message) are rate-limited per call site and can additionally be sampled.
+Other loggers, e.g. for startup and reloads, are left alone.
+"""
+
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+import constants
+import metrics
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking when its queue
+    is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class RateLimitFilter(logging.Filter):
+    """Limits how often each call site may log below WARNING, with a token
+    bucket per site. The next record let through from a site reports how
+    many were suppressed.
+    """
+
+    def __init__(self, rate, burst):
+        """Construct a new RateLimitFilter.
+
+        Arguments:
+            rate -- How many records per second each call site may log.
+            burst -- How many records a call site may log at once.
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {} # (path, line) -> [tokens, last time, suppressed]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        site = (record.pathname, record.lineno)
+        bucket = self.buckets.get(site)
+        if bucket is None:
+            bucket = self.buckets[site] = [self.burst, now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            self.suppressed += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.msg = '{} ({} similar messages suppressed)'.format(
+                record.getMessage(),
+                bucket[2]
+            )
+            record.args = None
+            bucket[2] = 0
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Lets through only a fraction of the records below WARNING."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        if random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+# Shared by all hot-path loggers; their rates are set by setup_logging()
+hot_path_sampler = SamplingFilter()
+hot_path_rate_limit = RateLimitFilter(
+    constants.LOG_RATE_LIMIT,
+    constants.LOG_RATE_LIMIT_BURST
+)
+
+_queue_handler = None
+
+def hot_path_logger(name):
+    """Get a logger for records logged on the hot path, e.g. for every
+    message seen. It is a child of the named logger, so it shares that
+    logger's level, and its records are sampled and rate-limited.
+    """
+    logger = logging.getLogger(name + '.hot')
+    for f in (hot_path_sampler, hot_path_rate_limit):
+        if f not in logger.filters:
+            logger.addFilter(f)
+    return logger
+
+def start_pipeline(handler, queue_size=None):
+    """Start a listener that writes queued records to a handler.
+
+    Arguments:
+        handler -- The handler that writes the records out.
+        queue_size -- The most records to hold before dropping them.
+            Defaults to constants.LOG_QUEUE_SIZE.
+
+    Returns: A tuple of (the DroppingQueueHandler to log to, the started
+    QueueListener). The listener must be stopped to flush the queue.
+    """
+    if queue_size is None:
+        queue_size = constants.LOG_QUEUE_SIZE
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        handler,
+        respect_handler_level=True
+    )
+    listener.start()
+    return (queue_handler, listener)
+
+def setup_logging(global_level, rate_limit, sample_rate):
+    """Route all logging through a queue to stderr.
+
+    Arguments:
+        global_level -- The level of the root logger.
+        rate_limit -- The number of records per second each hot-path call
+            site may log below WARNING.
+        sample_rate -- The fraction of hot-path records to keep.
+
+    Returns: The QueueListener, which must be stopped at exit to flush the
+    remaining records.
+    """
+    global _queue_handler
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(
+        logging.Formatter(constants.LOG_FORMAT, constants.DATE_FORMAT)
+    )
+    _queue_handler, listener = start_pipeline(stream_handler)
+    set_rates(rate_limit, sample_rate)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(global_level)
+    return listener
+
+def set_rates(rate_limit, sample_rate):
+    """Change the rate limit and sample rate given to setup_logging()."""
+    hot_path_rate_limit.rate = rate_limit
+    hot_path_sampler.rate = sample_rate
+
+def stats():
+    """Get the number of records dropped because the queue was full,
+    suppressed by rate limiting and left out by sampling.
+    """
+    return {
+        'dropped' : _queue_handler.dropped if _queue_handler is not None else 0,
+        'suppressed' : hot_path_rate_limit.suppressed,
+        'sampled out' : hot_path_sampler.sampled_out,
+    }
+
+def collect():
+    """Get the counts from stats() as metrics."""
+    return [ metrics.Family(
+        'dragonbot_log_records_discarded_total',
+        'counter',
+        'Log records dropped, suppressed by rate limiting or sampled out.',
+        [ ('', (('reason', reason),), count)
+            for reason, count in stats().items() ]
+    ) ]
+
+metrics.register('logging', collect)
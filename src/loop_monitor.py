@@ -0,0 +1,190 @@
+"""Event loop lag monitoring for DragonBot.
+
+A task on the event loop wakes up at a fixed interval and records how late
+it was scheduled, which is how long other work kept the loop busy. A
+watchdog thread checks that the task keeps running; when the loop has been
+blocked for longer than a threshold, it captures the loop thread's stack so
+that the blocking call can be found.
+"""
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import constants
+import metrics
+
+# A period during which the event loop was blocked. duration is how long it
+# had been blocked when the stack was captured.
+Stall = collections.namedtuple('Stall', ['time', 'duration', 'stack'])
+
+class LagHistogram(metrics.HistogramValue):
+    """Counts lag samples in fixed buckets."""
+
+    def __init__(self, bounds=constants.LOOP_LAG_BUCKETS):
+        """Construct a new LagHistogram.
+
+        Arguments:
+            bounds -- The upper bounds of the buckets, in seconds, in
+                increasing order. Larger samples go in an overflow bucket.
+        """
+        super().__init__(bounds)
+
+class LoopMonitor():
+    """Measures event loop lag and captures the stack when the loop is
+    blocked.
+    """
+
+    def __init__(
+        self,
+        interval=constants.LOOP_LAG_INTERVAL,
+        threshold=constants.LOOP_STALL_THRESHOLD
+    ):
+        """Construct a new LoopMonitor.
+
+        Arguments:
+            interval -- How often, in seconds, to measure the lag.
+            threshold -- How long, in seconds, the loop must be blocked
+                before its stack is captured.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = LagHistogram()
+        self.stalls = collections.deque(maxlen=constants.LOOP_STALL_HISTORY)
+        self.stall_count = 0
+        self.last_lag = None
+        self.heartbeat = None
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Start monitoring the running event loop. Calling it again while
+        it is running does nothing.
+        """
+        if self.task is not None and not self.task.done():
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.ensure_future(self._measure())
+        self.watchdog = threading.Thread(
+            target=self._watch,
+            name='loop-watchdog',
+            daemon=True
+        )
+        self.watchdog.start()
+        self.logger.info('Started event loop monitor')
+
+    async def stop(self):
+        self.stopping.set()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            self.last_lag = max(0.0, now - expected)
+            self.histogram.observe(self.last_lag)
+
+    def _watch(self):
+        captured = None
+        while not self.stopping.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or captured == heartbeat:
+                continue
+            # Only capture each stall once
+            captured = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            del frame
+            self.stalls.append(Stall(time.time(), blocked, stack))
+            self.stall_count += 1
+            self.logger.warning(
+                'Event loop blocked for %.3fs so far in:\n%s',
+                blocked,
+                stack
+            )
+
+    def current_lag(self):
+        """Get the most recent lag, in seconds, or None if the monitor has
+        not measured any. If the loop has been blocked for longer than that
+        since, the time it has been blocked is returned instead.
+        """
+        if self.heartbeat is None or self.last_lag is None:
+            return None
+        blocked = time.monotonic() - self.heartbeat - self.interval
+        return max(self.last_lag, blocked)
+
+    def collect(self):
+        """Get the lag histogram and the number of stalls as metrics."""
+        return [
+            metrics.Family(
+                'dragonbot_event_loop_lag_seconds',
+                'histogram',
+                'How late the event loop ran a task scheduled at a fixed'
+                    ' interval.',
+                self.histogram.samples(())
+            ),
+            metrics.Family(
+                'dragonbot_event_loop_stalls_total',
+                'counter',
+                'Times the event loop was blocked for longer than the stall'
+                    ' threshold.',
+                [ ('', (), self.stall_count) ]
+            ),
+        ]
+
+    def summary(self):
+        """Get a one-line summary of the lag, for !stats."""
+        if not self.histogram.total:
+            return 'N/A'
+        return 'p50 ≤ {}, p99 ≤ {}, max {}; {} stall(s)'.format(
+            _ms(self.histogram.percentile(0.5)),
+            _ms(self.histogram.percentile(0.99)),
+            _ms(self.histogram.max),
+            self.stall_count,
+        )
+
+    def dump(self):
+        """Get a report of the lag histogram and recent stalls, with their
+        stacks.
+        """
+        lines = [ 'Event loop lag ({} samples, every {}s):'.format(
+            self.histogram.total,
+            self.interval
+        ) ]
+        bounds = [ _ms(b) for b in self.histogram.bounds ] + [ 'more' ]
+        for bound, count in zip(bounds, self.histogram.counts):
+            lines.append(f'  ≤ {bound}: {count}')
+        lines.append(
+            f'{self.stall_count} stall(s) of {_ms(self.threshold)} or more'
+        )
+        for stall in self.stalls:
+            lines.append('')
+            lines.append('{} UTC, blocked {}:'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(stall.time)),
+                _ms(stall.duration)
+            ))
+            lines.append(stall.stack.rstrip())
+        return '\n'.join(lines)
+
+def _ms(seconds):
+    return f'{seconds * 1000:.0f} ms'
@@ -6,6 +6,9 @@ import util
 
 class Magic8Ball():
 
+    # The 8-Ball answers in guilds and in direct messages
+    intents = ('guild_messages', 'dm_messages')
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
 
@@ -30,5 +33,5 @@ class Magic8Ball():
         )
 
     @command_method
-    async def eightball(self, _client, message):
+    async def eightball(self, _client, message, _cmd):
         await message.channel.send(random.choice(constants.EIGHT_BALL_ANSWERS))
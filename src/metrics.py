@@ -0,0 +1,339 @@
+"""Runtime metrics for DragonBot, in the Prometheus text format.
+
+Counters, gauges and histograms are kept in a registry and updated in place,
+so recording a value is a dict lookup and an addition. Statistics that other
+modules already keep, such as the outbound queue's or the HTTP client's, are
+read by collectors only when the metrics are rendered.
+"""
+
+import bisect
+import collections
+import math
+import time
+
+import constants
+
+# The Content-Type of rendered metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A rendered metric. samples is a list of (name suffix, labels, value), where
+# labels is a tuple of (name, value) pairs.
+Family = collections.namedtuple('Family', ['name', 'type', 'help', 'samples'])
+
+class Value():
+    """The value of a counter or gauge, for one set of label values."""
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from a function, which takes no arguments, when
+        the metrics are rendered.
+        """
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+    def samples(self, labels):
+        return [ ('', labels, self.get()) ]
+
+class HistogramValue():
+    """Counts observations in fixed buckets, for one set of label values."""
+
+    def __init__(self, bounds=constants.METRICS_LATENCY_BUCKETS):
+        """Construct a new HistogramValue.
+
+        Arguments:
+            bounds -- The upper bounds of the buckets, in increasing order.
+                Larger observations go in an overflow bucket.
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def time(self):
+        """Get a context manager that observes how long its block takes, in
+        seconds.
+        """
+        return _Timer(self)
+
+    def percentile(self, q):
+        """Estimate a percentile as the upper bound of the bucket it falls
+        in.
+
+        Returns: The bound, the maximum if the percentile is in the overflow
+        bucket, or None if there are no observations.
+        """
+        if not self.total:
+            return None
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.total:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def samples(self, labels):
+        samples = []
+        seen = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            seen += count
+            samples.append(('_bucket', labels + (('le', bound),), seen))
+        samples.append(('_sum', labels, self.sum))
+        samples.append(('_count', labels, self.total))
+        return samples
+
+class _Timer():
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Metric():
+    """A named metric, with a value for each combination of label values.
+    A metric without labels can be used as its only value.
+    """
+
+    type = None
+
+    def __init__(self, name, help_text, labels=()):
+        """Construct a new Metric.
+
+        Arguments:
+            name -- The name of the metric.
+            help_text -- A description of the metric.
+            labels -- The names of the metric's labels, if any.
+        """
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self.values = {} # tuple of label values -> value
+        self.default = None if self.labelnames else self.labels()
+
+    def _new_value(self):
+        return Value()
+
+    def labels(self, *values):
+        """Get the value for a combination of label values, creating it if
+        needed.
+        """
+        value = self.values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('{} takes labels {}, got {}'.format(
+                    self.name,
+                    self.labelnames,
+                    values
+                ))
+            value = self.values[values] = self._new_value()
+        return value
+
+    def collect(self):
+        samples = []
+        for values, value in self.values.items():
+            samples.extend(value.samples(tuple(zip(self.labelnames, values))))
+        return [ Family(self.name, self.type, self.help, samples) ]
+
+    def get(self):
+        """Get the value of a metric without labels."""
+        return self.default.get()
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, amount=1):
+        self.default.value += amount
+
+    def set_function(self, function):
+        self.default.set_function(function)
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    type = 'gauge'
+
+    def inc(self, amount=1):
+        self.default.value += amount
+
+    def dec(self, amount=1):
+        self.default.value -= amount
+
+    def set(self, value):
+        self.default.value = value
+
+    def set_function(self, function):
+        self.default.set_function(function)
+
+class Histogram(Metric):
+    """A distribution of observations, e.g. of latencies."""
+
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name,
+        help_text,
+        labels=(),
+        bounds=constants.METRICS_LATENCY_BUCKETS
+    ):
+        """Construct a new Histogram.
+
+        Arguments:
+            bounds -- The upper bounds of the buckets, in increasing order.
+
+        See Metric.__init__() for the other arguments.
+        """
+        self.bounds = bounds
+        super().__init__(name, help_text, labels)
+
+    def _new_value(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def time(self):
+        return self.default.time()
+
+class Registry():
+    """Holds metrics and collectors and renders them."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = {}
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, help_text, labels, **kwargs)
+        elif type(metric) is not cls or metric.labelnames != tuple(labels):
+            raise ValueError(f'Metric {name} already exists with another type')
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        """Get the counter with a name, creating it if needed."""
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        """Get the gauge with a name, creating it if needed."""
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(
+        self,
+        name,
+        help_text,
+        labels=(),
+        bounds=constants.METRICS_LATENCY_BUCKETS
+    ):
+        """Get the histogram with a name, creating it if needed."""
+        return self._get_or_create(
+            Histogram,
+            name,
+            help_text,
+            labels,
+            bounds=bounds
+        )
+
+    def register(self, name, collect):
+        """Register a collector, replacing any registered under the same
+        name.
+
+        Arguments:
+            name -- The name of the collector.
+            collect -- A function that takes no arguments and returns a list
+                of Family.
+        """
+        self.collectors[name] = collect
+
+    def collect(self):
+        families = []
+        for metric in self.metrics.values():
+            families.extend(metric.collect())
+        for collect in self.collectors.values():
+            families.extend(collect())
+        return families
+
+    def render(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = []
+        for family in self.collect():
+            lines.append(f'# HELP {family.name} {_escape_help(family.help)}')
+            lines.append(f'# TYPE {family.name} {family.type}')
+            for suffix, labels, value in family.samples:
+                if labels:
+                    lines.append('{}{}{{{}}} {}'.format(
+                        family.name,
+                        suffix,
+                        ','.join(
+                            f'{label}="{_escape_label(label_value)}"'
+                                for label, label_value in labels
+                        ),
+                        _format_value(value)
+                    ))
+                else:
+                    lines.append(
+                        f'{family.name}{suffix} {_format_value(value)}'
+                    )
+        lines.append('')
+        return '\n'.join(lines)
+
+def _escape_help(text):
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+def _escape_label(value):
+    if not isinstance(value, str):
+        return _format_value(value)
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    return repr(float(value))
+
+# The registry the bot's metrics are kept in
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register = REGISTRY.register
+render = REGISTRY.render
@@ -0,0 +1,199 @@
+"""Outbound message queue for DragonBot.
+
+Messages the bot sends on its own initiative, rather than as the answer to a
+command, are queued per channel instead of being sent straight away.
+Consecutive queued messages for a channel are merged into one message where
+they fit, which saves requests against Discord's per-channel rate limits,
+and channels take turns so that one busy channel cannot hold up the rest.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+import constants
+import metrics
+
+wait_seconds = metrics.histogram(
+    'dragonbot_outbox_wait_seconds',
+    'Time queued messages waited before being sent.'
+)
+
+# A message waiting to be sent
+Pending = collections.namedtuple('Pending', ['content', 'future', 'queued_at'])
+
+def split_message(content, max_characters):
+    """Split text into parts no longer than max_characters, breaking after
+    whole lines where possible. Single lines that are too long are cut.
+
+    Returns: A list of the parts, without the newlines they were split at.
+    """
+    parts = []
+    while len(content) > max_characters:
+        end = content.rfind('\n', 0, max_characters + 1)
+        if end <= 0:
+            parts.append(content[:max_characters])
+            content = content[max_characters:]
+        else:
+            parts.append(content[:end])
+            content = content[end + 1:]
+    parts.append(content)
+    return parts
+
+class Outbox():
+    """Queues text messages per channel and sends them from a small pool of
+    workers, serving channels round-robin. Each channel's messages are sent
+    in order, one request at a time.
+    """
+
+    def __init__(
+        self,
+        max_characters=constants.MAX_CHARACTERS,
+        workers=constants.OUTBOX_WORKERS
+    ):
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.max_characters = max_characters
+        self.workers = workers
+        self.queues = {}   # channel -> deque of Pending
+        self.ready = None  # Queue of channels with messages to send
+        self.tasks = []
+        self.stats = collections.defaultdict(int)
+        self.latencies = collections.deque(
+            maxlen=constants.OUTBOX_LATENCY_SAMPLES
+        )
+
+    def depth(self):
+        """Get the number of messages waiting to be sent."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def send(self, channel, content):
+        """Queue a message to be sent to a channel. Messages longer than the
+        character limit are split between lines.
+
+        Arguments:
+            channel -- The channel to send to.
+            content -- The text of the message.
+
+        Returns: A future that resolves to the sent discord.Message (which
+        may also contain other queued messages) once the last part of the
+        message is sent. Awaiting it is optional.
+        """
+        self._start()
+        loop = asyncio.get_event_loop()
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = collections.deque()
+            self.ready.put_nowait(channel)
+        future = None
+        for part in split_message(content, self.max_characters):
+            future = loop.create_future()
+            queue.append(Pending(part, future, time.monotonic()))
+            self.stats['queued'] += 1
+        self.stats['max depth'] = max(self.stats['max depth'], self.depth())
+        return future
+
+    def _start(self):
+        if self.tasks:
+            return
+        self.ready = asyncio.Queue()
+        self.tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+        self.logger.info('Started %d outbox worker(s)', self.workers)
+
+    async def _work(self):
+        while True:
+            channel = await self.ready.get()
+            queue = self.queues[channel]
+            batch = [ queue.popleft() ]
+            length = len(batch[0].content)
+            while queue and length + 1 + len(queue[0].content) <= self.max_characters:
+                batch.append(queue.popleft())
+                length += 1 + len(batch[-1].content)
+            await self._send(channel, batch)
+            # Go to the back of the line if there is more to send
+            if queue:
+                self.ready.put_nowait(channel)
+            else:
+                del self.queues[channel]
+
+    async def _send(self, channel, batch):
+        try:
+            message = await channel.send(
+                '\n'.join(pending.content for pending in batch)
+            )
+        except asyncio.CancelledError:
+            for pending in batch:
+                pending.future.cancel()
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            self.logger.warning(
+                'Error sending queued message to %s: %s',
+                channel,
+                e
+            )
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+                    # Mark the exception as retrieved in case nobody waits
+                    pending.future.exception()
+            return
+        now = time.monotonic()
+        self.stats['sent'] += 1
+        self.stats['merged'] += len(batch) - 1
+        for pending in batch:
+            self.latencies.append(now - pending.queued_at)
+            wait_seconds.observe(now - pending.queued_at)
+            if not pending.future.done():
+                pending.future.set_result(message)
+
+    def latency(self):
+        """Get the median time, in seconds, recent messages spent queued, or
+        None if none have been sent.
+        """
+        if not self.latencies:
+            return None
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def collect(self):
+        """Get the queue's statistics as metrics."""
+        return [
+            metrics.Family(
+                'dragonbot_outbox_messages_total',
+                'counter',
+                'Messages queued, sent, merged into others, or failed.',
+                [ ('', (('event', event),), self.stats[event])
+                    for event in ('queued', 'sent', 'merged', 'failed') ]
+            ),
+            metrics.Family(
+                'dragonbot_outbox_depth',
+                'gauge',
+                'Messages waiting to be sent.',
+                [ ('', (), self.depth()) ]
+            ),
+            metrics.Family(
+                'dragonbot_outbox_max_depth',
+                'gauge',
+                'The most messages that have been waiting at once.',
+                [ ('', (), self.stats['max depth']) ]
+            ),
+        ]
+
+    async def close(self):
+        """Stop the workers, cancelling any messages still queued. The
+        workers are restarted if another message is queued.
+        """
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        for queue in self.queues.values():
+            for pending in queue:
+                pending.future.cancel()
+        self.queues.clear()
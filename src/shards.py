@@ -0,0 +1,206 @@
+"""Sharding for DragonBot.
+
+Discord splits a bot's gateway connection into shards, each carrying the
+events of the guilds whose IDs map to it. DragonBot can run all of its
+shards in one process, or several processes can each run a range of them
+against the same storage directory or MongoDB database. A guild's emotes and
+keywords are only loaded by the process whose shard carries the guild, so
+processes never write the same guild's storage.
+
+Each sharded process publishes its statistics to the shared storage at a
+fixed interval, so that any of them can add up the statistics of all shards.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+import constants
+import metrics
+import storage
+
+def parse_shard_ids(text):
+    """Parse a list of shard IDs and ranges of them, e.g. '0-3,6'.
+
+    Returns: A sorted list of the IDs.
+
+    Raises:
+        ValueError -- If the text is not such a list.
+    """
+    ids = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        if first < 0 or last < first:
+            raise ValueError(f'Invalid shard range "{part.strip()}"')
+        ids.update(range(first, last + 1))
+    return sorted(ids)
+
+def format_shard_ids(shard_ids):
+    """Format a list of shard IDs compactly, collapsing consecutive IDs into
+    ranges. The inverse of parse_shard_ids().
+    """
+    ranges = []
+    for shard_id in sorted(shard_ids):
+        if ranges and ranges[-1][1] == shard_id - 1:
+            ranges[-1][1] = shard_id
+        else:
+            ranges.append([shard_id, shard_id])
+    return ','.join(
+        str(first) if first == last else f'{first}-{last}'
+            for first, last in ranges
+    )
+
+def validate(shard_ids, shard_count):
+    """Check that shard IDs can be run with a shard count.
+
+    Raises:
+        ValueError -- If they cannot.
+    """
+    if shard_count is None:
+        if shard_ids is not None:
+            raise ValueError('Shard IDs require a shard count')
+        return
+    if shard_count < 1:
+        raise ValueError('The shard count must be at least 1')
+    if shard_ids is not None and shard_ids[-1] >= shard_count:
+        raise ValueError(
+            f'Shard IDs must be less than the shard count, {shard_count}'
+        )
+
+class ShardStats():
+    """Publishes a sharded process's statistics to the shared storage and
+    adds up those of every process.
+    """
+
+    def __init__(
+        self,
+        client,
+        snapshot,
+        interval=constants.SHARD_STATS_INTERVAL
+    ):
+        """Construct a new ShardStats.
+
+        Arguments:
+            client -- The discord.AutoShardedClient running this process's
+                shards.
+            snapshot -- A function that takes no arguments and returns this
+                process's statistics, as a dict of numbers by name.
+            interval -- How often, in seconds, to publish the statistics.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.client = client
+        self.snapshot = snapshot
+        self.interval = interval
+        self.task = None
+
+    def key(self):
+        """Get the name of this process's shards, e.g. '0-3 of 8'."""
+        shard_ids = self.client.shard_ids
+        if shard_ids is None:
+            shard_ids = range(self.client.shard_count or 1)
+        return '{} of {}'.format(
+            format_shard_ids(shard_ids),
+            self.client.shard_count
+        )
+
+    def current(self):
+        """Get this process's statistics as they are published."""
+        stats = dict(self.snapshot())
+        stats['updated'] = time.time()
+        return stats
+
+    def start(self):
+        """Start publishing the statistics. Calling it again while it is
+        running does nothing.
+        """
+        if self.task is not None and not self.task.done():
+            return
+        self.task = asyncio.ensure_future(self._publish_periodically())
+        self.logger.info('Publishing statistics for shards %s', self.key())
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _publish_periodically(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(
+                    None,
+                    storage.publish_shard_stats,
+                    self.key(),
+                    self.current()
+                )
+            except Exception:
+                self.logger.exception('Failed to publish shard statistics')
+            await asyncio.sleep(self.interval)
+
+    async def totals(self):
+        """Add up the statistics of every process that has published them
+        recently, using this process's current statistics for itself.
+
+        Returns: A tuple of (the totals by name, the keys of the processes
+        counted).
+        """
+        try:
+            published = await asyncio.get_event_loop().run_in_executor(
+                None,
+                storage.load_shard_stats,
+                time.time() - constants.SHARD_STATS_MAX_AGE
+            )
+        except Exception:
+            self.logger.exception('Failed to load shard statistics')
+            published = {}
+        published[self.key()] = self.current()
+
+        totals = collections.Counter()
+        for stats in published.values():
+            for name, value in stats.items():
+                if name != 'updated':
+                    totals[name] += value
+        return (dict(totals), sorted(published))
+
+    def collect(self):
+        """Get the latency and guild count of each of this process's shards
+        as metrics.
+        """
+        guilds = collections.Counter(
+            guild.shard_id for guild in self.client.guilds
+        )
+        latencies = self.client.latencies
+        return [
+            metrics.Family(
+                'dragonbot_shard_latency_seconds',
+                'gauge',
+                'Latency between a shard\'s gateway heartbeat and its'
+                    ' acknowledgement.',
+                [
+                    ('', (('shard', shard_id),), latency)
+                        for shard_id, latency in latencies
+                ]
+            ),
+            metrics.Family(
+                'dragonbot_shard_guilds',
+                'gauge',
+                'Guilds carried by each shard.',
+                [
+                    ('', (('shard', shard_id),), guilds[shard_id])
+                        for shard_id, _ in latencies
+                ]
+            ),
+            metrics.Family(
+                'dragonbot_shard_count',
+                'gauge',
+                'Shards the bot is split into, across all processes.',
+                [ ('', (), self.client.shard_count or 0) ]
+            ),
+        ]
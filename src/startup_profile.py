@@ -0,0 +1,82 @@
+"""Timings of DragonBot's startup phases.
+
+Every startup is timed. With --profile-startup, the timings are logged at
+INFO once the bot is ready, and each guild's setup is timed separately;
+otherwise they are logged at DEBUG. They are also served as metrics.
+"""
+
+import logging
+import time
+
+import metrics
+
+class StartupProfile():
+    """Records how long each phase of startup takes, in order."""
+
+    def __init__(self, started=None, detailed=False):
+        """Construct a new StartupProfile.
+
+        Arguments:
+            started -- The perf_counter() time startup began at. Defaults to
+                now.
+            detailed -- Whether to time small, numerous phases, such as
+                each guild's setup, separately.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.started = started if started is not None else time.perf_counter()
+        self.detailed = detailed
+        self.phases = [] # (name, seconds)
+        self.finished = None
+
+    def phase(self, name):
+        """Get a context manager that records how long its block takes as a
+        phase.
+        """
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def finish(self):
+        """Mark startup as finished and log the report. Later calls do
+        nothing, so it can be called whenever the bot becomes ready.
+        """
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        self.logger.log(
+            logging.INFO if self.detailed else logging.DEBUG,
+            '%s',
+            self.report()
+        )
+
+    def report(self):
+        """Get the phases and their durations as text."""
+        end = self.finished if self.finished is not None else time.perf_counter()
+        lines = [ f'Startup took {end - self.started:.3f}s:' ]
+        for name, seconds in self.phases:
+            lines.append(f'{seconds * 1000:10.1f} ms  {name}')
+        return '\n'.join(lines)
+
+    def collect(self):
+        """Get the phases' durations as metrics."""
+        return [ metrics.Family(
+            'dragonbot_startup_phase_seconds',
+            'gauge',
+            'Time taken by each phase of startup.',
+            [ ('', (('phase', name),), seconds) for name, seconds in self.phases ]
+        ) ]
+
+class _Phase():
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.profile.record(self.name, time.perf_counter() - self.start)
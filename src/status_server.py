@@ -0,0 +1,87 @@
+"""An HTTP server inside the bot process that serves its health, readiness
+and metrics.
+"""
+
+import json
+import logging
+
+from aiohttp import web
+
+import constants
+import metrics
+
+class StatusServer():
+    """Serves the bot's liveness at / and /health, its readiness at /ready,
+    and the metrics registry in the Prometheus text format at /metrics.
+    """
+
+    def __init__(
+        self,
+        port,
+        host=constants.STATUS_HOST,
+        registry=None,
+        health=None
+    ):
+        """Construct a new StatusServer.
+
+        Arguments:
+            port -- The port to listen on.
+            host -- The address to listen on.
+            registry -- The metrics.Registry to serve. Defaults to
+                metrics.REGISTRY.
+            health -- The health.Health to report. If None, only metrics
+                are served.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.port = port
+        self.host = host
+        self.registry = registry if registry is not None else metrics.REGISTRY
+        self.health = health
+        self.runner = None
+
+    async def start(self):
+        """Start listening. Calling it again while it is running does
+        nothing.
+        """
+        if self.runner is not None:
+            return
+        app = web.Application()
+        app.add_routes([ web.get('/metrics', self.handle_metrics) ])
+        if self.health is not None:
+            app.add_routes([
+                web.get('/', self.handle_health),
+                web.get('/health', self.handle_health),
+                web.get('/ready', self.handle_ready),
+            ])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except Exception:
+            await runner.cleanup()
+            raise
+        self.runner = runner
+        self.logger.info('Serving status on %s:%d', self.host, self.port)
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle_metrics(self, _request):
+        return web.Response(
+            body=self.registry.render().encode('utf-8'),
+            headers={ 'Content-Type' : metrics.CONTENT_TYPE }
+        )
+
+    async def handle_health(self, _request):
+        alive, description = self.health.liveness()
+        return web.Response(status=200 if alive else 503, text=description)
+
+    async def handle_ready(self, _request):
+        ready, checks = await self.health.readiness()
+        return web.Response(
+            status=200 if ready else 503,
+            content_type='application/json',
+            text=json.dumps({ 'ready' : ready, 'checks' : checks }, indent=4)
+        )
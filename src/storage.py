@@ -3,15 +3,123 @@ from collections import UserDict
 import atexit
 import config
 import json
+import log_pipeline
 import logging
+import metrics
 import os
 
+storage_seconds = metrics.histogram(
+    'dragonbot_storage_seconds',
+    'Time taken to load and save guild storage.',
+    labels=('backend', 'operation')
+)
+
 class KeyExistsError(RuntimeError):
     pass
 
 def _normalize_key(key):
     return key.strip().casefold()
 
+def unsaved_changes():
+    """Get the number of changes to all storage since it was last saved."""
+    return sum(store.unsaved for store in Storage.stores.values())
+
+def check_backend():
+    """Check that the configured storage backend can be reached. This
+    blocks, so it should be called in an executor.
+
+    Returns: The name of the backend.
+
+    Raises:
+        OSError -- If the storage directory is not writable.
+        pymongo.errors.PyMongoError -- If MongoDB does not answer.
+    """
+    if config.storage_dir:
+        if not os.access(config.storage_dir, os.W_OK):
+            raise OSError(f'{config.storage_dir} is not writable')
+        return 'file'
+    if config.mongodb_uri:
+        config.mongo.admin.command('ping')
+        return 'mongodb'
+    return 'none'
+
+metrics.gauge(
+    'dragonbot_storage_unsaved_changes',
+    'Changes to guild storage since it was last saved.'
+).set_function(unsaved_changes)
+
+def _write_json_atomically(path, data):
+    """Write JSON to a file by writing a temporary file beside it and
+    renaming it over the file. Readers, including other bot processes
+    sharing the storage directory, only ever see a complete file.
+
+    The file is not fsynced: saves happen on the event loop, and waiting for
+    the disk there would stall every guild's messages.
+    """
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as fh:
+        json.dump(
+            data,
+            fh,
+            indent=4,
+            separators=(',', ' : '),
+            sort_keys=True
+        )
+    os.replace(temporary, path)
+
+def publish_shard_stats(key, stats):
+    """Save a process's shard statistics where the other processes sharing
+    the storage backend can read them. This blocks, so it should be called
+    in an executor.
+
+    Arguments:
+        key -- The name of the process's shards.
+        stats -- A dict of the statistics, including the time they were
+            taken as 'updated'.
+    """
+    if config.storage_dir:
+        shards_dir = os.path.join(config.storage_dir, 'shards')
+        os.makedirs(shards_dir, exist_ok=True)
+        _write_json_atomically(
+            os.path.join(shards_dir, f'{key.replace(" ", "_")}.json'),
+            { 'key' : key, 'stats' : stats }
+        )
+    elif config.mongodb_uri:
+        config.mongo.get_default_database()['shards'].replace_one(
+            { '_id' : key },
+            { '_id' : key, 'stats' : stats },
+            upsert=True
+        )
+
+def load_shard_stats(since):
+    """Load the shard statistics published by every process. This blocks,
+    so it should be called in an executor.
+
+    Arguments:
+        since -- The Unix time before which statistics are too old to use,
+            e.g. those of processes that have stopped.
+
+    Returns: A dict of the statistics by the name of each process's shards.
+    """
+    published = {}
+    if config.storage_dir:
+        shards_dir = os.path.join(config.storage_dir, 'shards')
+        if not os.path.isdir(shards_dir):
+            return published
+        for name in os.listdir(shards_dir):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(shards_dir, name), 'r', encoding='utf-8') as fh:
+                document = json.load(fh)
+            if document['stats'].get('updated', 0) >= since:
+                published[document['key']] = document['stats']
+    elif config.mongodb_uri:
+        for document in config.mongo.get_default_database()['shards'].find(
+            { 'stats.updated' : { '$gte' : since } }
+        ):
+            published[document['_id']] = document['stats']
+    return published
+
 def storage_injector(store_type, store_id):
     storage_args = { 'store_type' : store_type, 'store_id' : store_id }
     if config.storage_dir:
@@ -25,12 +133,18 @@ class Storage(ABC, UserDict):
     retrieving the mappings to and from JSON files, respectively.
     """
 
+    # All storage objects by type and ID, for counting unsaved changes
+    stores = {}
+
     # pylint: disable=unused-argument
     def __init__(self, store_type, store_id):
         super().__init__()
         self.store_type = store_type
         self.store_id = store_id
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.hot_logger = log_pipeline.hot_path_logger(self.logger.name)
+        self.unsaved = 0
+        Storage.stores[(store_type, store_id)] = self
         atexit.register(self.save)
 
     @abstractmethod
@@ -41,9 +155,16 @@ class Storage(ABC, UserDict):
     def save(self):
         pass
 
+    def touch(self):
+        """Record a change made to a stored value in place, e.g. to a dict
+        stored under a key.
+        """
+        self.unsaved += 1
+
     def __setitem__(self, key, value):
         key = _normalize_key(key)
-        self.logger.debug('Set "%s" to "%s"', key, value)
+        self.hot_logger.debug('Set "%s" to "%s"', key, value)
+        self.unsaved += 1
         return super().__setitem__(key, value)
 
     def __getitem__(self, key):
@@ -54,6 +175,7 @@ class Storage(ABC, UserDict):
         key = _normalize_key(key)
         if key in self:
             self.logger.info('Deleted "%s"', key)
+            self.unsaved += 1
             return super().__delitem__(key)
         raise KeyError(f'Key "{key}" does not exist.')
 
@@ -82,42 +204,43 @@ class FileStorage(Storage):
         self.load()
 
     def load(self):
-        if not os.path.isfile(self.file):
-            self.logger.info('Creating new entries file "%s"', self.file)
-            with open(self.file, 'x') as fh:
-                fh.writelines(["{}"])
-        with open(self.file, 'r', encoding='utf-8') as fh:
-            self.clear()
-            self.update(json.load(fh)) # Add all entries from file
-        self.logger.info(
-            '[%d] Loaded %d %s(s) from "%s"',
-            self.store_id,
-            len(self),
-            self.store_type,
-            self.file
-        )
-
-    def save(self):
-        self.logger.info('Saving %s for %s', self.store_type, self.store_id)
-        if (
-            not self.data
-            and os.path.isfile(self.file)
-            and os.path.getsize(self.file) >= 2
-        ):
-            self.logger.warning(
-                'Refusing to overwrite file "%s" with empty FileStorage',
+        with storage_seconds.labels('file', 'load').time():
+            if not os.path.isfile(self.file):
+                self.logger.info('Creating new entries file "%s"', self.file)
+                try:
+                    with open(self.file, 'x') as fh:
+                        fh.writelines(["{}"])
+                except FileExistsError:
+                    # Another process sharing the directory created it
+                    pass
+            with open(self.file, 'r', encoding='utf-8') as fh:
+                self.clear()
+                self.update(json.load(fh)) # Add all entries from file
+            self.logger.info(
+                '[%d] Loaded %d %s(s) from "%s"',
+                self.store_id,
+                len(self),
+                self.store_type,
                 self.file
             )
-            return
-
-        with open(self.file, 'w') as fh:
-            json.dump(
-                self.data,
-                fh,
-                indent=4,
-                separators=(',', ' : '),
-                sort_keys=True
-            )
+            self.unsaved = 0
+
+    def save(self):
+        with storage_seconds.labels('file', 'save').time():
+            self.logger.info('Saving %s for %s', self.store_type, self.store_id)
+            if (
+                not self.data
+                and os.path.isfile(self.file)
+                and os.path.getsize(self.file) >= 2
+            ):
+                self.logger.warning(
+                    'Refusing to overwrite file "%s" with empty FileStorage',
+                    self.file
+                )
+                return
+
+            _write_json_atomically(self.file, self.data)
+            self.unsaved = 0
 
 class MongoStorage(Storage):
     def __init__(self, store_type, store_id):
@@ -126,55 +249,63 @@ class MongoStorage(Storage):
         self.load()
 
     def load(self):
-        collection = self.db[self.store_type]
-        stored = collection.find_one({ '_id' : self.store_id })
-        if stored is None:
-            self.logger.info('No document found for %s', self.store_id)
-            stored = collection.insert_one({
-                '_id' : self.store_id,
-                'values' : {}
-            })
-            self.logger.info('Created document with ID %s', stored.inserted_id)
-        else:
-            self.logger.info('Loaded document for %s', self.store_id)
-            if 'values' not in stored:
-                raise ValueError(f'Invalid document in database: {stored}');
-            self.clear()
-            self.update(stored['values'])
-            self.logger.info(
-                '[%d] Loaded %d %s(s) from database',
-                self.store_id,
-                len(self),
-                self.store_type
-            )
+        with storage_seconds.labels('mongodb', 'load').time():
+            collection = self.db[self.store_type]
+            stored = collection.find_one({ '_id' : self.store_id })
+            if stored is None:
+                self.logger.info('No document found for %s', self.store_id)
+                # An upsert, rather than an insert, so that another process
+                # creating the same document does not make this one fail
+                collection.update_one(
+                    { '_id' : self.store_id },
+                    { '$setOnInsert' : { 'values' : {} } },
+                    upsert=True
+                )
+                self.logger.info('Created document with ID %s', self.store_id)
+            else:
+                self.logger.info('Loaded document for %s', self.store_id)
+                if 'values' not in stored:
+                    raise ValueError(f'Invalid document in database: {stored}');
+                self.clear()
+                self.update(stored['values'])
+                self.logger.info(
+                    '[%d] Loaded %d %s(s) from database',
+                    self.store_id,
+                    len(self),
+                    self.store_type
+                )
+            self.unsaved = 0
 
     def save(self):
-        self.logger.info('Saving entries')
-        if not self.data:
-            self.logger.warning(
-                'Refusing to overwrite document with empty MongoStorage'
-            )
-            return
-        collection = self.db[self.store_type]
-        result = collection.update_one(
-            { '_id' : self.store_id },
-            { '$set': { 'values' : self.data } }
-        )
-        if result.matched_count == 0:
-            self.logger.warning(
-                'Failed to match document in %s with _id %s',
-                self.store_type,
-                self.store_id
-            )
-        if result.modified_count == 0:
-            self.logger.warning(
-                'Failed to update document in %s with _id %s',
-                self.store_type,
-                self.store_id
-            )
-        else:
-            self.logger.info(
-                'Updated document in %s with _id %s',
-                self.store_type,
-                self.store_id
+        with storage_seconds.labels('mongodb', 'save').time():
+            self.logger.info('Saving entries')
+            if not self.data:
+                self.logger.warning(
+                    'Refusing to overwrite document with empty MongoStorage'
+                )
+                return
+            collection = self.db[self.store_type]
+            result = collection.update_one(
+                { '_id' : self.store_id },
+                { '$set': { 'values' : self.data } }
             )
+            if result.matched_count == 0:
+                self.logger.warning(
+                    'Failed to match document in %s with _id %s',
+                    self.store_type,
+                    self.store_id
+                )
+            if result.modified_count == 0:
+                self.logger.warning(
+                    'Failed to update document in %s with _id %s',
+                    self.store_type,
+                    self.store_id
+                )
+            else:
+                self.logger.info(
+                    'Updated document in %s with _id %s',
+                    self.store_type,
+                    self.store_id
+                )
+            if result.matched_count:
+                self.unsaved = 0
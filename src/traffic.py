@@ -0,0 +1,285 @@
+"""Recording of the messages DragonBot sees, for replaying them offline.
+
+With --record-messages, every message the bot receives is written to a log
+of JSON lines, gzipped if the file name ends in ".gz". The log is
+anonymized as it is written:
+
+- Guild, channel and user IDs are replaced by small numbers, in order of
+  first appearance, and mentions of them in message text by the same
+  numbers.
+- Words are replaced by pseudo-words of the same length, derived from the
+  word and a key that is thrown away when the bot exits, so a repeated word
+  is replaced the same way throughout the log.
+- Command and emote names, the guild's keywords, numbers and dice notation
+  are kept, since they decide how the bot handles a message.
+
+Messages are anonymized and written on a background thread, so that
+recording adds as little as possible to the latency it is meant to measure.
+
+bench/replay.py replays such a log against the bot's handlers.
+"""
+
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import string
+import threading
+import time
+
+import constants
+
+# Identifies a message log, on its first line
+FORMAT = 'dragonbot-messages'
+FORMAT_VERSION = 1
+
+_MENTION_PATTERN = re.compile(r'<(@!?|@&|#)([0-9]+)>')
+_CUSTOM_EMOJI_PATTERN = re.compile(r'<a?:\w+:[0-9]+>')
+_WORD_PATTERN = re.compile(r'\w+')
+# Words kept as they are: numbers and dice, e.g. "20", "2d6" or "4d6kh3"
+_KEPT_WORD_PATTERN = re.compile(r'[0-9]*(?:d[0-9]+)?(?:k[hl]?[0-9]*)?', re.ASCII)
+
+def open_log(path, mode):
+    """Open a message log for reading ('r') or appending ('a') text,
+    through gzip if its name ends in ".gz".
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def read_log(path):
+    """Read a message log.
+
+    Returns: A generator of its records, as dicts. Guild records, with a
+    'guild' field, come before the first message in their guild; message
+    records have a 't' field. The headers of later recordings appended to
+    the log are skipped.
+
+    Raises:
+        ValueError -- If the file is not a message log.
+    """
+    with open_log(path, 'r') as fh:
+        header = json.loads(fh.readline() or 'null')
+        if not isinstance(header, dict) or header.get('format') != FORMAT:
+            raise ValueError(f'{path} is not a message log')
+        for line in fh:
+            if line.strip():
+                record = json.loads(line)
+                if 'format' not in record:
+                    yield record
+
+# The parts of a message that are recorded, taken on the event loop
+_Message = collections.namedtuple('_Message', [
+    'at',
+    'guild_id',
+    'guild_info',
+    'channel_id',
+    'author_id',
+    'bot',
+    'content',
+    'mention_ids',
+    'attachments',
+])
+
+class MessageRecorder():
+    """Writes anonymized messages to a message log from a background
+    thread. If the thread falls behind, messages are dropped and counted.
+    """
+
+    def __init__(self, path, guild_info=None):
+        """Construct a new MessageRecorder, appending to a log.
+
+        Arguments:
+            path -- The log's file name.
+            guild_info -- A function that takes a guild and returns a dict
+                with lists of its 'keywords' and 'emotes' names, which are
+                recorded with the guild and kept in its messages.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.path = path
+        self.guild_info = guild_info
+        self.key = os.urandom(16)
+        self.ids = {} # snowflake -> small number
+        self.keep = {} # guild ID -> pattern of words to keep, or None
+        self.guilds_seen = set()
+        self.started = time.monotonic()
+        self.count = 0
+        self.dropped = 0
+        self.fh = open_log(path, 'a')
+        self._write({ 'format' : FORMAT, 'version' : FORMAT_VERSION })
+        self.queue = queue.Queue(maxsize=constants.RECORD_QUEUE_SIZE)
+        self.thread = threading.Thread(
+            target=self._run,
+            name='message recorder',
+            daemon=True
+        )
+        self.thread.start()
+        self.logger.info('Recording messages to %s', path)
+
+    def _write(self, record):
+        self.fh.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def anonymous_id(self, snowflake):
+        anonymous = self.ids.get(snowflake)
+        if anonymous is None:
+            anonymous = self.ids[snowflake] = len(self.ids) + 1
+        return anonymous
+
+    def record(self, message, at=None):
+        """Queue a message to be recorded.
+
+        Arguments:
+            message -- The discord.Message.
+            at -- When it was received, as a time.monotonic() value.
+                Defaults to now.
+        """
+        guild_id = guild_info = None
+        if message.guild is not None:
+            guild_id = message.guild.id
+            if guild_id not in self.guilds_seen:
+                # Looked up here, since the bot's state is not thread-safe
+                self.guilds_seen.add(guild_id)
+                guild_info = (
+                    self.guild_info(message.guild)
+                        if self.guild_info is not None else {}
+                )
+        try:
+            self.queue.put_nowait(_Message(
+                time.monotonic() if at is None else at,
+                guild_id,
+                guild_info,
+                message.channel.id,
+                message.author.id,
+                message.author.bot,
+                message.content,
+                [ user.id for user in message.mentions ],
+                len(message.attachments),
+            ))
+        except queue.Full:
+            self.dropped += 1
+            if guild_info is not None:
+                # Record the guild with its next message instead
+                self.guilds_seen.discard(guild_id)
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            try:
+                self._write_message(message)
+            except Exception:
+                self.logger.exception('Error recording message')
+
+    def _write_message(self, message):
+        record = { 't' : round(message.at - self.started, 3) }
+        keep = None
+        if message.guild_id is not None:
+            if message.guild_info is not None:
+                self.keep[message.guild_id] = self._record_guild(
+                    message.guild_id,
+                    message.guild_info
+                )
+            keep = self.keep.get(message.guild_id)
+            record['g'] = self.anonymous_id(message.guild_id)
+        record['c'] = self.anonymous_id(message.channel_id)
+        record['a'] = self.anonymous_id(message.author_id)
+        if message.bot:
+            record['bot'] = True
+        record['m'] = self.anonymize(message.content, keep)
+        if message.mention_ids:
+            record['mentions'] = [
+                self.anonymous_id(user_id) for user_id in message.mention_ids
+            ]
+        if message.attachments:
+            record['attachments'] = message.attachments
+        self._write(record)
+        self.count += 1
+
+    def _record_guild(self, guild_id, info):
+        """Record a guild's keyword and emote names.
+
+        Arguments:
+            guild_id -- The guild's ID.
+            info -- A dict with lists of its 'keywords' and 'emotes' names.
+
+        Returns: A pattern matching its keywords, or None if it has none.
+        """
+        keywords = sorted(info.get('keywords', ()), key=len, reverse=True)
+        self._write({
+            'guild' : self.anonymous_id(guild_id),
+            'keywords' : keywords,
+            'emotes' : sorted(info.get('emotes', ())),
+        })
+        if not keywords:
+            return None
+        return re.compile(
+            '|'.join(re.escape(keyword) for keyword in keywords),
+            re.IGNORECASE
+        )
+
+    def anonymize(self, content, keep=None):
+        """Anonymize a message's text.
+
+        Arguments:
+            content -- The text.
+            keep -- A pattern matching phrases to keep, e.g. keywords.
+        """
+        kept = []
+        # The command or emote name
+        if content.startswith((constants.COMMAND_PREFIX, constants.EMOTE_PREFIX)):
+            name, _, _ = content.partition(' ')
+            kept.append((0, len(name)))
+        for pattern in (_MENTION_PATTERN, _CUSTOM_EMOJI_PATTERN, keep):
+            if pattern is not None:
+                kept.extend(match.span() for match in pattern.finditer(content))
+
+        parts = []
+        position = 0
+        for start, end in sorted(kept):
+            if start < position:
+                continue # Overlaps a span already kept
+            parts.append(self._scramble(content[position:start]))
+            parts.append(_MENTION_PATTERN.sub(
+                lambda m: f'<{m.group(1)}{self.anonymous_id(int(m.group(2)))}>',
+                content[start:end]
+            ))
+            position = end
+        parts.append(self._scramble(content[position:]))
+        return ''.join(parts)
+
+    def _scramble(self, text):
+        return _WORD_PATTERN.sub(self._pseudo_word, text)
+
+    def _pseudo_word(self, match):
+        word = match.group(0)
+        if _KEPT_WORD_PATTERN.fullmatch(word):
+            return word
+        digest = hashlib.blake2b(
+            word.casefold().encode('utf-8'),
+            key=self.key
+        ).digest()
+        letters = string.ascii_lowercase
+        pseudo = []
+        for i, char in enumerate(word):
+            letter = letters[digest[i % len(digest)] % len(letters)]
+            pseudo.append(letter.upper() if char.isupper() else letter)
+        return ''.join(pseudo)
+
+    def close(self):
+        """Write the queued messages and close the log."""
+        if self.fh.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.fh.close()
+        self.logger.info(
+            'Recorded %d message(s) to %s; dropped %d',
+            self.count,
+            self.path,
+            self.dropped
+        )
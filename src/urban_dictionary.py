@@ -10,9 +10,16 @@ from util import command_method
 
 class UrbanDictionary():
 
+    # Gateway intents for looking up definitions from guilds and DMs
+    intents = ('guild_messages', 'dm_messages')
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
         self.strip_brackets = str.maketrans({ "[" : None, "]" : None })
+        self.cache = util.ResponseCache(
+            'urban dictionary',
+            *constants.RESPONSE_CACHES['urban dictionary']
+        )
 
     def register_commands(self, cd):
         """Register this modules's commands with a CommandDispatcher.
@@ -20,9 +27,11 @@ class UrbanDictionary():
         Arguments:
             cd -- The CommandDispatcher to register with.
         """
-        cd.register('ud', self.urban_dictionary)
-        cd.register('urban', self.urban_dictionary)
-        cd.register('urbandictionary', self.urban_dictionary)
+        cd.register(
+            'urbandictionary',
+            self.urban_dictionary,
+            aliases=('ud', 'urban')
+        )
         self.logger.info('Registered commands')
 
     @staticmethod
@@ -38,52 +47,72 @@ class UrbanDictionary():
         )
 
     @command_method
-    async def urban_dictionary(self, _client, message):
-        _command, arg = util.split_command(message)
+    async def urban_dictionary(self, _client, message, cmd):
+        arg = cmd.argstr
         try:
-            async with message.channel.typing():
-                client = await util.get_http_client()
-                headers = {
-                    'x-rapidapi-key': config.rapidapi_key,
-                    'x-rapidapi-host': config.rapidapi_host,
-                }
-                self.logger.info('headers: %s', headers)
-                rsp = await client.get(
-                    constants.UD_API_URL,
-                    params={ 'term': arg },
-                    headers=headers
+            async with util.DeferredTyping(message.channel):
+                key = arg.strip().casefold() if arg else arg
+                results = await self.cache.get(
+                    key,
+                    lambda: self.fetch_definitions(arg)
                 )
-                if 400 <= rsp.status <= 599:
-                    util.log_http_error(self.logger, rsp)
-                    await message.channel.send('An error occurred.')
+                if results is None:
+                    await message.channel.send(
+                        'No pages with that title found.'
+                    )
+                elif len(results) == 0:
+                    await message.channel.send(
+                        'No results.'
+                    )
                 else:
-                    json = await rsp.json()
-                    if 'list' not in json :
-                        await message.channel.send(
-                            'No pages with that title found.'
-                        )
-                    elif len(json['list']) == 0:
-                        await message.channel.send(
-                            'No results.'
-                        )
-                    else:
-                        result = max(
-                            json['list'],
-                            key=lambda item: \
-                                item['thumbs_up'] - item['thumbs_down']
-                        )
-                        description = result['definition'] \
-                            .translate(self.strip_brackets)
-                        if len(description) > 2048:
-                            description = description[0:2045] + '...'
-                        await message.channel.send(
-                            embed=discord.Embed(
-                                title=result['word'],
-                                url=result['permalink'],
-                                description=description,
-                            )
+                    result = max(
+                        results,
+                        key=lambda item: \
+                            item['thumbs_up'] - item['thumbs_down']
+                    )
+                    description = result['definition'] \
+                        .translate(self.strip_brackets)
+                    if len(description) > 2048:
+                        description = description[0:2045] + '...'
+                    await message.channel.send(
+                        embed=discord.Embed(
+                            title=result['word'],
+                            url=result['permalink'],
+                            description=description,
                         )
+                    )
 
+        except util.HTTPStatusError:
+            await message.channel.send('An error occurred.')
+        except util.CircuitOpenError:
+            await message.channel.send(
+                'Urban Dictionary is not responding right now. Try again later.'
+            )
         except Exception:
             self.logger.exception('Unknown error')
             await message.channel.send('Unknown error.')
+
+    async def fetch_definitions(self, term):
+        """Fetch the definitions of a term from Urban Dictionary.
+
+        Returns: A list of definitions, or None if the response had no list.
+
+        Raises:
+            HTTPStatusError -- If the API responded with an error.
+        """
+        client = await util.get_http_client()
+        headers = {
+            'x-rapidapi-key': config.rapidapi_key,
+            'x-rapidapi-host': config.rapidapi_host,
+        }
+        rsp = await client.get(
+            constants.UD_API_URL,
+            upstream='urban dictionary',
+            params={ 'term': term },
+            headers=headers
+        )
+        if 400 <= rsp.status <= 599:
+            util.log_http_error(self.logger, rsp)
+            raise util.HTTPStatusError(rsp)
+        json = await rsp.json()
+        return json['list'] if 'list' in json else None
@@ -1,16 +1,30 @@
-import aiohttp
-import atexit
+import asyncio
 import config
 import constants
 import discord
 import functools
+import importlib.util
 import logging
+import metrics
 import re
 import sys
+import time
+import types
 import unicodedata
 import urllib.parse
 
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
+from http_client import (
+    CircuitOpenError,
+    DownloadError,
+    HTTPClient,
+    HTTPStatusError,
+)
+from outbox import Outbox
+
+# A command message, parsed once and handed to every command handler.
+ParsedCommand = namedtuple('ParsedCommand', ['name', 'argstr'])
 
 def chunker(seq, size):
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
@@ -48,6 +62,15 @@ def split_command(message):
     """
     return _split_command_helper(message.content)
 
+def parse_command(message):
+    """Parse a command message into a ParsedCommand.
+
+    This should be done once per message; the result is passed along to
+    the command handler so that it does not have to split the message
+    again.
+    """
+    return ParsedCommand(*_split_command_helper(message.content))
+
 def split_command_clean(message):
     """Split a command message, using the clean content."""
     return _split_command_helper(message.clean_content)
@@ -67,18 +90,24 @@ def is_get(number):
     return False
 
 def command(command):
-    """Perform actions that should be done every time a command is invoked."""
+    """Perform actions that should be done every time a command is invoked.
+
+    The wrapped coroutine is called with the parsed command as its third
+    argument. If the caller does not supply one, the message is parsed here.
+    """
     @functools.wraps(command)
-    async def wrapper(client, message):
+    async def wrapper(client, message, cmd=None):
         assert client is not None, 'Got None for client'
         assert message is not None, 'Got None for message'
-        await command(client, message)
+        if cmd is None:
+            cmd = parse_command(message)
+        await command(client, message, cmd)
     return wrapper
 
 def server_command(command):
     """Only allow this command in a server, not PMs."""
     @functools.wraps(command)
-    async def wrapper(client,  message):
+    async def wrapper(client,  message, cmd=None):
         assert client is not None, 'Got None for client'
         assert message is not None, 'Got None for message'
         if not hasattr(message, 'guild') or message.guild is None:
@@ -86,22 +115,26 @@ def server_command(command):
                 'This command can only be used in a server context.'
             )
         else:
-            await command(client, message)
+            if cmd is None:
+                cmd = parse_command(message)
+            await command(client, message, cmd)
     return wrapper
 
 def command_method(command):
     """Perform actions that should be done every time a command is invoked."""
     @functools.wraps(command)
-    async def wrapper(self, client, message):
+    async def wrapper(self, client, message, cmd=None):
         assert client is not None, 'Got None for client'
         assert message is not None, 'Got None for message'
-        await command(self, client, message)
+        if cmd is None:
+            cmd = parse_command(message)
+        await command(self, client, message, cmd)
     return wrapper
 
 def server_command_method(command):
     """Only allow this command in a server, not PMs."""
     @functools.wraps(command)
-    async def wrapper(self, client,  message):
+    async def wrapper(self, client,  message, cmd=None):
         assert client is not None, 'Got None for client'
         assert message is not None, 'Got None for message'
         if not hasattr(message, 'guild') or message.guild is None:
@@ -109,7 +142,9 @@ def server_command_method(command):
                 'This command can only be used in a server context.'
             )
         else:
-            await command(self, client, message)
+            if cmd is None:
+                cmd = parse_command(message)
+            await command(self, client, message, cmd)
     return wrapper
 
 def ts_to_iso(timestamp):
@@ -151,20 +186,389 @@ def log_http_error(logger, response):
         response.url
     )
 
+_http_client = HTTPClient()
+
 async def get_http_client():
-    if not hasattr(config, 'http_client'):
-        config.http_client = aiohttp.ClientSession()
-        def close_http_client():
-            if (
-                hasattr(config, 'http_client')
-                and hasattr(config.http_client, 'close')
-                and not config.http_client.closed
-            ):
-                logging.info('Closing aiohttp ClientSession (FIXME)')
-                # config.http_client.close()
-        atexit.register(close_http_client)
-    return config.http_client
+    """Get the shared HTTPClient used for all upstream requests."""
+    return _http_client
+
+async def close_http_client():
+    """Close the shared HTTPClient's session. It will be recreated if it
+    is used again.
+    """
+    await _http_client.close()
+
+_outbox = Outbox()
+
+def queue_message(channel, content):
+    """Queue a message on the shared Outbox, to be sent in turn with other
+    channels' messages and merged with other queued messages to the same
+    channel where possible.
+
+    Returns: A future that resolves to the sent discord.Message.
+    """
+    return _outbox.send(channel, content)
+
+def get_outbox():
+    """Get the shared Outbox, e.g. for its statistics."""
+    return _outbox
+
+async def close_outbox():
+    """Stop sending queued messages, dropping any that are left."""
+    await _outbox.close()
+
+def lazy_import(name):
+    """Import a module lazily, for optional dependencies that are slow to
+    import. The module is only loaded when one of its attributes is first
+    used.
+
+    Returns: The module, or a stand-in for it that loads it on first use, or
+    None if it is not installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        spec = importlib.util.find_spec(name)
+    except ImportError:
+        # The parent package is not installed
+        return None
+    if spec is None:
+        return None
+    return _LazyModule(name)
+
+class _LazyModule(types.ModuleType):
+    """Stands in for a module until one of its attributes is used, then
+    imports it normally. Unlike importlib.util.LazyLoader, the module is
+    executed under the import system's own locks, which LazyLoader can trip
+    over when the module imports its own submodules.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        # Later lookups find the module's attributes without coming here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
 
 def format_url(base_url, params):
     query_params = urllib.parse.urlencode(params)
     return '{}?{}'.format(base_url, query_params)
+
+class ResponseCache():
+    """A size-bounded LRU cache with expiry for upstream lookups.
+
+    Results deemed negative ("not found") are kept for a shorter time than
+    positive ones. Concurrent lookups of the same key are coalesced, so at
+    most one upstream request per key is in flight. Exceptions are passed
+    on to every waiting caller and are not cached.
+    """
+
+    # All caches by name, for reporting in !stats
+    caches = {}
+    # Tells coalesced lookups that they must fetch for themselves
+    _UNSHAREABLE = object()
+
+    def __init__(
+        self,
+        name,
+        max_size,
+        ttl,
+        negative_ttl,
+        negative=None,
+        cacheable=None
+    ):
+        """Construct a new ResponseCache.
+
+        Arguments:
+            name -- The name the cache is reported under.
+            max_size -- The maximum number of entries to keep.
+            ttl -- How long, in seconds, positive results are kept.
+            negative_ttl -- How long, in seconds, negative results are kept.
+            negative -- A function that takes a result and returns whether
+                it is negative. By default, falsy results are negative.
+            cacheable -- A function that takes a result and returns whether
+                it may be cached. Results that may not be cached are not
+                shared with coalesced lookups either; those fetch their own.
+                By default, all results may be cached.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative = negative if negative is not None else lambda v: not v
+        self.cacheable = cacheable
+        self.entries = OrderedDict() # key -> (expiry time, value)
+        self.in_flight = {}          # key -> Future
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        ResponseCache.caches[name] = self
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, key, fetch):
+        """Look up a key, calling fetch() on a miss.
+
+        Arguments:
+            key -- The (hashable) cache key.
+            fetch -- A coroutine function taking no arguments, which
+                retrieves the value from upstream.
+
+        Returns: The cached or fetched value.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            expiry, value = entry
+            if expiry > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            # Shield the shared future so that this waiter being cancelled
+            # does not cancel the lookup for the others. If the lookup's
+            # owner is cancelled instead, the future is marked unshareable
+            # and this waiter fetches for itself.
+            value = await asyncio.shield(future)
+            if value is not ResponseCache._UNSHAREABLE:
+                self.coalesced += 1
+                return value
+            self.misses += 1
+            return await fetch()
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.set_result(ResponseCache._UNSHAREABLE)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else waits
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+        if self.cacheable is not None and not self.cacheable(value):
+            future.set_result(ResponseCache._UNSHAREABLE)
+            return value
+        self.put(key, value)
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry if the
+        cache is full.
+        """
+        ttl = self.negative_ttl if self.negative(value) else self.ttl
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    @classmethod
+    def hit_ratio(cls):
+        """Get the hit ratio across all caches, counting coalesced lookups as
+        hits since they did not cause an upstream request.
+
+        Returns: A tuple of (ratio, hits, lookups). The ratio is None if
+        there have been no lookups.
+        """
+        hits = sum(c.hits + c.coalesced for c in cls.caches.values())
+        lookups = hits + sum(c.misses for c in cls.caches.values())
+        return (hits / lookups if lookups else None, hits, lookups)
+
+    @classmethod
+    def collect(cls):
+        """Get every cache's lookups and size as metrics."""
+        caches = sorted(cls.caches.items())
+        return [
+            metrics.Family(
+                'dragonbot_cache_lookups_total',
+                'counter',
+                'Response cache lookups, by result.',
+                [ ('', (('cache', name), ('result', result)), getattr(cache, attr))
+                    for name, cache in caches
+                        for result, attr in (
+                            ('hit', 'hits'),
+                            ('coalesced', 'coalesced'),
+                            ('miss', 'misses'),
+                        ) ]
+            ),
+            metrics.Family(
+                'dragonbot_cache_entries',
+                'gauge',
+                'Entries in each response cache.',
+                [ ('', (('cache', name),), len(cache)) for name, cache in caches ]
+            ),
+        ]
+
+class RequestBatcher():
+    """Coalesces concurrent lookups of single keys into batched upstream
+    requests.
+
+    Keys requested within a short window of each other are collected and
+    fetched together; a batch is sent early if it reaches its maximum size.
+    Exceptions raised by the batch fetch are passed on to every lookup in
+    the batch. If a batch fetch is cancelled, its keys are requested again
+    in a new batch.
+    """
+
+    # Tells lookups that their batch was cancelled
+    _RETRY = object()
+
+    def __init__(self, name, fetch_batch, window, max_size):
+        """Construct a new RequestBatcher.
+
+        Arguments:
+            name -- The name of the batcher, for logging.
+            fetch_batch -- A coroutine function that takes a list of keys
+                and returns a dict mapping keys to their values. Keys
+                missing from the dict get None.
+            window -- How long, in seconds, to collect keys for a batch.
+            max_size -- The maximum number of keys in a batch.
+        """
+        self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.name = name
+        self.fetch_batch = fetch_batch
+        self.window = window
+        self.max_size = max_size
+        self.pending = OrderedDict() # key -> Future
+        self.timer = None
+        self.batches = 0
+        self.lookups = 0
+
+    async def get(self, key):
+        """Look up a key as part of the next batch.
+
+        Returns: The key's value, or None if the batch had no value for it.
+        """
+        self.lookups += 1
+        while True:
+            future = self.pending.get(key)
+            if future is None:
+                future = asyncio.get_event_loop().create_future()
+                self.pending[key] = future
+                if len(self.pending) >= self.max_size:
+                    self.flush()
+                elif self.timer is None:
+                    self.timer = asyncio.get_event_loop().call_later(
+                        self.window,
+                        self.flush
+                    )
+            # Shield the shared future so that one waiter being cancelled
+            # does not cancel the lookup for the others.
+            value = await asyncio.shield(future)
+            if value is not RequestBatcher._RETRY:
+                return value
+
+    def flush(self):
+        """Send the pending keys as a batch now."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, OrderedDict()
+        self.batches += 1
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch):
+        self.logger.debug('Fetching batch of %d from %s', len(batch), self.name)
+        try:
+            values = await self.fetch_batch(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                if not future.done():
+                    future.set_result(RequestBatcher._RETRY)
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Mark the exception as retrieved in case nobody waits
+                    future.exception()
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(values.get(key))
+
+class DeferredTyping():
+    """An async context manager that shows the typing indicator in a channel,
+    but only if the work inside it is still running after a delay.
+
+    Fast responses, e.g. from a cache, then do not spend an API request on
+    the typing indicator.
+    """
+
+    # Number of typing indicators started and skipped
+    started = 0
+    saved = 0
+
+    def __init__(self, channel, delay=None):
+        """Construct a new DeferredTyping.
+
+        Arguments:
+            channel -- The channel to type in.
+            delay -- How long, in seconds, to wait before typing. Defaults to
+                constants.TYPING_DELAY.
+        """
+        self.channel = channel
+        self.delay = delay if delay is not None else constants.TYPING_DELAY
+        self.typing = None
+        self.task = None
+
+    async def __aenter__(self):
+        self.task = asyncio.ensure_future(self._start())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logging.getLogger('dragonbot.' + __name__).warning(
+                'Error starting typing indicator',
+                exc_info=True
+            )
+        if self.typing is not None:
+            await self.typing.__aexit__(exc_type, exc, tb)
+        else:
+            DeferredTyping.saved += 1
+
+    async def _start(self):
+        await asyncio.sleep(self.delay)
+        typing = self.channel.typing()
+        await typing.__aenter__()
+        self.typing = typing
+        DeferredTyping.started += 1
+
+    @classmethod
+    def collect(cls):
+        """Get the number of typing indicators started and skipped as
+        metrics.
+        """
+        return [ metrics.Family(
+            'dragonbot_typing_indicators_total',
+            'counter',
+            'Typing indicators started, or skipped because the response was'
+                ' fast.',
+            [
+                ('', (('result', 'started'),), cls.started),
+                ('', (('result', 'saved'),), cls.saved),
+            ]
+        ) ]
+
+metrics.register('http client', _http_client.collect)
+metrics.register('outbox', _outbox.collect)
+metrics.register('response caches', ResponseCache.collect)
+metrics.register('typing', DeferredTyping.collect)
@@ -1,19 +1,65 @@
 from util import command_method
+import asyncio
 import constants
 import discord
 import logging
 import urllib.parse
 import util
 
+from collections import OrderedDict
+
 WIKI_LONG = 'wikipedia'
 WIKI_SHORT = 'wiki'
 WIKT_LONG = 'wiktionary'
 WIKT_SHORT = 'wikt'
 
+def resolve_titles(titles, pages, normalized, redirects):
+    """Match the pages in a multi-title query's response to the titles that
+    were requested, following title normalization and redirects.
+
+    Arguments:
+        titles -- The requested titles.
+        pages -- The page objects from the response.
+        normalized -- The response's list of {from, to} normalizations.
+        redirects -- The response's list of {from, to} redirects.
+
+    Returns: A dict mapping requested titles to page objects. Titles whose
+    pages are missing or invalid are left out.
+    """
+    by_title = {
+        page['title'] : page for page in pages
+            if 'missing' not in page and 'invalid' not in page
+    }
+    normalized = { n['from'] : n['to'] for n in normalized }
+    redirects = { r['from'] : r['to'] for r in redirects }
+    resolved = {}
+    for title in titles:
+        target = normalized.get(title, title)
+        seen = set()
+        while target in redirects and target not in seen:
+            seen.add(target)
+            target = redirects[target]
+        if target in by_title:
+            resolved[title] = by_title[target]
+    return resolved
+
 class Wikipedia():
 
+    # Gateway intents this module needs; lookups work in guilds and DMs
+    intents = ('guild_messages', 'dm_messages')
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        self.caches = {
+            site : util.ResponseCache(site, *constants.RESPONSE_CACHES[site])
+                for site in (WIKI_LONG, WIKT_LONG)
+        }
+        self.batcher = util.RequestBatcher(
+            WIKI_LONG,
+            self.fetch_wikipedia_batch,
+            constants.WIKI_BATCH_WINDOW,
+            constants.WIKI_BATCH_MAX_TITLES
+        )
 
     def register_commands(self, cd):
         """Register this modules's commands with a CommandDispatcher.
@@ -21,10 +67,8 @@ class Wikipedia():
         Arguments:
             cd -- The CommandDispatcher to register with.
         """
-        cd.register(WIKI_LONG, self.wiki)
-        cd.register(WIKI_SHORT, self.wiki)
-        cd.register(WIKT_LONG, self.wiki)
-        cd.register(WIKT_SHORT, self.wiki)
+        cd.register(WIKI_LONG, self.wiki, aliases=(WIKI_SHORT,))
+        cd.register(WIKT_LONG, self.wiki, aliases=(WIKT_SHORT,))
         self.logger.info('Registered commands')
 
     @staticmethod
@@ -40,57 +84,129 @@ class Wikipedia():
         )
 
     @command_method
-    async def wiki(self, _client, message):
-        command, arg = util.split_command(message)
+    async def wiki(self, _client, message, cmd):
+        command, arg = cmd
+        if arg is None or not arg.strip():
+            await message.channel.send(
+                f'Usage: {constants.COMMAND_PREFIX}{command} <title>'
+            )
+            return
         try:
-            async with message.channel.typing():
+            async with util.DeferredTyping(message.channel):
                 if command in (WIKI_LONG, WIKI_SHORT):
-                    url = self.make_wikipedia_request(arg)
+                    site = WIKI_LONG
                 elif command in (WIKT_LONG, WIKT_SHORT):
-                    url = self.make_wiktionary_request(arg)
+                    site = WIKT_LONG
                 else:
                     await message.channel.send('An error occurred: unknown command')
                     return
 
-                client = await util.get_http_client()
-                rsp = await client.get(url)
-                if 400 <= rsp.status <= 599:
-                    util.log_http_error(self.logger, rsp)
-                    await message.channel.send('An error occurred.')
+                pages = await self.caches[site].get(
+                    arg,
+                    lambda: self.fetch_pages(site, arg)
+                )
+                if not pages:
+                    await message.channel.send(
+                        'No pages with that title found.'
+                    )
                 else:
-                    json = await rsp.json()
-                    if (
-                        'query' not in json
-                        or 'pages' not in json['query']
-                        or len(json['query']['pages']) == 0
-                        or '-1' in json['query']['pages']
-                    ):
+                    for page in pages:
+                        extract = page.get('extract', '')
+                        if site == WIKI_LONG:
+                            extract = extract.replace('\n', '\n\n')
                         await message.channel.send(
-                            'No pages with that title found.'
-                        )
-                    else:
-                        for page in json['query']['pages'].values():
-                            title = page['title']
-                            extract = page['extract']
-                            if command in (WIKI_LONG, WIKI_SHORT):
-                                extract = extract.replace('\n', '\n\n')
-                            url = page['fullurl']
-                            await message.channel.send(
-                                embed=discord.Embed(
-                                    title=title,
-                                    url=url,
-                                    description=util.truncate(
-                                        extract,
-                                        constants.MAX_EMBED_DESC_SIZE
-                                    ),
-                                    color=constants.EMBED_COLOR,
-                                )
+                            embed=discord.Embed(
+                                title=page['title'],
+                                url=page['fullurl'],
+                                description=util.truncate(
+                                    extract,
+                                    constants.MAX_EMBED_DESC_SIZE
+                                ),
+                                color=constants.EMBED_COLOR,
                             )
+                        )
 
+        except util.HTTPStatusError:
+            await message.channel.send('An error occurred.')
+        except util.CircuitOpenError:
+            await message.channel.send(
+                f'{site.capitalize()} is not responding right now. Try again later.'
+            )
         except Exception:
             self.logger.exception('Unknown error')
             await message.channel.send('Unknown error.')
 
+    async def fetch_pages(self, site, query):
+        """Fetch the pages matching a title from Wikipedia or Wiktionary.
+
+        Wikipedia titles are looked up through the batcher, so that
+        concurrent lookups share a request. Wiktionary lookups are not
+        batched, since the API only returns one full-page extract per
+        request.
+
+        Arguments:
+            site -- WIKI_LONG or WIKT_LONG.
+            query -- The title, or several titles separated by '|'.
+
+        Returns: A list of page objects, or None if no pages were found.
+
+        Raises:
+            HTTPStatusError -- If the API responded with an error.
+        """
+        if site == WIKI_LONG:
+            titles = list(OrderedDict.fromkeys(
+                title.strip() for title in query.split('|') if title.strip()
+            ))
+            found = await asyncio.gather(*(
+                self.batcher.get(title) for title in titles
+            ))
+            pages = list({
+                page['pageid'] : page for page in found if page is not None
+            }.values())
+            return pages or None
+
+        url = self.make_wiktionary_request(query)
+        json = await self.query_api(url, upstream=WIKT_LONG)
+        if (
+            'query' not in json
+            or 'pages' not in json['query']
+            or len(json['query']['pages']) == 0
+            or '-1' in json['query']['pages']
+        ):
+            return None
+        return list(json['query']['pages'].values())
+
+    async def fetch_wikipedia_batch(self, titles):
+        """Fetch several Wikipedia pages in one request.
+
+        Arguments:
+            titles -- A list of titles, no longer than the API's limit.
+
+        Returns: A dict mapping each requested title to its page object.
+        Titles without a page are left out.
+
+        Raises:
+            HTTPStatusError -- If the API responded with an error.
+        """
+        json = await self.query_api(
+            self.make_wikipedia_request('|'.join(titles))
+        )
+        query = json.get('query', {})
+        return resolve_titles(
+            titles,
+            query.get('pages', {}).values(),
+            query.get('normalized', []),
+            query.get('redirects', [])
+        )
+
+    async def query_api(self, url, upstream='wikipedia'):
+        client = await util.get_http_client()
+        rsp = await client.get(url, upstream=upstream)
+        if 400 <= rsp.status <= 599:
+            util.log_http_error(self.logger, rsp)
+            raise util.HTTPStatusError(rsp)
+        return await rsp.json()
+
     def make_wikipedia_request(self, query):
         return util.format_url(
             constants.WIKIPEDIA_API_URL,
@@ -100,6 +216,7 @@ class Wikipedia():
                 'prop': 'extracts|info',
                 'inprop': 'url',
                 'exintro': '',
+                'exlimit': 'max',
                 'explaintext': '',
                 'redirects': 1,
                 'titles': query,
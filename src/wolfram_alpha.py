@@ -4,6 +4,8 @@ import io
 import logging
 import urllib
 
+from collections import namedtuple
+
 import config
 import constants
 import util
@@ -12,8 +14,29 @@ from util import command_method
 
 class WolframAlpha():
 
+    Answer = namedtuple('Answer', ['status', 'body'])
+
+    # Gateway intents: queries may come from guilds or direct messages
+    intents = ('guild_messages', 'dm_messages')
+
     def __init__(self):
         self.logger = logging.getLogger('dragonbot.' + __name__)
+        # Queries that were invalid or not understood are negative results.
+        # Images too large to be kept in memory are not cached.
+        negative = lambda answer: answer.status in (400, 501)
+        self.caches = {
+            constants.WOLFRAM_SIMPLE : util.ResponseCache(
+                'wolfram simple',
+                *constants.RESPONSE_CACHES['wolfram simple'],
+                negative=negative,
+                cacheable=lambda answer: not hasattr(answer.body, 'read')
+            ),
+            constants.WOLFRAM_SHORT : util.ResponseCache(
+                'wolfram ask',
+                *constants.RESPONSE_CACHES['wolfram ask'],
+                negative=negative
+            ),
+        }
 
     def register_commands(self, cd):
         """Register this module's commands with a CommandDispatcher.
@@ -41,57 +64,77 @@ class WolframAlpha():
         )
 
     @command_method
-    async def wolfram_alpha(self, _client, message):
-        _command, arg = util.split_command(message)
+    async def wolfram_alpha(self, _client, message, cmd):
+        arg = cmd.argstr
         try:
-            async with message.channel.typing():
-                url    = await self.make_request(arg, constants.WOLFRAM_SIMPLE)
-                client = await util.get_http_client()
-                rsp    = await client.get(url)
-                if rsp.status == 501:
-                    util.log_http_error(self.logger, rsp)
+            async with util.DeferredTyping(message.channel):
+                answer = await self.caches[constants.WOLFRAM_SIMPLE].get(
+                    arg,
+                    lambda: self.query_image(arg)
+                )
+                if answer.status == 501:
                     await message.channel.send(
                         'Wolfram Alpha could not understand your query.'
                     )
-                elif rsp.status == 400:
-                    util.log_http_error(self.logger, rsp)
+                elif answer.status == 400:
                     await message.channel.send('Invalid input.')
-                else:
-                    fp = io.BytesIO(await rsp.read())
+                elif isinstance(answer.body, bytes):
+                    fp = io.BytesIO(answer.body)
                     image = discord.File(fp=fp, filename='query.png')
                     await message.channel.send(file=image)
+                else:
+                    try:
+                        image = discord.File(fp=answer.body, filename='query.png')
+                        await message.channel.send(file=image)
+                    finally:
+                        answer.body.close()
+        except util.HTTPStatusError as e:
+            self.logger.warning('Error querying Wolfram Alpha: %s', e)
+            await message.channel.send('An error occurred.')
+        except util.DownloadError as e:
+            self.logger.warning('Rejected Wolfram Alpha image: %s', e)
+            await message.channel.send('The result was too large to send.')
+        except util.CircuitOpenError:
+            await message.channel.send(
+                'Wolfram Alpha is not responding right now. Try again later.'
+            )
         except Exception:
             self.logger.exception('Unknown error')
             await message.channel.send('Unknown error.')
 
     @command_method
-    async def ask(self, _client, message):
-        _command, arg = util.split_command(message)
+    async def ask(self, _client, message, cmd):
+        arg = cmd.argstr
         if arg is None:
             await message.channel.send('What is your question?')
             return
         try:
-            async with message.channel.typing():
-                url    = await self.make_request(arg, constants.WOLFRAM_SHORT)
-                client = await util.get_http_client()
-                rsp    = await client.get(url)
-                text   = await rsp.text()
+            async with util.DeferredTyping(message.channel):
+                answer = await self.caches[constants.WOLFRAM_SHORT].get(
+                    arg,
+                    lambda: self.query(arg, constants.WOLFRAM_SHORT)
+                )
+                text = answer.body
                 if text:
                     text = text.replace('Wolfram|Alpha', 'DragonBot')
                     text = text.replace('Wolfram Alpha', 'DragonBot')
-                if rsp.status == 501:
-                    util.log_http_error(self.logger, rsp)
+                if answer.status == 501:
                     if text:
                         await message.channel.send(text)
                     else:
                         await message.channel.send(
                             "I don't know how to answer that."
                         )
-                elif rsp.status == 400:
-                    util.log_http_error(self.logger, rsp)
+                elif answer.status == 400:
                     await message.channel.send('Invalid input.')
                 else:
                     await message.channel.send(text)
+        except util.HTTPStatusError:
+            await message.channel.send('An error occurred.')
+        except util.CircuitOpenError:
+            await message.channel.send(
+                'Wolfram Alpha is not responding right now. Try again later.'
+            )
         except aiohttp.ClientResponseError:
             self.logger.exception('Error reading response body')
             await message.channel.send('Error getting response')
@@ -99,6 +142,64 @@ class WolframAlpha():
             self.logger.exception('Unknown error')
             await message.channel.send('Unknown error.')
 
+    async def query_image(self, query):
+        """Query the Wolfram Alpha simple API, which answers with an image.
+
+        The image is streamed with a size limit. If it is small enough to
+        have been kept in memory, the Answer's body is the image as bytes;
+        otherwise it is a file object, which the caller must close.
+        Statuses 400 and 501 are returned with no body, so that they can be
+        cached as in query().
+
+        Returns: An Answer.
+
+        Raises:
+            HTTPStatusError -- If the API responded with any other error.
+            DownloadError -- If the image was too large or not an image.
+        """
+        url    = await self.make_request(query, constants.WOLFRAM_SIMPLE)
+        client = await util.get_http_client()
+        try:
+            fp = await client.download(
+                url,
+                upstream='wolfram',
+                max_size=constants.MAX_WOLFRAM_IMAGE_SIZE,
+                content_types=('image/',)
+            )
+        except util.HTTPStatusError as e:
+            if e.status in (400, 501):
+                self.logger.warning('Error querying Wolfram Alpha: %s', e)
+                return WolframAlpha.Answer(status=e.status, body=None)
+            raise
+        if isinstance(fp, io.BytesIO):
+            return WolframAlpha.Answer(status=200, body=fp.getvalue())
+        return WolframAlpha.Answer(status=200, body=fp)
+
+    async def query(self, query, api):
+        """Make a query to one of the Wolfram Alpha APIs.
+
+        Statuses 400 and 501 mean the query was invalid or not understood;
+        they are returned rather than raised so that they can be cached.
+
+        Arguments:
+            query -- The query string.
+            api -- The API to use, WOLFRAM_SIMPLE or WOLFRAM_SHORT.
+
+        Returns: An Answer.
+
+        Raises:
+            HTTPStatusError -- If the API responded with any other error.
+        """
+        url    = await self.make_request(query, api)
+        client = await util.get_http_client()
+        rsp    = await client.get(url, upstream='wolfram')
+        if rsp.status in (400, 501):
+            util.log_http_error(self.logger, rsp)
+        elif 400 <= rsp.status <= 599:
+            util.log_http_error(self.logger, rsp)
+            raise util.HTTPStatusError(rsp)
+        return WolframAlpha.Answer(status=rsp.status, body=await rsp.text())
+
     async def make_request(self, query, api):
         if api == constants.WOLFRAM_SHORT:
             query_params = urllib.parse.urlencode({
@@ -1,8 +1,5 @@
 #!/usr/bin/env bash
 
-echo "Starting health service"
-pipenv run python -O src/health.py &
+# Health checks are served by the bot itself
 echo "Starting bot"
-pipenv run python -O src/dragonbot.py &
-
-wait
+exec pipenv run python -O src/dragonbot.py
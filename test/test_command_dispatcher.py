@@ -0,0 +1,58 @@
+import unittest
+
+from unittest.mock import Mock, sentinel
+from utils import async_test
+
+from command_dispatcher import CommandDispatcher
+
+class TestCommandDispatcher(unittest.TestCase):
+
+    def test_register_aliases(self):
+        cd = CommandDispatcher()
+        cd.register('roll', sentinel.roll, aliases=('r',))
+        self.assertIs(cd.lookup('roll'), cd.lookup('r'))
+        self.assertEqual(cd.lookup('r').name, 'roll')
+        self.assertEqual(set(cd.known_command_names()), { 'roll', 'r' })
+
+    def test_duplicate_alias(self):
+        cd = CommandDispatcher()
+        cd.register('roll', sentinel.roll)
+        with self.assertRaises(CommandDispatcher.DuplicateCommand):
+            cd.register('reroll', sentinel.reroll, aliases=('roll',))
+        self.assertFalse(cd.is_registered('reroll'))
+
+    def test_lookup_unknown(self):
+        cd = CommandDispatcher()
+        self.assertIsNone(cd.lookup('unknown'))
+
+    @async_test
+    async def test_dispatch(self):
+        calls = []
+        async def func(client, message, cmd):
+            calls.append((client, message, cmd))
+        cd = CommandDispatcher()
+        cd.register('test', func, aliases=('t',))
+        await cd.dispatch(sentinel.client, 't', sentinel.message, sentinel.cmd)
+        self.assertEqual(
+            calls,
+            [ (sentinel.client, sentinel.message, sentinel.cmd) ]
+        )
+        with self.assertRaises(CommandDispatcher.UnknownCommand):
+            await cd.dispatch(sentinel.client, 'unknown', sentinel.message)
+
+    @async_test
+    async def test_invoke_permissions(self):
+        async def func(_client, _message, _cmd):
+            pass
+        message = Mock()
+        message.author.id = 2
+        cd = CommandDispatcher(read_only=True)
+        cd.register('owner', func, may_use={ 1 })
+        cd.register('write', func, rw=True)
+        with self.assertRaises(CommandDispatcher.PermissionDenied):
+            await cd.invoke(sentinel.client, cd.lookup('owner'), message)
+        with self.assertRaises(CommandDispatcher.WriteDenied):
+            await cd.invoke(sentinel.client, cd.lookup('write'), message)
+
+if __name__ == "__main__":
+    unittest.main()
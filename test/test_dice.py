@@ -0,0 +1,111 @@
+import unittest
+
+from unittest.mock import patch
+
+import dice
+
+from dice import BinaryOp, Constant, Group, Negate, Roll
+
+class TestDice(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(
+            dice.parse('4d6k3 - 2*(d4+1)'),
+            BinaryOp(
+                '-',
+                Roll(4, 6, ('h', 3), False),
+                BinaryOp(
+                    '*',
+                    Constant(2),
+                    Group(BinaryOp('+', Roll(1, 4, None, False), Constant(1)))
+                )
+            )
+        )
+        self.assertEqual(dice.parse('-3d6!kl1'), Negate(Roll(3, 6, ('l', 1), True)))
+
+    def test_parse_errors(self):
+        for expr in ('', '1d', 'foo', '(1d6', '1d6 2', '1d1!'):
+            with self.assertRaises(ValueError):
+                dice.parse(expr)
+        with self.assertRaises(ValueError):
+            dice.parse(f'{dice.max_dice_rolls() + 1}d6')
+
+    def test_canonical(self):
+        self.assertEqual(dice.canonical(dice.parse('D20 +4d6K3')), '1d20 + 4d6kh3')
+
+    def test_keep(self):
+        with patch('dice.roll_pool', return_value=[2, 5, 1, 4]):
+            self.assertEqual(
+                dice.evaluate(dice.parse('4d6kh3')),
+                ('[2 + 5 + ~~1~~ + 4]', 11)
+            )
+            self.assertEqual(
+                dice.evaluate(dice.parse('4d6kl1 + 1')),
+                ('[~~2~~ + ~~5~~ + 1 + ~~4~~] + 1', 2)
+            )
+
+    @patch('dice.numpy', None)
+    def test_explode(self):
+        with patch('dice.roll_dice', side_effect=[[6, 2], [6], [3]]):
+            self.assertEqual(
+                list(dice.roll_pool(Roll(2, 6, None, True))),
+                [6, 2, 6, 3]
+            )
+
+    def test_large_pool_summary(self):
+        text, total = dice.evaluate(dice.parse('100000d6kl10'))
+        self.assertTrue(text.startswith('[100000d6kl10: kept 10 of 100000 dice'))
+        self.assertEqual(total, 10)
+
+    def probabilities(self, expr):
+        d = dice.distribution(dice.parse(expr))
+        return {
+            d.offset + i : p for i, p in enumerate(d.pmf) if p > 0
+        }
+
+    def test_distribution(self):
+        two_d6 = self.probabilities('2d6')
+        self.assertAlmostEqual(two_d6[7], 6 / 36)
+        self.assertAlmostEqual(two_d6[12], 1 / 36)
+        self.assertEqual(min(two_d6), 2)
+        self.assertEqual(max(two_d6), 12)
+
+        self.assertEqual(
+            set(self.probabilities('2 * 1d4 - 1')),
+            { 1, 3, 5, 7 }
+        )
+
+    def test_large_distribution(self):
+        # Large enough to use FFT convolution
+        d = dice.distribution(dice.parse('1000d6'))
+        self.assertEqual((d.offset, len(d.pmf)), (1000, 5001))
+        self.assertAlmostEqual(d.pmf.sum(), 1)
+        self.assertAlmostEqual(d.pmf[2500], d.pmf.max())
+
+    def test_keep_distribution(self):
+        highest = self.probabilities('2d6kh1')
+        self.assertAlmostEqual(highest[6], 11 / 36)
+        self.assertAlmostEqual(highest[1], 1 / 36)
+        lowest = self.probabilities('2d6kl1')
+        self.assertAlmostEqual(lowest[1], 11 / 36)
+        best_three = self.probabilities('4d6kh3')
+        self.assertAlmostEqual(best_three[18], 21 / 1296)
+        self.assertAlmostEqual(best_three[3], 1 / 1296)
+
+    def test_large_keep_distribution(self):
+        # Binomial coefficients of pools this large overflow floats
+        highest = self.probabilities('2000d2kh1')
+        self.assertLessEqual(set(highest), { 1, 2 })
+        self.assertAlmostEqual(highest[2], 1)
+        lowest = dice.distribution(dice.parse('1100d2kl1'))
+        self.assertAlmostEqual(lowest.pmf.sum(), 1)
+        self.assertEqual(lowest.offset, 1)
+
+    def test_exploding_distribution(self):
+        exploding = self.probabilities('1d6!')
+        self.assertNotIn(6, exploding)
+        self.assertAlmostEqual(exploding[5], 1 / 6)
+        self.assertAlmostEqual(exploding[8], 1 / 36)
+
+if __name__ == "__main__":
+    unittest.main()
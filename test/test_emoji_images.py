@@ -0,0 +1,120 @@
+import concurrent.futures
+import io
+import os
+import unittest
+from unittest.mock import patch
+
+from utils import async_test
+
+import emoji_images
+
+# Limits small enough that test images stay quick to transcode
+MAX_SIZE = 64 * 1024
+MAX_DIMENSION = 128
+MAX_PIXELS = 1000 * 1000
+
+def noise_image(size, mode='RGB'):
+    # Random pixels compress badly, so the image is large for its size
+    return emoji_images.Image.frombytes(
+        mode,
+        size,
+        os.urandom(size[0] * size[1] * len(mode))
+    )
+
+def png(image):
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+def animated_gif(size, frames):
+    images = [ noise_image(size).convert('P') for _ in range(frames) ]
+    out = io.BytesIO()
+    images[0].save(
+        out,
+        format='GIF',
+        save_all=True,
+        append_images=images[1:],
+        duration=50,
+        loop=0
+    )
+    return out.getvalue()
+
+@unittest.skipUnless(emoji_images.can_transcode(), 'Pillow is not installed')
+class TestFitToSize(unittest.TestCase):
+
+    def test_large_png(self):
+        data = png(noise_image((512, 512)))
+        self.assertGreater(len(data), MAX_SIZE)
+        result = emoji_images.fit_to_size(
+            data,
+            MAX_SIZE,
+            MAX_DIMENSION,
+            MAX_PIXELS
+        )
+        self.assertLessEqual(len(result), MAX_SIZE)
+        with emoji_images.Image.open(io.BytesIO(result)) as image:
+            self.assertEqual(image.format, 'PNG')
+            self.assertLessEqual(max(image.size), MAX_DIMENSION)
+
+    def test_animated_gif(self):
+        data = animated_gif((256, 256), 4)
+        self.assertGreater(len(data), MAX_SIZE)
+        result = emoji_images.fit_to_size(
+            data,
+            MAX_SIZE,
+            MAX_DIMENSION,
+            MAX_PIXELS
+        )
+        self.assertLessEqual(len(result), MAX_SIZE)
+        with emoji_images.Image.open(io.BytesIO(result)) as image:
+            self.assertEqual(image.format, 'GIF')
+            self.assertTrue(image.is_animated)
+            self.assertEqual(image.n_frames, 4)
+
+    def test_too_many_pixels(self):
+        # 1.3 million pixels over all frames
+        data = animated_gif((256, 256), 20)
+        with self.assertRaises(ValueError):
+            emoji_images.fit_to_size(data, MAX_SIZE, MAX_DIMENSION, MAX_PIXELS)
+
+    def test_undecodable(self):
+        with self.assertRaises(OSError):
+            emoji_images.fit_to_size(
+                b'not an image',
+                MAX_SIZE,
+                MAX_DIMENSION,
+                MAX_PIXELS
+            )
+
+@unittest.skipUnless(emoji_images.can_transcode(), 'Pillow is not installed')
+class TestEmojiImages(unittest.TestCase):
+
+    def setUp(self):
+        self.images = emoji_images.EmojiImages()
+        self.images.cache.clear()
+        # Threads rather than processes keep the tests fast
+        self.images.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.addCleanup(self.images.shutdown)
+
+    @async_test
+    async def test_small_image_unchanged(self):
+        data = png(noise_image((32, 32)))
+        with patch('emoji_images.fit_to_size') as fit_to_size:
+            self.assertIs(await self.images.fit(data), data)
+        fit_to_size.assert_not_called()
+
+    @async_test
+    async def test_cache_hit(self):
+        data = png(noise_image((512, 512)))
+        with patch(
+            'emoji_images.fit_to_size',
+            wraps=emoji_images.fit_to_size
+        ) as fit_to_size:
+            first = await self.images.fit(data)
+            second = await self.images.fit(data)
+        self.assertEqual(fit_to_size.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertLessEqual(len(first), emoji_images.constants.MAX_EMOJI_SIZE)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -79,6 +79,7 @@ class TestEmotes(unittest.TestCase):
         e = Emotes()
         client, msg = create_command_mocks()
         msg.guild.id = sentinel.server_id
+        msg.content = '!refreshemotes'
         storage = mock(FileStorage)
         e.add_server(msg.guild, storage)
 
@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+
+from utils import async_test
+
+import constants
+from health import Health
+
+class FakeWebSocket():
+    open = True
+
+class FakeClient():
+
+    def __init__(self, ready=True, closed=False, latency=0.1):
+        self.ready = ready
+        self.closed = closed
+        self.latency = latency
+        self.ws = FakeWebSocket() if ready else None
+
+    def is_ready(self):
+        return self.ready
+
+    def is_closed(self):
+        return self.closed
+
+class FakeLoopMonitor():
+
+    def __init__(self, lag=0.01):
+        self.lag = lag
+
+    def current_lag(self):
+        return self.lag
+
+class TestHealth(unittest.TestCase):
+
+    def test_liveness(self):
+        client = FakeClient()
+        health = Health(client, FakeLoopMonitor())
+        self.assertEqual(health.liveness(), (True, 'Healthy'))
+        client.ws = None
+        with mock.patch('time.monotonic', return_value=1000):
+            self.assertEqual(health.liveness(), (True, 'Reconnecting'))
+        later = 1001 + constants.HEALTH_GATEWAY_GRACE
+        with mock.patch('time.monotonic', return_value=later):
+            alive, _ = health.liveness()
+            self.assertFalse(alive)
+        self.assertEqual(
+            Health(FakeClient(ready=False), FakeLoopMonitor()).liveness(),
+            (True, 'Starting')
+        )
+        client.closed = True
+        self.assertFalse(health.liveness()[0])
+
+    @async_test
+    async def test_readiness(self):
+        with mock.patch('storage.check_backend', return_value='file'), \
+                mock.patch('storage.unsaved_changes', return_value=3):
+            ready, checks = await Health(
+                FakeClient(),
+                FakeLoopMonitor()
+            ).readiness()
+            self.assertTrue(ready)
+            self.assertEqual(checks['storage']['detail'], 'file')
+            self.assertEqual(checks['pending writes']['detail'], 3)
+
+            ready, checks = await Health(
+                FakeClient(latency=float('inf')),
+                FakeLoopMonitor(lag=constants.HEALTH_MAX_LOOP_LAG * 2)
+            ).readiness()
+            self.assertFalse(ready)
+            self.assertFalse(checks['heartbeat latency']['ok'])
+            self.assertFalse(checks['event loop lag']['ok'])
+            self.assertTrue(checks['gateway']['ok'])
+
+        with mock.patch('storage.check_backend', side_effect=OSError('gone')):
+            ready, checks = await Health(
+                FakeClient(),
+                FakeLoopMonitor()
+            ).readiness()
+            self.assertFalse(ready)
+            self.assertEqual(checks['storage']['detail'], 'gone')
+
+if __name__ == "__main__":
+    unittest.main()
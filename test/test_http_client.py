@@ -0,0 +1,150 @@
+import asyncio
+import unittest
+
+from types import SimpleNamespace
+from unittest.mock import patch
+from utils import async_test
+
+import http_client
+
+from http_client import CircuitBreaker, CircuitOpenError, HTTPClient
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def make_breaker(self):
+        return CircuitBreaker(
+            'test',
+            failure_threshold=2,
+            slow_call=1,
+            reset_timeout=10
+        )
+
+    @patch('http_client.time.monotonic', return_value=0)
+    def test_opens_after_failures(self, _monotonic):
+        breaker = self.make_breaker()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.trips, 1)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    @patch('http_client.time.monotonic', return_value=0)
+    def test_success_resets_failures(self, _monotonic):
+        breaker = self.make_breaker()
+        breaker.record_failure()
+        breaker.record_success(0.1)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @patch('http_client.time.monotonic', return_value=0)
+    def test_slow_calls_count_as_failures(self, _monotonic):
+        breaker = self.make_breaker()
+        breaker.record_success(2)
+        breaker.record_success(2)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    @patch('http_client.time.monotonic', return_value=0)
+    def test_slow_call_follows_timeout(self, _monotonic):
+        with patch.dict(
+            http_client.constants.HTTP_TIMEOUTS,
+            { 'fast' : 4, 'slow' : 20 }
+        ):
+            fast = CircuitBreaker('fast', failure_threshold=1)
+            slow = CircuitBreaker('slow', failure_threshold=1)
+        fast.record_success(3)
+        slow.record_success(3)
+        self.assertEqual(fast.state, CircuitBreaker.OPEN)
+        self.assertEqual(slow.state, CircuitBreaker.CLOSED)
+
+    @patch('http_client.time.monotonic')
+    def test_half_open_probe(self, monotonic):
+        breaker = self.make_breaker()
+        monotonic.return_value = 0
+        breaker.record_failure()
+        breaker.record_failure()
+
+        monotonic.return_value = 10
+        breaker.before_call()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        monotonic.return_value = 20
+        breaker.before_call()
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.trips, 2)
+
+class TestHTTPClient(unittest.TestCase):
+
+    @async_test
+    async def test_retries_error_statuses(self):
+        client = HTTPClient()
+        responses = [ SimpleNamespace(status=503), SimpleNamespace(status=200) ]
+
+        async def fake_get_once(url, upstream, **kwargs):
+            return responses.pop(0)
+
+        with patch.object(client, '_get_once', fake_get_once), \
+                patch.object(HTTPClient, '_backoff', return_value=0):
+            rsp = await client.get('http://example.com', upstream='wikipedia')
+        self.assertEqual(rsp.status, 200)
+        self.assertEqual(client.stats['retries'], 1)
+        self.assertEqual(client.breakers['wikipedia'].failures, 0)
+
+    @async_test
+    async def test_hedges_slow_requests(self):
+        client = HTTPClient()
+        client.latencies['wikipedia'].extend(
+            [ 0.001 ] * http_client.constants.HTTP_HEDGE_MIN_SAMPLES
+        )
+        calls = []
+
+        async def fake_get_once(url, upstream, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+            return SimpleNamespace(status=200)
+
+        with patch.object(client, '_get_once', fake_get_once):
+            rsp = await client.get('http://example.com', upstream='wikipedia')
+        self.assertEqual(rsp.status, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(client.stats['hedged requests'], 1)
+        self.assertEqual(client.stats['hedged requests won'], 1)
+
+    @async_test
+    async def test_cancelling_hedged_get_cancels_request(self):
+        client = HTTPClient()
+        client.latencies['wikipedia'].extend(
+            [ 1 ] * http_client.constants.HTTP_HEDGE_MIN_SAMPLES
+        )
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def fake_get_once(url, upstream, **kwargs):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with patch.object(client, '_get_once', fake_get_once):
+            get = asyncio.ensure_future(
+                client.get('http://example.com', upstream='wikipedia')
+            )
+            await started.wait()
+            # Cancelled before the hedge delay is up
+            get.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await get
+        await asyncio.sleep(0)
+        self.assertTrue(cancelled.is_set())
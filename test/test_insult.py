@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from unittest.mock import patch
+from utils import async_test
+
+import insult
+
+from insult import InsultPool, NAME_PLACEHOLDER
+
+async def fake_fetch_insult(who=None):
+    await asyncio.sleep(0)
+    if who:
+        return f'{who} is a dummy'
+    return 'You are a dummy'
+
+class TestInsultPool(unittest.TestCase):
+
+    def test_take_empty(self):
+        pool = InsultPool(size=2, low_water=1)
+        self.assertIsNone(pool.take())
+        self.assertIsNone(pool.take(who='Someone'))
+
+    def test_take_templated(self):
+        pool = InsultPool(size=2, low_water=1)
+        pool.templated.append(f'{NAME_PLACEHOLDER} is a dummy')
+        self.assertEqual(pool.take(who='Someone'), 'Someone is a dummy')
+        self.assertIsNone(pool.take(who='Someone'))
+
+    @async_test
+    async def test_refill(self):
+        pool = InsultPool(size=3, low_water=2)
+        with patch.object(insult, 'fetch_insult', fake_fetch_insult):
+            pool.start()
+            for _ in range(20):
+                await asyncio.sleep(0)
+            self.assertEqual(len(pool.generic), 3)
+            self.assertEqual(len(pool.templated), 3)
+
+            self.assertEqual(pool.take(), 'You are a dummy')
+            self.assertEqual(pool.take(who='Bob'), 'Bob is a dummy')
+            self.assertEqual(pool.take(who='Bob'), 'Bob is a dummy')
+            # Below the low-water mark, so the pool is refilled
+            for _ in range(20):
+                await asyncio.sleep(0)
+            self.assertEqual(len(pool.templated), 3)
+            await pool.stop()
+
+if __name__ == "__main__":
+    unittest.main()
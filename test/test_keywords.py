@@ -0,0 +1,49 @@
+import unittest
+
+from unittest.mock import AsyncMock, Mock, patch
+from utils import async_test
+
+from keywords import Keywords
+
+class FakeStorage(dict):
+
+    @property
+    def data(self):
+        return self
+
+    def touch(self):
+        pass
+
+    def save(self):
+        pass
+
+def make_message(content):
+    message = Mock()
+    message.guild.id = 1
+    message.clean_content = content
+    message.add_reaction = AsyncMock()
+    return message
+
+class TestKeywords(unittest.TestCase):
+
+    @async_test
+    async def test_concurrent_gets(self):
+        keywords = Keywords()
+        keywords.add_server(
+            Mock(id=1),
+            FakeStorage(dragon={ 'reactions' : [], 'count' : 20 })
+        )
+        first = make_message('a dragon')
+        second = make_message('another dragon')
+        # Both messages are counted before either reacts
+        found_first = keywords.count_keywords_in(first)
+        found_second = keywords.count_keywords_in(second)
+        self.assertEqual(found_first, [('dragon', 21)])
+        self.assertEqual(found_second, [('dragon', 22)])
+        with patch('keywords.util.queue_message') as queue_message:
+            await keywords.react_to_keywords(None, first, found_first)
+            await keywords.react_to_keywords(None, second, found_second)
+        queue_message.assert_called_once_with(second.channel, 'dragon #22')
+
+if __name__ == "__main__":
+    unittest.main()
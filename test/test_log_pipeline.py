@@ -0,0 +1,53 @@
+import logging
+import unittest
+
+from unittest.mock import patch
+
+import log_pipeline
+
+from log_pipeline import RateLimitFilter, SamplingFilter
+
+def make_record(level=logging.INFO, lineno=1):
+    return logging.LogRecord(
+        'test', level, 'test.py', lineno, 'Message %d', (1,), None
+    )
+
+class TestLogPipeline(unittest.TestCase):
+
+    @patch('log_pipeline.time.monotonic', return_value=0)
+    def test_rate_limit(self, monotonic):
+        rate_limit = RateLimitFilter(rate=1, burst=2)
+        results = [ rate_limit.filter(make_record()) for _ in range(4) ]
+        self.assertEqual(results, [True, True, False, False])
+        # Other call sites and warnings are not limited
+        self.assertTrue(rate_limit.filter(make_record(lineno=2)))
+        self.assertTrue(rate_limit.filter(make_record(logging.WARNING)))
+
+        monotonic.return_value = 1
+        record = make_record()
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(
+            record.getMessage(),
+            'Message 1 (2 similar messages suppressed)'
+        )
+        self.assertEqual(rate_limit.suppressed, 2)
+
+    def test_sampling(self):
+        sampler = SamplingFilter(0.5)
+        with patch('log_pipeline.random.random', side_effect=[0.2, 0.7]):
+            self.assertTrue(sampler.filter(make_record()))
+            self.assertFalse(sampler.filter(make_record()))
+        self.assertTrue(sampler.filter(make_record(logging.ERROR)))
+        self.assertEqual(sampler.sampled_out, 1)
+
+    def test_only_hot_path_rate_limited(self):
+        hot = log_pipeline.hot_path_logger('test')
+        log_pipeline.hot_path_logger('test') # Filters are not added twice
+        self.assertEqual(
+            hot.filters,
+            [ log_pipeline.hot_path_sampler, log_pipeline.hot_path_rate_limit ]
+        )
+        self.assertEqual(logging.getLogger('test').filters, [])
+
+if __name__ == "__main__":
+    unittest.main()
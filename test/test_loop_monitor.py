@@ -0,0 +1,40 @@
+import asyncio
+import time
+import unittest
+
+from utils import async_test
+
+from loop_monitor import LagHistogram, LoopMonitor
+
+def block_the_loop():
+    time.sleep(0.3)
+
+class TestLoopMonitor(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = LagHistogram(bounds=(0.01, 0.1, 1))
+        for value in (0.001, 0.002, 0.05, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.percentile(0.4), 0.01)
+        self.assertEqual(histogram.percentile(0.6), 0.1)
+        self.assertEqual(histogram.percentile(1), 3)
+        self.assertIsNone(LagHistogram().percentile(0.5))
+
+    @async_test
+    async def test_captures_blocking_stack(self):
+        monitor = LoopMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            block_the_loop()
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+        self.assertEqual(monitor.stall_count, 1)
+        self.assertIn('block_the_loop', monitor.stalls[0].stack)
+        self.assertGreaterEqual(monitor.histogram.max, 0.2)
+        self.assertIn('block_the_loop', monitor.dump())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from utils import async_test
+
+from metrics import Family, Registry
+from status_server import StatusServer
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_total', 'A "test".\nTwo lines.')
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.get(), 3)
+        self.assertIs(self.registry.counter('test_total', ''), counter)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('test_total', '')
+        self.assertEqual(
+            self.registry.render(),
+            '# HELP test_total A "test".\\nTwo lines.\n'
+            '# TYPE test_total counter\n'
+            'test_total 3\n'
+        )
+
+    def test_labels(self):
+        gauge = self.registry.gauge('queue', 'Queued.', labels=('channel',))
+        gauge.labels('a "b"').set(1.5)
+        gauge.labels('c').set_function(lambda: 7)
+        with self.assertRaises(ValueError):
+            gauge.labels()
+        self.assertIn('queue{channel="a \\"b\\""} 1.5\n', self.registry.render())
+        self.assertIn('queue{channel="c"} 7\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('lag', 'Lag.', bounds=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(histogram.default.percentile(0.5), 0.1)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'lag_bucket{le="0.1"} 2',
+            'lag_bucket{le="1"} 3',
+            'lag_bucket{le="+Inf"} 4',
+            'lag_sum 2.65',
+            'lag_count 4',
+        ])
+
+    def test_collector(self):
+        self.registry.register('test', lambda: [ Family(
+            'collected', 'gauge', 'Collected.', [ ('', (('k', 'v'),), 1) ]
+        ) ])
+        self.assertIn('collected{k="v"} 1\n', self.registry.render())
+
+    @async_test
+    async def test_server(self):
+        self.registry.counter('served_total', 'Served.').inc()
+        server = StatusServer(port=0, registry=self.registry)
+        response = await server.handle_metrics(None)
+        self.assertEqual(response.content_type, 'text/plain')
+        self.assertIn(b'served_total 1\n', response.body)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from utils import async_test
+
+from outbox import Outbox
+
+class FakeChannel():
+
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    async def send(self, content):
+        await asyncio.sleep(0)
+        self.log.append((self.name, content))
+        return content
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+
+    @async_test
+    async def test_merges_messages(self):
+        outbox = Outbox(max_characters=10, workers=1)
+        channel = FakeChannel('a', self.log)
+        futures = [ outbox.send(channel, text) for text in ('one', 'two', 'three') ]
+        results = await asyncio.gather(*futures)
+        await outbox.close()
+        self.assertEqual(self.log, [('a', 'one\ntwo'), ('a', 'three')])
+        self.assertEqual(results, ['one\ntwo', 'one\ntwo', 'three'])
+        self.assertEqual(outbox.stats['merged'], 1)
+        self.assertEqual(outbox.depth(), 0)
+
+    @async_test
+    async def test_splits_long_messages(self):
+        outbox = Outbox(max_characters=4, workers=1)
+        channel = FakeChannel('a', self.log)
+        await outbox.send(channel, 'abcdefghij')
+        await outbox.close()
+        self.assertEqual(
+            self.log,
+            [('a', 'abcd'), ('a', 'efgh'), ('a', 'ij')]
+        )
+
+    @async_test
+    async def test_splits_between_lines(self):
+        outbox = Outbox(max_characters=12, workers=1)
+        channel = FakeChannel('a', self.log)
+        listing = 'shrug: ok\nwave: hello\ntoolongtofitinone\nhi'
+        await outbox.send(channel, listing)
+        await outbox.close()
+        self.assertEqual(
+            self.log,
+            [
+                ('a', 'shrug: ok'),
+                ('a', 'wave: hello'),
+                ('a', 'toolongtofit'),
+                ('a', 'inone\nhi'),
+            ]
+        )
+
+    @async_test
+    async def test_round_robin(self):
+        outbox = Outbox(max_characters=3, workers=1)
+        a = FakeChannel('a', self.log)
+        b = FakeChannel('b', self.log)
+        futures = [ outbox.send(a, text) for text in ('a1', 'a2', 'a3') ]
+        futures.append(outbox.send(b, 'b1'))
+        await asyncio.gather(*futures)
+        await outbox.close()
+        self.assertEqual(
+            self.log,
+            [('a', 'a1'), ('b', 'b1'), ('a', 'a2'), ('a', 'a3')]
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from utils import async_test
+
+import config
+import shards
+from storage import FileStorage
+
+class FakeShardedClient():
+
+    def __init__(self, shard_ids, shard_count):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.guilds = []
+        self.latencies = [ (shard_id, 0.1) for shard_id in shard_ids ]
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(
+            config,
+            'storage_dir',
+            self.storage_dir.name,
+            create=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.storage_dir.cleanup)
+
+    def test_shard_ids(self):
+        self.assertEqual(shards.parse_shard_ids('0-3, 6,2'), [0, 1, 2, 3, 6])
+        self.assertEqual(shards.format_shard_ids([6, 0, 1, 2, 3, 8]), '0-3,6,8')
+        for invalid in ('', 'a', '3-1', '-1'):
+            with self.assertRaises(ValueError):
+                shards.parse_shard_ids(invalid)
+        shards.validate([0, 1], 4)
+        shards.validate(None, None)
+        with self.assertRaises(ValueError):
+            shards.validate([4], 4)
+        with self.assertRaises(ValueError):
+            shards.validate([0], None)
+
+    @async_test
+    async def test_totals(self):
+        first = shards.ShardStats(
+            FakeShardedClient([0, 1], 4),
+            lambda: { 'messages' : 3, 'guilds' : 2 }
+        )
+        second = shards.ShardStats(
+            FakeShardedClient([2, 3], 4),
+            lambda: { 'messages' : 4, 'guilds' : 1 }
+        )
+        stopped = shards.ShardStats(FakeShardedClient([0], 1), lambda: {})
+        with mock.patch('time.time', return_value=time.time() - 3600):
+            shards.storage.publish_shard_stats(stopped.key(), stopped.current())
+        shards.storage.publish_shard_stats(second.key(), second.current())
+
+        totals, processes = await first.totals()
+        self.assertEqual(totals, { 'messages' : 7, 'guilds' : 3 })
+        self.assertEqual(processes, ['0-1 of 4', '2-3 of 4'])
+
+    def test_file_storage(self):
+        with mock.patch('atexit.register'):
+            store = FileStorage('keywords', 1)
+            store['a'] = 1
+            store.save()
+            other = FileStorage('keywords', 1)
+        self.assertEqual(dict(other), { 'a' : 1 })
+        self.assertEqual(
+            os.listdir(os.path.join(self.storage_dir.name, '1')),
+            ['keywords.json']
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+import traffic
+
+def make_message(content, guild_id=10, author_id=20, mentions=()):
+    message = Mock()
+    message.content = content
+    message.guild.id = guild_id
+    message.channel.id = 30
+    message.author.id = author_id
+    message.author.bot = False
+    message.mentions = [ Mock(id=user_id) for user_id in mentions ]
+    message.attachments = []
+    return message
+
+class TestTraffic(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'messages.jsonl.gz')
+
+    def test_anonymize(self):
+        recorder = traffic.MessageRecorder(self.path)
+        self.addCleanup(recorder.close)
+        keep = recorder._record_guild(1, {}) # No keywords
+        self.assertIsNone(keep)
+
+        roll = recorder.anonymize('!roll 4d6kh3 + 2 for Secret')
+        self.assertTrue(roll.startswith('!roll 4d6kh3 + 2 '))
+        self.assertNotIn('Secret', roll)
+        self.assertEqual(len(roll), len('!roll 4d6kh3 + 2 for Secret'))
+        # The same word is always replaced the same way
+        self.assertEqual(
+            recorder.anonymize('hello there'),
+            recorder.anonymize('Hello there').lower()
+        )
+        mention = recorder.anonymize('<@!123456789> and <#987654321>')
+        self.assertNotIn('123456789', mention)
+        self.assertRegex(mention, r'^<@!\d+> [a-z]{3} <#\d+>$')
+
+    def test_record_and_read(self):
+        recorder = traffic.MessageRecorder(
+            self.path,
+            guild_info=lambda guild: {
+                'keywords' : [ 'good morning' ],
+                'emotes' : [ 'shrug' ],
+            }
+        )
+        recorder.record(make_message('Good morning, secret world'))
+        recorder.record(make_message('@shrug', author_id=21, mentions=(20,)))
+        recorder.close()
+
+        guild, first, second = traffic.read_log(self.path)
+        self.assertEqual(guild['keywords'], [ 'good morning' ])
+        self.assertEqual(guild['guild'], first['g'])
+        self.assertTrue(first['m'].startswith('Good morning, '))
+        self.assertNotIn('secret', first['m'])
+        self.assertEqual(second['m'], '@shrug')
+        self.assertEqual(second['mentions'], [ first['a'] ])
+        self.assertNotEqual(second['a'], first['a'])
+
+    def test_not_a_log(self):
+        path = os.path.join(self.directory.name, 'other.jsonl')
+        with open(path, 'w') as fh:
+            fh.write('{"t":0}\n')
+        with self.assertRaises(ValueError):
+            list(traffic.read_log(path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
+import asyncio
 import unittest
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+from utils import async_test
 
 import util
 
@@ -27,6 +29,17 @@ class TestUtil(unittest.TestCase):
         msg.content = '!test foo bar'
         self.assertEqual(util.split_command(msg), ('test', 'foo bar'))
 
+    def test_parse_command(self):
+        msg = Mock()
+
+        msg.content = '!test'
+        self.assertEqual(util.parse_command(msg), ('test', None))
+
+        msg.content = '!test foo bar'
+        cmd = util.parse_command(msg)
+        self.assertEqual(cmd.name, 'test')
+        self.assertEqual(cmd.argstr, 'foo bar')
+
     def test_truncate(self):
         self.assertEqual(
             util.truncate('abcdefghijklmnopqrstuvwxyz', 5),
@@ -67,5 +80,193 @@ class TestUtil(unittest.TestCase):
             util.format_url('https://example.com', { 'foo': 'bar', 'baz': 'bat' })
         )
 
+    def test_lazy_import(self):
+        self.assertIsNone(util.lazy_import('no_such_module'))
+        self.assertIsNone(util.lazy_import('no_such_package.module'))
+        with patch.dict('sys.modules'):
+            module = util.lazy_import('colorsys')
+            self.assertEqual(module.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fetches = 0
+
+    async def fetch(self, value):
+        self.fetches += 1
+        await asyncio.sleep(0)
+        return value
+
+    @async_test
+    async def test_hit(self):
+        cache = util.ResponseCache('test hit', 10, 60, 10)
+        self.assertEqual(await cache.get('a', lambda: self.fetch(1)), 1)
+        self.assertEqual(await cache.get('a', lambda: self.fetch(2)), 1)
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    @async_test
+    async def test_lru_eviction(self):
+        cache = util.ResponseCache('test lru', 2, 60, 10)
+        await cache.get('a', lambda: self.fetch('a'))
+        await cache.get('b', lambda: self.fetch('b'))
+        await cache.get('a', lambda: self.fetch('a'))
+        await cache.get('c', lambda: self.fetch('c'))
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+    @async_test
+    async def test_expiry(self):
+        cache = util.ResponseCache('test expiry', 10, 60, 10)
+        with patch('util.time.monotonic', return_value=0):
+            await cache.get('found', lambda: self.fetch('value'))
+            await cache.get('missing', lambda: self.fetch(None))
+        with patch('util.time.monotonic', return_value=30):
+            await cache.get('found', lambda: self.fetch('value'))
+            await cache.get('missing', lambda: self.fetch(None))
+        # Only the negative result should have expired
+        self.assertEqual(self.fetches, 3)
+
+    @async_test
+    async def test_single_flight(self):
+        cache = util.ResponseCache('test single flight', 10, 60, 10)
+        results = await asyncio.gather(*(
+            cache.get('a', lambda: self.fetch('value')) for _ in range(5)
+        ))
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(cache.coalesced, 4)
+
+    @async_test
+    async def test_uncacheable(self):
+        cache = util.ResponseCache(
+            'test uncacheable', 10, 60, 10,
+            cacheable=lambda value: value != 'big'
+        )
+        results = await asyncio.gather(*(
+            cache.get('a', lambda: self.fetch('big')) for _ in range(3)
+        ))
+        self.assertEqual(results, ['big'] * 3)
+        # Not shared with the coalesced lookups and not stored
+        self.assertEqual(self.fetches, 3)
+        self.assertEqual(len(cache), 0)
+
+    @async_test
+    async def test_errors_not_cached(self):
+        cache = util.ResponseCache('test errors', 10, 60, 10)
+        async def fail():
+            raise ValueError('upstream error')
+        with self.assertRaises(ValueError):
+            await cache.get('a', fail)
+        self.assertEqual(await cache.get('a', lambda: self.fetch(1)), 1)
+
+    @async_test
+    async def test_owner_cancelled(self):
+        cache = util.ResponseCache('test owner cancelled', 10, 60, 10)
+        started = asyncio.Event()
+        async def slow_fetch():
+            started.set()
+            await asyncio.sleep(10)
+        owner = asyncio.ensure_future(cache.get('a', slow_fetch))
+        await started.wait()
+        waiter = asyncio.ensure_future(cache.get('a', lambda: self.fetch(1)))
+        await asyncio.sleep(0)
+        owner.cancel()
+        # The waiter was not cancelled, so it fetches for itself
+        self.assertEqual(await waiter, 1)
+        self.assertEqual(self.fetches, 1)
+
+class TestRequestBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    async def fetch_batch(self, keys):
+        self.batches.append(keys)
+        return { key : key.upper() for key in keys if key != 'missing' }
+
+    @async_test
+    async def test_batches_concurrent_lookups(self):
+        batcher = util.RequestBatcher('test', self.fetch_batch, 0.01, 10)
+        results = await asyncio.gather(
+            batcher.get('a'),
+            batcher.get('b'),
+            batcher.get('a'),
+            batcher.get('missing'),
+        )
+        self.assertEqual(results, ['A', 'B', 'A', None])
+        self.assertEqual(self.batches, [['a', 'b', 'missing']])
+
+    @async_test
+    async def test_max_size(self):
+        batcher = util.RequestBatcher('test', self.fetch_batch, 10, 2)
+        results = await asyncio.gather(*(
+            batcher.get(key) for key in ('a', 'b', 'c', 'd')
+        ))
+        self.assertEqual(results, ['A', 'B', 'C', 'D'])
+        self.assertEqual(self.batches, [['a', 'b'], ['c', 'd']])
+
+    @async_test
+    async def test_errors(self):
+        async def fail(keys):
+            raise ValueError('upstream error')
+        batcher = util.RequestBatcher('test', fail, 0.01, 10)
+        results = await asyncio.gather(
+            batcher.get('a'),
+            batcher.get('b'),
+            return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    @async_test
+    async def test_batch_cancelled(self):
+        fetches = []
+        async def fetch_batch(keys):
+            fetches.append(asyncio.current_task())
+            if len(fetches) == 1:
+                await asyncio.sleep(10)
+            return await self.fetch_batch(keys)
+        batcher = util.RequestBatcher('test', fetch_batch, 0, 10)
+        lookup = asyncio.ensure_future(batcher.get('a'))
+        while not fetches:
+            await asyncio.sleep(0)
+        fetches[0].cancel()
+        # The key is requested again in a new batch
+        self.assertEqual(await lookup, 'A')
+        self.assertEqual(self.batches, [['a']])
+
+class FakeTyping():
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def __aenter__(self):
+        self.channel.typing_started += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.channel.typing_stopped += 1
+
+class TestDeferredTyping(unittest.TestCase):
+
+    def setUp(self):
+        self.channel = Mock()
+        self.channel.typing_started = 0
+        self.channel.typing_stopped = 0
+        self.channel.typing = lambda: FakeTyping(self.channel)
+
+    @async_test
+    async def test_fast_work_skips_typing(self):
+        saved = util.DeferredTyping.saved
+        async with util.DeferredTyping(self.channel, delay=0.05):
+            pass
+        self.assertEqual(self.channel.typing_started, 0)
+        self.assertEqual(util.DeferredTyping.saved, saved + 1)
+
+    @async_test
+    async def test_slow_work_types(self):
+        async with util.DeferredTyping(self.channel, delay=0):
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.channel.typing_started, 1)
+        self.assertEqual(self.channel.typing_stopped, 1)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from unittest.mock import AsyncMock, Mock
+from utils import async_test
+
+import util
+
+from wikipedia import Wikipedia, resolve_titles
+
+class TestWikipedia(unittest.TestCase):
+
+    def test_resolve_titles(self):
+        pages = [
+            { 'pageid' : 1, 'title' : 'Dragon' },
+            { 'pageid' : 2, 'title' : 'United States' },
+            { 'ns' : 0, 'title' : 'Nonexistent', 'missing' : '' },
+        ]
+        normalized = [ { 'from' : 'dragon', 'to' : 'Dragon' } ]
+        redirects = [
+            { 'from' : 'USA', 'to' : 'United States of America' },
+            { 'from' : 'United States of America', 'to' : 'United States' },
+        ]
+        resolved = resolve_titles(
+            ['dragon', 'USA', 'Nonexistent', 'Dragon'],
+            pages,
+            normalized,
+            redirects
+        )
+        self.assertEqual(resolved['dragon']['pageid'], 1)
+        self.assertEqual(resolved['Dragon']['pageid'], 1)
+        self.assertEqual(resolved['USA']['pageid'], 2)
+        self.assertNotIn('Nonexistent', resolved)
+
+    @async_test
+    async def test_wiki_without_title(self):
+        message = Mock()
+        message.channel.send = AsyncMock()
+        for arg in (None, '  '):
+            await Wikipedia().wiki(Mock(), message, util.ParsedCommand('wiki', arg))
+            message.channel.send.assert_awaited_with('Usage: !wiki <title>')
+
+if __name__ == "__main__":
+    unittest.main()
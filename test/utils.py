@@ -8,7 +8,10 @@ from mockito import mock
 def async_test(coro):
     def wrapper(*args, **kwargs):
         loop = asyncio.new_event_loop()
-        return loop.run_until_complete(coro(*args, **kwargs))
+        try:
+            return loop.run_until_complete(coro(*args, **kwargs))
+        finally:
+            loop.close()
     return wrapper
 
 def create_command_mocks():